@@ -0,0 +1,52 @@
+"""
+Кодирование событий для Kafka. KAFKA_EVENT_FORMAT=protobuf (по умолчанию) — сообщения events.proto
+в топиках с суффиксом _v2, json — JSON в исходных топиках для потребителей, не перешедших на protobuf.
+Событие — словарь с полями сообщения: время — datetime с часовым поясом. Каждое событие получает
+event_id, по которому потребители отбрасывают повторы; время передаётся с миллисекундами (в protobuf —
+секундное поле и поле *_ms).
+"""
+import calendar
+import datetime
+import json
+import os
+import uuid
+
+import events_pb2
+from google.protobuf.descriptor import FieldDescriptor
+
+EVENT_FORMAT = os.getenv("KAFKA_EVENT_FORMAT", "protobuf")
+PROTOBUF_TOPIC_SUFFIX = "_v2"
+
+MESSAGES = {
+    "user_registrations": events_pb2.UserRegistration,
+}
+
+
+def event_topic(topic):
+    return topic + PROTOBUF_TOPIC_SUFFIX if EVENT_FORMAT == "protobuf" else topic
+
+
+def encode_event(topic, event):
+    event = {"event_id": str(uuid.uuid4()), **event}
+    if EVENT_FORMAT != "protobuf":
+        return json.dumps(event, default=lambda value: value.isoformat(timespec="milliseconds")).encode('utf-8')
+    message = MESSAGES[topic]
+    fields = message.DESCRIPTOR.fields_by_name
+    values = {}
+    for name, value in event.items():
+        if isinstance(value, datetime.datetime):
+            values[name + "_ms"] = epoch_millis(value)
+            values[name] = values[name + "_ms"] // 1000
+        else:
+            values[name] = to_field(fields[name], value)
+    return message(**values).SerializeToString()
+
+
+def epoch_millis(value):
+    return calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+
+
+def to_field(field, value):
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return uuid.UUID(value).bytes
+    return value
@@ -1,4 +1,9 @@
+import asyncio
+import json
+import logging
 import os
+import threading
+import time
 
 import grpc
 import httpx
@@ -6,14 +11,20 @@ import posts_pb2
 import posts_pb2_grpc
 import stats_pb2
 import stats_pb2_grpc
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from .auth import create_jwt_token, verify_jwt_token
+from .events import encode_event, event_topic
+from .live import LIVE_KEEPALIVE_INTERVAL, PostStatsHub
+from .live_comments import CommentFeed, SubscriptionClosed, TooManySubscribers
 from .schemas import (RegisterRequest, LoginRequest, ProfileUpdateRequest,
                       UpdatePostRequest, CreatePostRequest, CommentIn)
 from kafka import KafkaProducer
-import json
+from kafka.errors import KafkaError, NoBrokersAvailable
+from grpc_health.v1 import health_pb2, health_pb2_grpc
 from datetime import datetime, timezone
 
 router = APIRouter()
@@ -23,22 +34,137 @@ USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user_service:8001")
 POSTS_SERVICE_ADDRESS = os.getenv("POSTS_SERVICE_ADDRESS", "posts_service:50051")
 STATS_SERVICE_ADDRESS = os.getenv("STATS_SERVICE_ADDRESS", "stats_service:50050")
 
-producer = KafkaProducer(
-    bootstrap_servers=['kafka:9092'],
-    value_serializer=lambda v: json.dumps(v).encode('utf-8')
-)
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092").split(",")
+KAFKA_RECONNECT_BACKOFF = float(os.getenv("KAFKA_RECONNECT_BACKOFF", "5"))
+# Сколько send() ждёт метаданных топика или места в буфере, пока брокер недоступен
+KAFKA_MAX_BLOCK_MS = int(os.getenv("KAFKA_MAX_BLOCK_MS", "1000"))
+# Повтор отправки может записать событие в топик дважды; ClickHouse отбрасывает его по event_id
+# до сырых таблиц и счётчиков (stats_clickhouse/init/03_materialized_views.sql)
+KAFKA_PRODUCER_RETRIES = int(os.getenv("KAFKA_PRODUCER_RETRIES", "5"))
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "1"))
+# Публичные счётчики и рейтинги — в приближённом режиме stats_service (uniqCombined, topK)
+STATS_APPROXIMATE = os.getenv("STATS_APPROXIMATE", "true").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+# Producer и gRPC-каналы создаются при первом обращении, а не при импорте:
+# приложение стартует, даже если Kafka или сервисы ещё недоступны.
+producer = None
+_producer_lock = threading.Lock()
+_producer_failed_at = float("-inf")
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def get_producer():
+    global producer, _producer_failed_at
+    if producer is not None:
+        return producer
+    with _producer_lock:
+        if producer is None:
+            if time.monotonic() - _producer_failed_at < KAFKA_RECONNECT_BACKOFF:
+                raise NoBrokersAvailable()
+            try:
+                producer = KafkaProducer(
+                    bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+                    key_serializer=lambda k: k.encode('utf-8'),
+                    acks='all',
+                    retries=KAFKA_PRODUCER_RETRIES,
+                    max_block_ms=KAFKA_MAX_BLOCK_MS
+                )
+            except KafkaError:
+                _producer_failed_at = time.monotonic()
+                raise
+    return producer
+
+
+def send_event(topic, value, key):
+    """
+    Отправка события в Kafka; недоступность брокера не ломает основной запрос. key задаёт партицию.
+    Без flush(): доставку ведёт фоновый поток producer'а. Из async-обработчиков вызывается через
+    run_in_threadpool — создание producer'а и send() могут ждать брокер.
+    """
+    try:
+        kafka_producer = get_producer()
+        kafka_producer.send(event_topic(topic), encode_event(topic, value), key=key)
+    except KafkaError as e:
+        logger.warning("Failed to send event to %s: %s", topic, e)
+
+
+def get_channel(address):
+    channel = _channels.get(address)
+    if channel is None:
+        with _channels_lock:
+            channel = _channels.get(address)
+            if channel is None:
+                channel = grpc.insecure_channel(address)
+                _channels[address] = channel
+    return channel
+
+
+def close_clients():
+    global producer
+    live_stats.close()
+    with _producer_lock:
+        if producer is not None:
+            producer.close()
+            producer = None
+    with _channels_lock:
+        for channel in _channels.values():
+            channel.close()
+        _channels.clear()
 
 
 def get_posts_stub():
-    channel = grpc.insecure_channel(POSTS_SERVICE_ADDRESS)
-    stub = posts_pb2_grpc.PostServiceStub(channel)
-    return stub
+    return posts_pb2_grpc.PostServiceStub(get_channel(POSTS_SERVICE_ADDRESS))
 
 
 def get_stats_stub():
-    channel = grpc.insecure_channel(STATS_SERVICE_ADDRESS)
-    stub = stats_pb2_grpc.StatsServiceStub(channel)
-    return stub
+    return stats_pb2_grpc.StatsServiceStub(get_channel(STATS_SERVICE_ADDRESS))
+
+
+def open_stats_stream(post_id):
+    return get_stats_stub().StreamPostStats(stats_pb2.PostStatsRequest(post_id=post_id))
+
+
+# Одна подписка StreamPostStats на пост для всех SSE-клиентов
+live_stats = PostStatsHub(open_stats_stream)
+# Один консьюмер топиков комментариев на процесс для всех WebSocket- и SSE-клиентов
+live_comments = CommentFeed()
+
+
+def kafka_ready():
+    try:
+        return get_producer().bootstrap_connected()
+    except KafkaError:
+        return False
+
+
+def grpc_service_ready(address):
+    stub = health_pb2_grpc.HealthStub(get_channel(address))
+    try:
+        response = stub.Check(health_pb2.HealthCheckRequest(), timeout=READINESS_TIMEOUT)
+    except grpc.RpcError as e:
+        # Сервис без health-сервиса, но с живым каналом считаем готовым
+        return e.code() == grpc.StatusCode.UNIMPLEMENTED
+    return response.status == health_pb2.HealthCheckResponse.SERVING
+
+
+@router.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def ready():
+    checks = {
+        "kafka": kafka_ready(),
+        "posts_service": grpc_service_ready(POSTS_SERVICE_ADDRESS),
+        "stats_service": grpc_service_ready(STATS_SERVICE_ADDRESS),
+    }
+    status_code = 200 if all(checks.values()) else 503
+    return JSONResponse(status_code=status_code, content=checks)
 
 
 @router.post("/register", status_code=201)
@@ -49,12 +175,11 @@ async def register_user(req: RegisterRequest):
         if response.status_code != 201:
             raise HTTPException(status_code=response.status_code, detail=response.text)
         result = response.json()
-        producer.send('user_registrations', {
+        await run_in_threadpool(send_event, 'user_registrations', {
             'user_id': result['user_id'],
             'username': req.username,
-            'registered_at': datetime.now(timezone.utc).isoformat()
-        })
-        producer.flush()
+            'registered_at': datetime.now(timezone.utc)
+        }, key=str(result['user_id']))
         return result
 
 
@@ -249,8 +374,32 @@ async def delete_post(post_id: str, credentials: HTTPAuthorizationCredentials =
     return {"detail": response.message}
 
 
+def stats_counters(stats):
+    return {
+        "views": stats.views,
+        "likes": stats.likes,
+        "comments": stats.comments,
+        "unique_viewers": stats.unique_viewers,
+        "unique_likers": stats.unique_likers,
+        "unique_commenters": stats.unique_commenters,
+    }
+
+
+def posts_stats(post_ids):
+    """Счётчики для страницы постов одним запросом к stats_service; при ошибке — None, лента отдаётся без них."""
+    if not post_ids:
+        return {}
+    try:
+        response = get_stats_stub().GetPostsStats(stats_pb2.PostsStatsRequest(post_ids=post_ids,
+                                                                              approximate=STATS_APPROXIMATE))
+    except grpc.RpcError as e:
+        logger.warning("Failed to load stats for %d posts: %s", len(post_ids), e)
+        return None
+    return {stats.post_id: stats_counters(stats) for stats in response.stats}
+
+
 @router.get("/posts")
-async def list_posts(page: int = 0, page_size: int = 10,
+async def list_posts(page: int = 0, page_size: int = 10, include: str = "",
                      credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
     verify_jwt_token(credentials.credentials)
     stub = get_posts_stub()
@@ -272,6 +421,10 @@ async def list_posts(page: int = 0, page_size: int = 10,
             "is_private": post.is_private,
             "tags": list(post.tags)
         })
+    if "stats" in include.split(","):
+        stats = posts_stats([post["id"] for post in posts_list])
+        for post in posts_list:
+            post["stats"] = stats.get(post["id"]) if stats is not None else None
     return posts_list
 
 
@@ -330,6 +483,87 @@ async def create_comment(post_id: str, body: CommentIn,
     }
 
 
+def websocket_user(websocket, token):
+    """user_id из заголовка Authorization или параметра token: браузерный WebSocket не задаёт заголовки."""
+    header = websocket.headers.get("authorization", "")
+    if header.lower().startswith("bearer "):
+        token = header[len("bearer "):]
+    return verify_jwt_token(token).get("sub")
+
+
+async def wait_disconnect(websocket, subscriber):
+    # клиент ничего не присылает: чтение нужно, чтобы сразу узнать о закрытом соединении
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    except RuntimeError:
+        # соединение уже закрыто сервером
+        pass
+    subscriber.close("disconnected")
+
+
+@router.websocket("/posts/{post_id}/comments/ws")
+async def comments_websocket(websocket: WebSocket, post_id: str, token: str = ""):
+    try:
+        user_id = websocket_user(websocket, token)
+        # GetPost синхронный: в цикле событий он остановил бы все живые подключения
+        await run_in_threadpool(is_allowed_to_get_post, post_id, user_id)
+    except HTTPException as e:
+        # до accept: клиент получает отказ в рукопожатии
+        logger.info("Live comments for post %s rejected: %s", post_id, e.detail)
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        subscriber = live_comments.subscribe(post_id)
+    except TooManySubscribers:
+        await websocket.close(code=1013)
+        return
+    watcher = asyncio.create_task(wait_disconnect(websocket, subscriber))
+    try:
+        while True:
+            await websocket.send_json(await subscriber.get(None))
+    except SubscriptionClosed as e:
+        if str(e) != "disconnected":
+            # 1013 — повторить позже: клиент переподключается и дочитывает пропущенное через GET
+            await websocket.close(code=1013, reason=str(e))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        live_comments.unsubscribe(subscriber)
+
+
+async def comment_events(post_id):
+    try:
+        subscriber = live_comments.subscribe(post_id)
+    except TooManySubscribers:
+        return
+    try:
+        while True:
+            comment = await subscriber.get(LIVE_KEEPALIVE_INTERVAL)
+            if comment is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: comment\ndata: {json.dumps(comment)}\n\n"
+    except SubscriptionClosed:
+        # поток заканчивается, EventSource переподключится сам
+        return
+    finally:
+        live_comments.unsubscribe(subscriber)
+
+
+@router.get("/posts/{post_id}/comments/live")
+async def stream_comments(post_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    payload = verify_jwt_token(credentials.credentials)
+    user_id = payload.get("sub")
+    await run_in_threadpool(is_allowed_to_get_post, post_id, user_id)
+    if live_comments.count >= live_comments.max_subscribers:
+        raise HTTPException(status_code=503, detail="Too many live subscribers")
+    return StreamingResponse(comment_events(post_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @router.get("/posts/{post_id}/comments")
 async def list_comments(
         post_id: str,
@@ -393,15 +627,25 @@ async def get_post_stats(post_id: str, credentials: HTTPAuthorizationCredentials
     if not is_allowed_to_get_post(post_id, user_id):
         return {}
     try:
-        resp = stub.GetPostStats(stats_pb2.PostStatsRequest(post_id=post_id), metadata=(('current_user', user_id),))
+        resp = stub.GetPostStats(stats_pb2.PostStatsRequest(post_id=post_id, approximate=STATS_APPROXIMATE),
+                                 metadata=(('current_user', user_id),))
     except grpc.RpcError as e:
         detail = e.details() if hasattr(e, 'details') else str(e)
         raise HTTPException(status_code=500, detail=detail)
-    return {
-        'views': resp.views,
-        'likes': resp.likes,
-        'comments': resp.comments
-    }
+    return stats_counters(resp)
+
+
+@router.get("/posts/{post_id}/stats/live")
+async def stream_post_stats(post_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    payload = verify_jwt_token(credentials.credentials)
+    user_id = payload.get("sub")
+    if not await run_in_threadpool(is_allowed_to_get_post, post_id, user_id):
+        return {}
+    if not live_stats.accepts(post_id):
+        raise HTTPException(status_code=503, detail="Too many live posts")
+    # доступ проверяется при подключении, дальше — только счётчики из общей подписки поста
+    return StreamingResponse(live_stats.events(post_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @router.get("/posts/{post_id}/views/history")
@@ -449,23 +693,123 @@ async def get_recent_comments_by_minute(post_id: str, credentials: HTTPAuthoriza
         raise HTTPException(status_code=500, detail=str(e))
     return [{"minute": d.date, "count": d.stat} for d in resp.history]
 
-@router.get("/top/posts")
-async def get_top_posts(sort_by: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
-    param_map = {"views": stats_pb2.VIEWS, "likes": stats_pb2.LIKES, "comments": stats_pb2.COMMENTS}
-    if sort_by not in param_map:
+HISTORY_METRICS = {"views": stats_pb2.VIEWS, "likes": stats_pb2.LIKES, "comments": stats_pb2.COMMENTS}
+HISTORY_GRANULARITIES = {"minute": stats_pb2.MINUTE, "hour": stats_pb2.HOUR, "day": stats_pb2.DAY,
+                         "week": stats_pb2.WEEK, "month": stats_pb2.MONTH}
+
+
+@router.get("/posts/{post_id}/history")
+async def get_post_history(post_id: str, metric: str, granularity: str = "day",
+                           from_time: str = Query("", alias="from"), to_time: str = Query("", alias="to"),
+                           credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    if metric not in HISTORY_METRICS:
+        raise HTTPException(status_code=400, detail="Invalid metric value")
+    if granularity not in HISTORY_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Invalid granularity value")
+    payload = verify_jwt_token(credentials.credentials)
+    user_id = payload.get("sub")
+    if not is_allowed_to_get_post(post_id, user_id):
+        return {}
+    try:
+        resp = get_stats_stub().GetPostHistory(stats_pb2.PostHistoryRequest(
+            post_id=post_id, metric=HISTORY_METRICS[metric], granularity=HISTORY_GRANULARITIES[granularity],
+            from_time=from_time, to_time=to_time
+        ))
+    except grpc.RpcError as e:
+        detail = e.details() if hasattr(e, 'details') else str(e)
+        if hasattr(e, 'code') and e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            raise HTTPException(status_code=400, detail=detail)
+        raise HTTPException(status_code=500, detail=detail)
+    # counts[i] — интервал start + i * bucket_seconds (для month — i календарных месяцев)
+    return {
+        "start": resp.start,
+        "bucket_seconds": resp.bucket_seconds,
+        "counts": list(resp.counts),
+    }
+
+
+@router.get("/posts/{post_id}/metrics/history")
+async def get_post_metrics_history(post_id: str, granularity: str = "day",
+                                   from_time: str = Query("", alias="from"), to_time: str = Query("", alias="to"),
+                                   credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    if granularity not in HISTORY_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Invalid granularity value")
+    payload = verify_jwt_token(credentials.credentials)
+    user_id = payload.get("sub")
+    if not is_allowed_to_get_post(post_id, user_id):
+        return {}
+    try:
+        resp = get_stats_stub().GetPostMetricsHistory(stats_pb2.PostHistoryRequest(
+            post_id=post_id, granularity=HISTORY_GRANULARITIES[granularity], from_time=from_time, to_time=to_time
+        ))
+    except grpc.RpcError as e:
+        detail = e.details() if hasattr(e, 'details') else str(e)
+        if hasattr(e, 'code') and e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            raise HTTPException(status_code=400, detail=detail)
+        raise HTTPException(status_code=500, detail=detail)
+    # одна проверка доступа и один запрос к ClickHouse на все графики поста
+    return {
+        "start": resp.start,
+        "bucket_seconds": resp.bucket_seconds,
+        "views": list(resp.views),
+        "likes": list(resp.likes),
+        "comments": list(resp.comments),
+    }
+
+
+@router.get("/posts/{post_id}/metrics/recent")
+async def get_post_recent_activity(post_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    payload = verify_jwt_token(credentials.credentials)
+    user_id = payload.get("sub")
+    if not is_allowed_to_get_post(post_id, user_id):
+        return {}
+    try:
+        resp = get_stats_stub().GetPostRecentActivity(stats_pb2.PostStatsRequest(post_id=post_id))
+    except grpc.RpcError as e:
+        detail = e.details() if hasattr(e, 'details') else str(e)
+        raise HTTPException(status_code=500, detail=detail)
+    # по минутам за STATS_RECENT_MINUTES минут и текущую; stats_service отвечает из памяти, без ClickHouse
+    return {
+        "start": resp.start,
+        "bucket_seconds": resp.bucket_seconds,
+        "views": list(resp.views),
+        "likes": list(resp.likes),
+        "comments": list(resp.comments),
+    }
+
+
+TOP_SORT_PARAMS = {"views": stats_pb2.VIEWS, "likes": stats_pb2.LIKES, "comments": stats_pb2.COMMENTS}
+TOP_WINDOWS = {"all": stats_pb2.ALL_TIME, "hour": stats_pb2.LAST_HOUR,
+               "day": stats_pb2.LAST_DAY, "week": stats_pb2.LAST_WEEK}
+MAX_TOP_LIMIT = 1000
+
+
+def top_request_params(sort_by, limit, window):
+    if sort_by not in TOP_SORT_PARAMS:
         raise HTTPException(status_code=400, detail="Invalid sort_by value")
+    if window not in TOP_WINDOWS:
+        raise HTTPException(status_code=400, detail="Invalid window value")
+    if not 1 <= limit <= MAX_TOP_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_TOP_LIMIT}")
+    return {"param": TOP_SORT_PARAMS[sort_by], "limit": limit, "window": TOP_WINDOWS[window],
+            "approximate": STATS_APPROXIMATE}
+
+
+@router.get("/top/posts")
+async def get_top_posts(sort_by: str, limit: int = 10, window: str = "all",
+                        credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    params = top_request_params(sort_by, limit, window)
     payload = verify_jwt_token(credentials.credentials)
     stub = get_stats_stub()
-    resp = stub.GetTopTenPosts(stats_pb2.TopTenPostsRequest(param=param_map[sort_by]))
+    resp = stub.GetTopTenPosts(stats_pb2.TopTenPostsRequest(**params))
     return {"post_ids": list(resp.post_ids)}
 
 
 @router.get("/top/users")
-async def get_top_users(sort_by: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
-    param_map = {"views": stats_pb2.VIEWS, "likes": stats_pb2.LIKES, "comments": stats_pb2.COMMENTS}
-    if sort_by not in param_map:
-        raise HTTPException(status_code=400, detail="Invalid sort_by value")
+async def get_top_users(sort_by: str, limit: int = 10, window: str = "all",
+                        credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    params = top_request_params(sort_by, limit, window)
     payload = verify_jwt_token(credentials.credentials)
     stub = get_stats_stub()
-    resp = stub.GetTopTenUsers(stats_pb2.TopTenUsersRequest(param=param_map[sort_by]))
+    resp = stub.GetTopTenUsers(stats_pb2.TopTenUsersRequest(**params))
     return {"user_ids": list(resp.user_ids)}
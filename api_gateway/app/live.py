@@ -0,0 +1,154 @@
+"""
+Живые счётчики постов для Server-Sent Events. На пост, который смотрит хотя бы один клиент, открыта
+одна подписка StreamPostStats в stats_service: её читает отдельный поток (клиент gRPC синхронный) и
+передаёт сообщения в цикл событий, где к счётчикам прибавляются прибавки. Каждому клиенту отдаётся
+последнее состояние: очередь клиента на одно значение, медленный клиент пропускает промежуточные.
+Когда уходит последний клиент поста, подписка закрывается. Постов с подписками не больше LIVE_MAX_CHANNELS:
+каждому нужен поток Gateway и подписка stats_service, которая сама ограничена STATS_MAX_STREAMS.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+import grpc
+
+from .live_comments import canonical_post_id
+
+LIVE_MAX_CHANNELS = int(os.getenv("LIVE_MAX_CHANNELS", "1000"))
+LIVE_RECONNECT_BACKOFF = float(os.getenv("LIVE_RECONNECT_BACKOFF", "1"))
+# Комментарий SSE раз в столько секунд без обновлений, чтобы прокси не закрывали соединение
+LIVE_KEEPALIVE_INTERVAL = float(os.getenv("LIVE_KEEPALIVE_INTERVAL", "15"))
+
+logger = logging.getLogger(__name__)
+
+
+class TooManyChannels(Exception):
+    pass
+
+
+def offer(queue, item):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+class PostChannel:
+    def __init__(self, post_id):
+        self.post_id = post_id
+        self.stats = None
+        self.clients = set()
+        self.closed = False
+        self._call = None
+        self._lock = threading.Lock()
+
+    def attach(self, call):
+        """Запоминает вызов StreamPostStats; False — канал уже закрыт, вызов отменён."""
+        with self._lock:
+            self._call = call
+            closed = self.closed
+        if closed:
+            call.cancel()
+        return not closed
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            call = self._call
+        if call is not None:
+            call.cancel()
+
+    def apply(self, update):
+        """Сообщение PostStatsUpdate; вызывается в цикле событий."""
+        if update.snapshot:
+            self.stats = {"views": update.views, "likes": update.likes, "comments": update.comments}
+        elif self.stats is not None:
+            self.stats = {"views": self.stats["views"] + update.views,
+                          "likes": self.stats["likes"] + update.likes,
+                          "comments": self.stats["comments"] + update.comments}
+        else:
+            return
+        for queue in self.clients:
+            offer(queue, self.stats)
+
+
+class PostStatsHub:
+    def __init__(self, open_stream, backoff=LIVE_RECONNECT_BACKOFF, max_channels=LIVE_MAX_CHANNELS):
+        # post_id -> вызов StreamPostStats: итератор PostStatsUpdate с cancel()
+        self.open_stream = open_stream
+        self.backoff = backoff
+        self.max_channels = max_channels
+        self.channels = {}
+
+    def accepts(self, post_id):
+        """Хватит ли места для клиента поста: к открытой подписке клиенты добавляются без ограничения."""
+        return canonical_post_id(post_id) in self.channels or len(self.channels) < self.max_channels
+
+    def subscribe(self, post_id):
+        post_id = canonical_post_id(post_id)
+        channel = self.channels.get(post_id)
+        if channel is None:
+            if len(self.channels) >= self.max_channels:
+                raise TooManyChannels(f"At most {self.max_channels} live posts")
+            channel = self.channels[post_id] = PostChannel(post_id)
+            threading.Thread(target=self._read, args=(channel, asyncio.get_running_loop()), daemon=True).start()
+        queue = asyncio.Queue(maxsize=1)
+        channel.clients.add(queue)
+        if channel.stats is not None:
+            offer(queue, channel.stats)
+        return channel, queue
+
+    def unsubscribe(self, channel, queue):
+        channel.clients.discard(queue)
+        if not channel.clients:
+            if self.channels.get(channel.post_id) is channel:
+                del self.channels[channel.post_id]
+            channel.close()
+
+    def _read(self, channel, loop):
+        while not channel.closed:
+            call = None
+            try:
+                call = self.open_stream(channel.post_id)
+                if not channel.attach(call):
+                    return
+                for update in call:
+                    loop.call_soon_threadsafe(channel.apply, update)
+            except grpc.RpcError as e:
+                if channel.closed:
+                    return
+                logger.warning("Stats stream for post %s failed: %s", channel.post_id, e)
+            except Exception:
+                if channel.closed or loop.is_closed():
+                    # цикл событий закрыт: приложение останавливается
+                    return
+                # поток не должен завершаться, пока канал открыт: иначе счётчики поста замрут у всех клиентов
+                logger.exception("Stats stream for post %s failed", channel.post_id)
+                if call is not None:
+                    call.cancel()
+            time.sleep(self.backoff)
+
+    async def events(self, post_id, keepalive=LIVE_KEEPALIVE_INTERVAL):
+        """Поток SSE: счётчики поста при каждом изменении."""
+        try:
+            channel, queue = self.subscribe(post_id)
+        except TooManyChannels:
+            # место заняли после проверки в обработчике: поток заканчивается, EventSource переподключится
+            return
+        try:
+            while True:
+                try:
+                    stats = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(stats)}\n\n"
+        finally:
+            self.unsubscribe(channel, queue)
+
+    def close(self):
+        for channel in list(self.channels.values()):
+            channel.close()
+        self.channels.clear()
@@ -0,0 +1,219 @@
+"""
+Новые комментарии постов по WebSocket и SSE. Процесс Gateway читает топики комментариев одним
+консьюмером без группы (каждому процессу нужны все комментарии) с конца: история отдаётся
+GET /posts/{id}/comments, здесь — только то, что написано после подключения. Консьюмер работает в
+своём потоке (kafka-python блокирующий) и передаёт пачки комментариев в цикл событий, где они
+раскладываются по подписчикам поста.
+
+Доступ к посту проверяется при подписке. У каждого подключения очередь на LIVE_COMMENTS_QUEUE_SIZE
+комментариев; если клиент не успевает их забирать, очередь не растёт — подключение закрывается,
+и клиент переподключается, дочитав пропущенное через GET /posts/{id}/comments. Повторно
+доставленные комментарии (повторы отправки у продюсера) отбрасываются по id.
+"""
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import events_pb2
+from google.protobuf.message import DecodeError
+from kafka import KafkaConsumer, TopicPartition
+from kafka.errors import KafkaError
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092").split(",")
+LIVE_COMMENTS_QUEUE_SIZE = int(os.getenv("LIVE_COMMENTS_QUEUE_SIZE", "100"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "50000"))
+LIVE_RECONNECT_BACKOFF = float(os.getenv("LIVE_RECONNECT_BACKOFF", "1"))
+# Топик -> сообщение events.proto (None — JSON)
+COMMENT_TOPICS = {
+    "post_comments": None,
+    "post_comments_v2": events_pb2.PostComment,
+}
+# Сколько последних id комментариев помнить для отбрасывания повторов
+SEEN_COMMENTS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionClosed(Exception):
+    pass
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def uuid_string(value):
+    return str(uuid.UUID(bytes=value)) if value else ""
+
+
+def canonical_post_id(post_id):
+    """id поста в том виде, в каком он приходит в событиях: из пути может прийти UUID в верхнем регистре,
+    без дефисов и т.п., а GetPost такой id принимает."""
+    try:
+        return str(uuid.UUID(post_id))
+    except ValueError:
+        return post_id
+
+
+def decode_comment(topic, value):
+    """Комментарий в том же виде, что в GET /posts/{id}/comments."""
+    message = COMMENT_TOPICS[topic]
+    if message is None:
+        event = json.loads(value)
+        created_at = datetime.datetime.fromisoformat(event["commented_at"])
+        return {"id": event["comment_id"], "post_id": event["post_id"], "user_id": event["user_id"],
+                "content": event["content"], "created_at": created_at.isoformat(timespec="milliseconds")}
+    event = message.FromString(value)
+    millis = event.commented_at_ms or event.commented_at * 1000
+    created_at = datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=millis)
+    return {"id": uuid_string(event.comment_id), "post_id": uuid_string(event.post_id), "user_id": event.user_id,
+            "content": event.content, "created_at": created_at.isoformat(timespec="milliseconds")}
+
+
+class Subscriber:
+    # deque и одна Future вместо asyncio.Queue: подписчиков десятки тысяч на процесс
+    __slots__ = ("post_id", "size", "comments", "reason", "_waiter")
+
+    def __init__(self, post_id, size):
+        self.post_id = post_id
+        self.size = size
+        self.comments = collections.deque()
+        self.reason = None
+        self._waiter = None
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def push(self, comment):
+        """False — очередь переполнена, подписчик закрыт."""
+        if len(self.comments) >= self.size:
+            self.close("slow consumer")
+            return False
+        self.comments.append(comment)
+        self._wake()
+        return True
+
+    def close(self, reason):
+        self.reason = reason
+        self._wake()
+
+    async def get(self, timeout):
+        """Следующий комментарий; None — за timeout секунд новых нет."""
+        if self.reason is None and not self.comments:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self._waiter = None
+        if self.reason is not None:
+            raise SubscriptionClosed(self.reason)
+        return self.comments.popleft()
+
+
+def create_consumer():
+    return KafkaConsumer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS, enable_auto_commit=False)
+
+
+class CommentFeed:
+    def __init__(self, create=create_consumer, queue_size=LIVE_COMMENTS_QUEUE_SIZE,
+                 max_subscribers=LIVE_MAX_SUBSCRIBERS, backoff=LIVE_RECONNECT_BACKOFF):
+        self.create = create
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.backoff = backoff
+        self.subscribers = {}
+        self.count = 0
+        self.seen = collections.OrderedDict()
+        self.slow_disconnects = 0
+        self._thread = None
+
+    def subscribe(self, post_id):
+        """Вызывается в цикле событий; консьюмер запускается при первой подписке."""
+        if self.count >= self.max_subscribers:
+            raise TooManySubscribers(f"At most {self.max_subscribers} live subscribers")
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._consume, args=(asyncio.get_running_loop(),), daemon=True)
+            self._thread.start()
+        subscriber = Subscriber(canonical_post_id(post_id), self.queue_size)
+        self.subscribers.setdefault(subscriber.post_id, set()).add(subscriber)
+        self.count += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self.subscribers.get(subscriber.post_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        self.count -= 1
+        if not subscribers:
+            del self.subscribers[subscriber.post_id]
+
+    def publish(self, comments):
+        """Пачка комментариев из консьюмера; вызывается в цикле событий."""
+        for comment in comments:
+            if comment["id"] in self.seen:
+                continue
+            self.seen[comment["id"]] = True
+            if len(self.seen) > SEEN_COMMENTS:
+                self.seen.popitem(last=False)
+            slow = [subscriber for subscriber in self.subscribers.get(comment["post_id"], ())
+                    if not subscriber.push(comment)]
+            for subscriber in slow:
+                self.slow_disconnects += 1
+                self.unsubscribe(subscriber)
+
+    def _consume(self, loop):
+        while True:
+            consumer = None
+            try:
+                consumer = self.create()
+                partitions = [TopicPartition(topic, partition) for topic in COMMENT_TOPICS
+                              for partition in consumer.partitions_for_topic(topic) or ()]
+                consumer.assign(partitions)
+                consumer.seek_to_end(*partitions)
+                while True:
+                    comments = []
+                    for records in consumer.poll(timeout_ms=1000).values():
+                        for record in records:
+                            try:
+                                comments.append(decode_comment(record.topic, record.value))
+                            except (ValueError, KeyError, TypeError, DecodeError) as e:
+                                logger.warning("Skipping malformed comment at %s/%d/%d: %s",
+                                               record.topic, record.partition, record.offset, e)
+                    if comments and not self._send(loop, comments):
+                        consumer.close()
+                        return
+            except Exception as e:
+                # любая ошибка — переподключение: без консьюмера подписчики молча перестали бы получать комментарии
+                if isinstance(e, KafkaError):
+                    logger.warning("Comment feed consumer failed: %s", e)
+                else:
+                    logger.exception("Comment feed consumer failed")
+                if consumer is not None:
+                    try:
+                        consumer.close()
+                    except Exception:
+                        pass
+            time.sleep(self.backoff)
+
+    def _send(self, loop, comments):
+        try:
+            loop.call_soon_threadsafe(self.publish, comments)
+            return True
+        except RuntimeError:
+            # цикл событий закрыт: консьюмер запустится заново при следующей подписке
+            self._thread = None
+            return False
+
+    def stats(self):
+        return {"posts": len(self.subscribers), "subscribers": self.count,
+                "slow_disconnects": self.slow_disconnects}
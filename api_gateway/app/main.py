@@ -1,5 +1,10 @@
 from fastapi import FastAPI
-from .handlers import router
+from .handlers import router, close_clients
 
 app = FastAPI(title="API Gateway")
 app.include_router(router)
+
+
+@app.on_event("shutdown")
+def shutdown():
+    close_clients()
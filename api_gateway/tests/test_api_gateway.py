@@ -1,4 +1,11 @@
+import asyncio
+import json
+import queue
+import threading
+import uuid
+
 import pytest
+from fastapi import WebSocketDisconnect
 from fastapi.testclient import TestClient
 from datetime import datetime, timedelta
 import jwt
@@ -7,13 +14,37 @@ import grpc
 from httpx import Response
 from app.auth import create_jwt_token, SECRET_KEY, ALGORITHM
 from app.main import app
+import events_pb2
 import posts_pb2
 import stats_pb2
-from app import handlers
+from app import handlers, live, live_comments
 
 client = TestClient(app)
 
 
+class DummyProducer:
+    def __init__(self):
+        self.sent = []
+        self.keys = []
+
+    def send(self, topic, value, key=None):
+        self.sent.append((topic, value))
+        self.keys.append(key)
+
+    def flush(self):
+        pass
+
+    def bootstrap_connected(self):
+        return True
+
+
+@pytest.fixture(autouse=True)
+def override_producer(monkeypatch):
+    dummy = DummyProducer()
+    monkeypatch.setattr(handlers, "producer", dummy)
+    return dummy
+
+
 @respx.mock
 def test_register_proxy_success():
     route = respx.post("http://user_service:8001/register").mock(
@@ -30,6 +61,62 @@ def test_register_proxy_success():
     assert data["user_id"] == 1
 
 
+@respx.mock
+def test_register_succeeds_when_kafka_unavailable(monkeypatch):
+    def unavailable():
+        # подключение к брокеру не должно занимать цикл событий
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()
+        raise handlers.NoBrokersAvailable()
+
+    monkeypatch.setattr(handlers, "get_producer", unavailable)
+    respx.post("http://user_service:8001/register").mock(
+        return_value=Response(201, json={"message": "User created", "user_id": 7})
+    )
+    response = client.post("/register", json={
+        "username": "nokafka",
+        "password": "password",
+        "email": "nokafka@example.com"
+    })
+    assert response.status_code == 201
+    assert response.json()["user_id"] == 7
+
+
+def test_register_sends_event(override_producer):
+    with respx.mock:
+        respx.post("http://user_service:8001/register").mock(
+            return_value=Response(201, json={"message": "User created", "user_id": 8})
+        )
+        client.post("/register", json={
+            "username": "eventuser",
+            "password": "password",
+            "email": "event@example.com"
+        })
+    topic, value = override_producer.sent[0]
+    assert topic == "user_registrations_v2"
+    event = events_pb2.UserRegistration.FromString(value)
+    assert (event.user_id, event.username) == (8, "eventuser")
+    assert event.registered_at > 0 and event.registered_at_ms // 1000 == event.registered_at
+    assert len(event.event_id) == 16
+    assert override_producer.keys[0] == "8"
+
+
+def test_ready_reports_dependencies(monkeypatch):
+    monkeypatch.setattr(handlers, "grpc_service_ready", lambda address: address == handlers.POSTS_SERVICE_ADDRESS)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json() == {"kafka": True, "posts_service": True, "stats_service": False}
+
+    monkeypatch.setattr(handlers, "grpc_service_ready", lambda address: True)
+    response = client.get("/ready")
+    assert response.status_code == 200
+
+
+def test_channels_are_reused():
+    first = handlers.get_channel("localhost:1")
+    assert handlers.get_channel("localhost:1") is first
+
+
 @respx.mock
 def test_login_proxy_success():
     user_data = {"user_id": 2, "username": "loginuser", "email": "login@example.com"}
@@ -452,9 +539,31 @@ def test_like_post_error(monkeypatch):
     assert 'gRPC error' in response.json()['detail']
 
 
+class FakeRpcError(grpc.RpcError):
+    def __init__(self, code, details):
+        self._code = code
+        self._details = details
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._details
+
+
 class DummyStatsServiceStub:
     def GetPostStats(self, request, metadata=None):
-        return stats_pb2.PostStatsResponse(views=100, likes=20, comments=5)
+        assert request.approximate
+        return stats_pb2.PostStatsResponse(views=100, likes=20, comments=5,
+                                           unique_viewers=40, unique_likers=20, unique_commenters=3)
+
+    def GetPostsStats(self, request, metadata=None):
+        assert request.approximate
+        return stats_pb2.PostsStatsResponse(stats=[
+            stats_pb2.PostStats(post_id=post_id, views=100, likes=20, comments=5,
+                                unique_viewers=40, unique_likers=20, unique_commenters=3)
+            for post_id in request.post_ids
+        ])
 
     def GetPostViewsHistory(self, request, metadata=None):
         return stats_pb2.PostHistoryResponse(history=[
@@ -474,7 +583,27 @@ class DummyStatsServiceStub:
             stats_pb2.DayStats(date="2025-01-02", stat=4),
         ])
 
+    def GetPostHistory(self, request, metadata=None):
+        if request.from_time == "later":
+            raise FakeRpcError(grpc.StatusCode.INVALID_ARGUMENT, "Invalid isoformat string")
+        assert request.granularity == stats_pb2.WEEK and request.metric == stats_pb2.LIKES
+        assert request.from_time == "2025-01-01"
+        return stats_pb2.PackedHistoryResponse(start="2024-12-30", bucket_seconds=7 * 86400, counts=[3, 0, 5])
+
+    def GetPostMetricsHistory(self, request, metadata=None):
+        assert request.granularity == stats_pb2.HOUR
+        return stats_pb2.MetricsHistoryResponse(start="2025-01-01 10:00", bucket_seconds=3600,
+                                                views=[4, 1], likes=[1, 0], comments=[0, 2])
+
+    def GetPostRecentActivity(self, request, metadata=None):
+        assert request.post_id == "post123"
+        return stats_pb2.MetricsHistoryResponse(start="2025-01-01 10:00", bucket_seconds=60,
+                                                views=[7, 3], likes=[0, 1], comments=[1, 0])
+
     def GetTopTenPosts(self, request, metadata=None):
+        if request.limit == 2:
+            assert request.window == stats_pb2.LAST_WEEK and request.approximate
+            return stats_pb2.TopTenPostsResponse(post_ids=["post1", "post2"])
         return stats_pb2.TopTenPostsResponse(post_ids=["post1", "post2", "post3"])
 
     def GetTopTenUsers(self, request, metadata=None):
@@ -490,7 +619,8 @@ def test_get_post_stats():
     response = client.get("/posts/post123/stats", headers=HEADERS)
     assert response.status_code == 200
     data = response.json()
-    assert data == {"views": 100, "likes": 20, "comments": 5}
+    assert data == {"views": 100, "likes": 20, "comments": 5,
+                    "unique_viewers": 40, "unique_likers": 20, "unique_commenters": 3}
 
 
 def test_get_post_views_history():
@@ -516,6 +646,33 @@ def test_get_post_comments_history():
     assert data[1]["count"] == 4
 
 
+def test_get_post_history():
+    response = client.get("/posts/post123/history?metric=likes&granularity=week&from=2025-01-01", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json() == {"start": "2024-12-30", "bucket_seconds": 604800, "counts": [3, 0, 5]}
+
+
+def test_get_post_history_invalid_params():
+    assert client.get("/posts/post123/history?metric=shares", headers=HEADERS).status_code == 400
+    assert client.get("/posts/post123/history?metric=views&granularity=year", headers=HEADERS).status_code == 400
+    response = client.get("/posts/post123/history?metric=views&from=later", headers=HEADERS)
+    assert response.status_code == 400
+
+
+def test_get_post_metrics_history():
+    response = client.get("/posts/post123/metrics/history?granularity=hour", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json() == {"start": "2025-01-01 10:00", "bucket_seconds": 3600,
+                               "views": [4, 1], "likes": [1, 0], "comments": [0, 2]}
+
+
+def test_get_post_recent_activity():
+    response = client.get("/posts/post123/metrics/recent", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json() == {"start": "2025-01-01 10:00", "bucket_seconds": 60,
+                               "views": [7, 3], "likes": [0, 1], "comments": [1, 0]}
+
+
 def test_get_top_posts_by_likes():
     response = client.get("/top/posts?sort_by=likes", headers=HEADERS)
     assert response.status_code == 200
@@ -534,3 +691,301 @@ def test_invalid_sort_param_for_top_users():
     response = client.get("/top/users?sort_by=shares", headers=HEADERS)
     assert response.status_code == 400
     assert response.json()["detail"] == "Invalid sort_by value"
+
+
+def test_get_top_posts_with_limit_and_window():
+    response = client.get("/top/posts?sort_by=views&limit=2&window=week", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json()["post_ids"] == ["post1", "post2"]
+
+
+def test_invalid_top_window_and_limit():
+    assert client.get("/top/posts?sort_by=views&window=year", headers=HEADERS).status_code == 400
+    assert client.get("/top/users?sort_by=views&limit=0", headers=HEADERS).status_code == 400
+
+
+def test_list_posts_with_stats():
+    response = client.get("/posts?page=0&page_size=10&include=stats", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json()[0]["stats"] == {"views": 100, "likes": 20, "comments": 5,
+                                           "unique_viewers": 40, "unique_likers": 20, "unique_commenters": 3}
+
+
+def test_list_posts_with_stats_unavailable(monkeypatch):
+    class FailingStatsStub:
+        def GetPostsStats(self, request, metadata=None):
+            raise grpc.RpcError()
+
+    monkeypatch.setattr(handlers, "get_stats_stub", lambda: FailingStatsStub())
+    response = client.get("/posts?include=stats", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json()[0]["stats"] is None
+
+
+class FakeStatsStream:
+    """Вызов StreamPostStats: сообщения из очереди, после cancel() — ошибка CANCELLED, как у grpc."""
+
+    def __init__(self, *updates):
+        self.updates = queue.Queue()
+        for update in updates:
+            self.updates.put(update)
+        self.cancelled = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        update = self.updates.get()
+        if update is None:
+            raise FakeRpcError(grpc.StatusCode.CANCELLED, "Cancelled")
+        return update
+
+    def cancel(self):
+        self.cancelled.set()
+        self.updates.put(None)
+
+
+def sse_data(event):
+    assert event.startswith("data: ")
+    return json.loads(event[len("data: "):])
+
+
+def test_live_stats_share_one_stream_per_post():
+    calls = []
+
+    def open_stream(post_id):
+        calls.append((post_id, FakeStatsStream(stats_pb2.PostStatsUpdate(snapshot=True, views=10, likes=2,
+                                                                             comments=1))))
+        return calls[-1][1]
+
+    hub = live.PostStatsHub(open_stream, backoff=0)
+
+    async def main():
+        first = hub.events("post1")
+        assert sse_data(await asyncio.wait_for(first.__anext__(), 5)) == {"views": 10, "likes": 2, "comments": 1}
+        # второй клиент сразу получает текущие счётчики из той же подписки
+        second = hub.events("post1")
+        assert sse_data(await asyncio.wait_for(second.__anext__(), 5))["views"] == 10
+
+        call = calls[0][1]
+        call.updates.put(stats_pb2.PostStatsUpdate(views=3, comments=1))
+        for client_events in (first, second):
+            assert sse_data(await asyncio.wait_for(client_events.__anext__(), 5)) == {
+                "views": 13, "likes": 2, "comments": 2}
+
+        await first.aclose()
+        assert not call.cancelled.is_set()
+        await second.aclose()
+        assert call.cancelled.wait(5)
+        assert hub.channels == {}
+
+    asyncio.run(main())
+    assert [post_id for post_id, _ in calls] == ["post1"]
+
+
+def test_live_stats_reopen_after_unexpected_error():
+    calls = []
+
+    def open_stream(post_id):
+        calls.append(post_id)
+        if len(calls) == 1:
+            raise ValueError("broken channel")
+        return FakeStatsStream(stats_pb2.PostStatsUpdate(snapshot=True, views=5))
+
+    hub = live.PostStatsHub(open_stream, backoff=0)
+
+    async def main():
+        events = hub.events("post1")
+        event = await asyncio.wait_for(events.__anext__(), 5)
+        await events.aclose()
+        return event
+
+    assert sse_data(asyncio.run(main()))["views"] == 5
+    assert calls == ["post1", "post1"]
+
+
+def test_live_stats_keepalive():
+    hub = live.PostStatsHub(lambda post_id: FakeStatsStream(), backoff=0)
+
+    async def main():
+        events = hub.events("post1", keepalive=0.01)
+        event = await asyncio.wait_for(events.__anext__(), 5)
+        await events.aclose()
+        return event
+
+    assert asyncio.run(main()) == ": keepalive\n\n"
+
+
+def test_live_stats_of_private_post(monkeypatch):
+    class PrivatePostStub:
+        def GetPost(self, request, metadata=None):
+            raise FakeRpcError(grpc.StatusCode.PERMISSION_DENIED, "private")
+
+    monkeypatch.setattr(handlers, "get_posts_stub", lambda: PrivatePostStub())
+    response = client.get("/posts/post1/stats/live", headers=HEADERS)
+    assert response.status_code == 403
+    assert handlers.live_stats.channels == {}
+
+
+def test_live_stats_canonical_post_id_and_channel_limit():
+    calls = []
+
+    def open_stream(post_id):
+        calls.append(post_id)
+        return FakeStatsStream()
+
+    hub = live.PostStatsHub(open_stream, backoff=0, max_channels=1)
+    post_id = "6f1c6b2e-0000-4000-8000-0000000000aa"
+
+    async def main():
+        first, first_queue = hub.subscribe(post_id)
+        # другое написание того же UUID — та же подписка, а не второй канал
+        second, second_queue = hub.subscribe(post_id.upper().replace("-", ""))
+        assert second is first
+        assert hub.accepts(post_id) and not hub.accepts("post2")
+        with pytest.raises(live.TooManyChannels):
+            hub.subscribe("post2")
+        hub.unsubscribe(first, first_queue)
+        hub.unsubscribe(second, second_queue)
+        assert first.closed and hub.accepts("post2")
+
+    asyncio.run(main())
+    assert calls in ([], [post_id])
+
+
+def test_live_stats_limit_returns_503(monkeypatch):
+    monkeypatch.setattr(handlers, "get_posts_stub", lambda: DummyPostServiceStub())
+    monkeypatch.setattr(handlers, "live_stats", live.PostStatsHub(lambda post_id: FakeStatsStream(), max_channels=0))
+    response = client.get("/posts/post1/stats/live", headers=HEADERS)
+    assert response.status_code == 503
+
+
+POST_ID = "6f1c6b2e-0000-4000-8000-000000000001"
+COMMENT_ID = "6f1c6b2e-0000-4000-8000-0000000000c1"
+
+
+def comment_record(offset, comment_id=COMMENT_ID, post_id=POST_ID):
+    value = events_pb2.PostComment(user_id="user1", post_id=uuid.UUID(post_id).bytes,
+                                   comment_id=uuid.UUID(comment_id).bytes, content="hello",
+                                   commented_at=1735689600, commented_at_ms=1735689600250).SerializeToString()
+    return type("Record", (), {"topic": "post_comments_v2", "partition": 0, "offset": offset, "value": value})
+
+
+def test_decode_comment_from_json_and_protobuf():
+    expected = {"id": COMMENT_ID, "post_id": POST_ID, "user_id": "user1", "content": "hello",
+                "created_at": "2025-01-01T00:00:00.250"}
+    assert live_comments.decode_comment("post_comments_v2", comment_record(0).value) == expected
+    value = json.dumps({"event_id": "e1", "comment_id": COMMENT_ID, "post_id": POST_ID, "user_id": "user1",
+                        "content": "hello", "commented_at": "2025-01-01 00:00:00.250"}).encode()
+    assert live_comments.decode_comment("post_comments", value) == expected
+
+
+def test_comment_feed_fan_out_and_slow_consumer(monkeypatch):
+    feed = live_comments.CommentFeed(queue_size=2)
+    monkeypatch.setattr(feed, "_thread", object())
+
+    async def main():
+        fast = feed.subscribe(POST_ID)
+        slow = feed.subscribe(POST_ID)
+        other = feed.subscribe("post2")
+        comment = {"id": "c1", "post_id": POST_ID}
+        feed.publish([comment, comment])
+        assert await fast.get(1) == comment
+        feed.publish([{"id": "c2", "post_id": POST_ID}, {"id": "c3", "post_id": POST_ID}])
+        assert await fast.get(1) == {"id": "c2", "post_id": POST_ID}
+        assert await other.get(0.01) is None
+        # slow не забирал комментарии: на третьем очередь переполнилась
+        with pytest.raises(live_comments.SubscriptionClosed):
+            await slow.get(1)
+        assert feed.stats() == {"posts": 2, "subscribers": 2, "slow_disconnects": 1}
+
+    asyncio.run(main())
+
+
+class FakeCommentsConsumer:
+    def __init__(self, *records):
+        self.records = list(records)
+
+    def partitions_for_topic(self, topic):
+        return {0}
+
+    def assign(self, partitions):
+        self.partitions = partitions
+
+    def seek_to_end(self, *partitions):
+        self.seeked = partitions
+
+    def poll(self, timeout_ms=0):
+        if not self.records:
+            threading.Event().wait(timeout_ms / 1000)
+            return {}
+        records, self.records = self.records, []
+        return {("post_comments_v2", 0): records}
+
+    def close(self):
+        pass
+
+
+def test_comments_websocket(monkeypatch):
+    consumer = FakeCommentsConsumer(comment_record(0), comment_record(1))
+    monkeypatch.setattr(handlers, "live_comments", live_comments.CommentFeed(create=lambda: consumer))
+
+    with client.websocket_connect(f"/posts/{POST_ID}/comments/ws?token={TOKEN}") as websocket:
+        comment = websocket.receive_json()
+    assert (comment["id"], comment["content"]) == (COMMENT_ID, "hello")
+    assert {tp.topic for tp in consumer.seeked} == {"post_comments", "post_comments_v2"}
+
+
+def test_live_access_check_runs_outside_event_loop(monkeypatch):
+    loops = []
+
+    class Stub:
+        def GetPost(self, request, metadata=None):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            raise FakeRpcError(grpc.StatusCode.PERMISSION_DENIED, "private")
+
+    monkeypatch.setattr(handlers, "get_posts_stub", lambda: Stub())
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/posts/{POST_ID}/comments/ws?token={TOKEN}") as websocket:
+            websocket.receive_json()
+    assert client.get(f"/posts/{POST_ID}/comments/live", headers=HEADERS).status_code == 403
+    assert client.get(f"/posts/{POST_ID}/stats/live", headers=HEADERS).status_code == 403
+    # синхронный GetPost вызывается в пуле потоков, а не в цикле событий
+    assert loops == [None, None, None]
+
+
+def test_comments_websocket_restarts_consumer_and_normalizes_post_id(monkeypatch):
+    consumer = FakeCommentsConsumer(comment_record(0))
+    attempts = []
+
+    def create():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ValueError("unexpected")
+        return consumer
+
+    monkeypatch.setattr(handlers, "live_comments", live_comments.CommentFeed(create=create, backoff=0))
+
+    with client.websocket_connect(f"/posts/{POST_ID.upper()}/comments/ws?token={TOKEN}") as websocket:
+        comment = websocket.receive_json()
+    assert comment["id"] == COMMENT_ID
+    assert len(attempts) == 2
+
+
+def test_comments_websocket_requires_access(monkeypatch):
+    class PrivatePostStub:
+        def GetPost(self, request, metadata=None):
+            raise FakeRpcError(grpc.StatusCode.PERMISSION_DENIED, "private")
+
+    monkeypatch.setattr(handlers, "get_posts_stub", lambda: PrivatePostStub())
+    feed = live_comments.CommentFeed(create=lambda: FakeCommentsConsumer())
+    monkeypatch.setattr(handlers, "live_comments", feed)
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect(f"/posts/{POST_ID}/comments/ws?token={TOKEN}") as websocket:
+            websocket.receive_json()
+    assert error.value.code == 1008
+    assert feed.count == 0
+    assert client.get(f"/posts/{POST_ID}/comments/live", headers=HEADERS).status_code == 403
@@ -0,0 +1,21 @@
+#!/bin/bash
+# Создаёт топики событий с заданным числом партиций: KAFKA_TOPICS="топик:партиции ...".
+# У существующего топика число партиций только увеличивается: после этого часть ключей (post_id)
+# переходит в новые партиции, порядок событий поста сохраняется лишь для новых сообщений.
+set -euo pipefail
+
+BOOTSTRAP_SERVER=${KAFKA_BOOTSTRAP_SERVER:-kafka:9092}
+REPLICATION_FACTOR=${KAFKA_REPLICATION_FACTOR:-1}
+
+for spec in ${KAFKA_TOPICS}; do
+  topic=${spec%%:*}
+  partitions=${spec##*:}
+  kafka-topics.sh --bootstrap-server "$BOOTSTRAP_SERVER" --create --if-not-exists \
+    --topic "$topic" --partitions "$partitions" --replication-factor "$REPLICATION_FACTOR"
+  current=$(kafka-topics.sh --bootstrap-server "$BOOTSTRAP_SERVER" --describe --topic "$topic" \
+    | grep -c "Partition: ")
+  if [ "$current" -lt "$partitions" ]; then
+    kafka-topics.sh --bootstrap-server "$BOOTSTRAP_SERVER" --alter --topic "$topic" --partitions "$partitions"
+  fi
+  echo "$topic: $(( current > partitions ? current : partitions )) partitions"
+done
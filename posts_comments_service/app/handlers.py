@@ -1,27 +1,92 @@
 import grpc
 from concurrent import futures
+import logging
+import os
+import threading
 import time
 import uuid
 import datetime
+import heapq
+import itertools
 
 import posts_pb2
 import posts_pb2_grpc
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
 
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from .models import Post, SessionLocal, PostLike, Comment
+from .models import Post, PostLike, Comment, shards, init_db, parse_uuid
+from .partitions import archive_partitions, ensure_partitions
+from .events import encode_event, event_topic
 
 from kafka import KafkaProducer
-import json
-
-producer = KafkaProducer(
-    bootstrap_servers=['kafka:9092'],
-    value_serializer=lambda v: json.dumps(v).encode('utf-8')
-)
+from kafka.errors import KafkaError, NoBrokersAvailable
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092").split(",")
+KAFKA_RECONNECT_BACKOFF = float(os.getenv("KAFKA_RECONNECT_BACKOFF", "5"))
+# Сколько send() ждёт метаданных топика или места в буфере, пока брокер недоступен
+KAFKA_MAX_BLOCK_MS = int(os.getenv("KAFKA_MAX_BLOCK_MS", "1000"))
+# Повтор отправки может записать событие в топик дважды; ClickHouse отбрасывает его по event_id
+# до сырых таблиц и счётчиков (stats_clickhouse/init/03_materialized_views.sql)
+KAFKA_PRODUCER_RETRIES = int(os.getenv("KAFKA_PRODUCER_RETRIES", "5"))
+DB_INIT_RETRY_INTERVAL = float(os.getenv("DB_INIT_RETRY_INTERVAL", "5"))
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "5"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "86400"))
+# Без PARTITION_RETENTION_MONTHS старые партиции не архивируются
+PARTITION_RETENTION_MONTHS = os.getenv("PARTITION_RETENTION_MONTHS")
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR", "/archive")
+
+logger = logging.getLogger(__name__)
+
+# Producer создаётся при первой отправке события, а не при импорте модуля
+producer = None
+_producer_lock = threading.Lock()
+_producer_failed_at = float("-inf")
+
+
+def get_producer():
+    global producer, _producer_failed_at
+    if producer is not None:
+        return producer
+    with _producer_lock:
+        if producer is None:
+            if time.monotonic() - _producer_failed_at < KAFKA_RECONNECT_BACKOFF:
+                raise NoBrokersAvailable()
+            try:
+                producer = KafkaProducer(
+                    bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+                    key_serializer=lambda k: k.encode('utf-8'),
+                    acks='all',
+                    retries=KAFKA_PRODUCER_RETRIES,
+                    max_block_ms=KAFKA_MAX_BLOCK_MS
+                )
+            except KafkaError:
+                _producer_failed_at = time.monotonic()
+                raise
+    return producer
+
+
+def send_events(topic, values):
+    """
+    Отправка событий в Kafka; недоступность брокера не ломает обработку запроса.
+    Ключ — post_id: события поста попадают в одну партицию и загружаются в порядке отправки.
+    Без flush(): доставку ведёт фоновый поток producer'а, поток сервера не ждёт брокер.
+    """
+    try:
+        kafka_producer = get_producer()
+        for value in values:
+            kafka_producer.send(event_topic(topic), encode_event(topic, value), key=value['post_id'])
+    except KafkaError as e:
+        logger.warning("Failed to send %d event(s) to %s: %s", len(values), topic, e)
+
+
+def send_event(topic, value):
+    send_events(topic, [value])
 
 
 def post_to_proto(post: Post) -> posts_pb2.Post:
     return posts_pb2.Post(
-        id=post.id,
+        id=str(post.id),
         title=post.title,
         description=post.description,
         creator_id=post.creator_id,
@@ -32,11 +97,67 @@ def post_to_proto(post: Post) -> posts_pb2.Post:
     )
 
 
+def comment_to_proto(comment: Comment) -> posts_pb2.Comment:
+    return posts_pb2.Comment(
+        id=str(comment.id),
+        post_id=str(comment.post_id),
+        user_id=comment.user_id,
+        content=comment.content,
+        created_at=comment.created_at.isoformat()
+    )
+
+
+def post_not_found(context, response):
+    context.set_code(grpc.StatusCode.NOT_FOUND)
+    context.set_details('Post not found')
+    return response
+
+
+class AlreadyLiked(Exception):
+    pass
+
+
+def lock_like(session, user_id, post_id):
+    """
+    post_likes секционирована по created_at, и уникальный индекс по (user_id, post_id) на ней невозможен:
+    параллельные лайки одного пользователя сериализуются advisory-блокировкой до конца транзакции.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"{post_id}:{user_id}"})
+
+
+def like_exists(session, user_id, post_id, post_created_at):
+    # лайк не может быть старше поста: условие по created_at отсекает старые партиции
+    return session.query(PostLike.user_id).filter(
+        PostLike.post_id == post_id,
+        PostLike.user_id == user_id,
+        PostLike.created_at >= post_created_at,
+    ).first() is not None
+
+
+def wants_primary(context):
+    """Клиент может явно запросить чтение из primary (read-your-own-writes между процессами)."""
+    return dict(context.invocation_metadata()).get("read_primary") == "1"
+
+
+def list_visible_posts(session_factory, current_user, offset, limit):
+    session = session_factory()
+    try:
+        query = session.query(Post)
+        if current_user:
+            query = query.filter((Post.is_private == False) | (Post.creator_id == current_user))
+        else:
+            query = query.filter(Post.is_private == False)
+        return query.order_by(Post.created_at, Post.id).offset(offset).limit(limit).all()
+    finally:
+        session.close()
+
+
 class PostService(posts_pb2_grpc.PostServiceServicer):
     def CreatePost(self, request, context):
-        session = SessionLocal()
+        post_id = uuid.uuid4()
+        session = shards.session_for(post_id)
         try:
-            post_id = str(uuid.uuid4())
             now = datetime.datetime.utcnow()
             tags_str = ",".join(request.tags)
             new_post = Post(
@@ -52,6 +173,7 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             session.add(new_post)
             session.commit()
             session.refresh(new_post)
+            shards.replica_set_for(post_id).mark_written(post_id, f"user:{request.creator_id}")
             return posts_pb2.CreatePostResponse(post=post_to_proto(new_post))
         except SQLAlchemyError as e:
             session.rollback()
@@ -62,9 +184,12 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             session.close()
 
     def GetPost(self, request, context):
-        session = SessionLocal()
+        post_id = parse_uuid(request.id)
+        if post_id is None:
+            return post_not_found(context, posts_pb2.GetPostResponse())
+        session = shards.read_session_for(post_id, wants_primary(context))
         try:
-            post = session.query(Post).filter(Post.id == request.id).first()
+            post = session.query(Post).filter(Post.id == post_id).first()
             if post is None:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details('Post not found')
@@ -77,12 +202,11 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
                     context.set_details(f"Access denied: private post, {current_user} != {post.creator_id}")
                     return posts_pb2.GetPostResponse()
 
-            producer.send('post_views', {
-                'post_id': request.id,
+            send_event('post_views', {
+                'post_id': str(post_id),
                 'user_id': dict(context.invocation_metadata()).get('current_user', ''),
-                'viewed_at': datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+                'viewed_at': datetime.datetime.utcnow()
             })
-            producer.flush()
 
             return posts_pb2.GetPostResponse(post=post_to_proto(post))
         except SQLAlchemyError as e:
@@ -93,9 +217,12 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             session.close()
 
     def UpdatePost(self, request, context):
-        session = SessionLocal()
+        post_id = parse_uuid(request.id)
+        if post_id is None:
+            return post_not_found(context, posts_pb2.UpdatePostResponse())
+        session = shards.session_for(post_id)
         try:
-            post = session.query(Post).filter(Post.id == request.id).first()
+            post = session.query(Post).filter(Post.id == post_id).first()
             if post is None:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details('Post not found')
@@ -113,6 +240,7 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             post.is_private = request.is_private
             post.tags = ",".join(request.tags)
             session.commit()
+            shards.replica_set_for(post_id).mark_written(post_id, f"user:{current_user}")
             session.refresh(post)
             return posts_pb2.UpdatePostResponse(post=post_to_proto(post))
         except SQLAlchemyError as e:
@@ -124,9 +252,12 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             session.close()
 
     def DeletePost(self, request, context):
-        session = SessionLocal()
+        post_id = parse_uuid(request.id)
+        if post_id is None:
+            return post_not_found(context, posts_pb2.DeletePostResponse())
+        session = shards.session_for(post_id)
         try:
-            post = session.query(Post).filter(Post.id == request.id).first()
+            post = session.query(Post).filter(Post.id == post_id).first()
             if post:
                 current_user = dict(context.invocation_metadata()).get("current_user")
                 if current_user != post.creator_id:
@@ -135,6 +266,7 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
                     return posts_pb2.DeletePostResponse()
                 session.delete(post)
                 session.commit()
+                shards.replica_set_for(post_id).mark_written(post_id, f"user:{current_user}")
                 return posts_pb2.DeletePostResponse(message="Post deleted")
             else:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
@@ -149,24 +281,34 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             session.close()
 
     def ListPosts(self, request, context):
-        session = SessionLocal()
         try:
             current_user = dict(context.invocation_metadata()).get("current_user")
-            query = session.query(Post)
-            if current_user:
-                query = query.filter((Post.is_private == False) | (Post.creator_id == current_user))
+            offset = request.page * request.page_size
+            read_options = {
+                "read": True,
+                "key": f"user:{current_user}" if current_user else None,
+                "use_primary": wants_primary(context),
+            }
+            if len(shards) == 1:
+                posts_list = shards.scatter(
+                    lambda factory: list_visible_posts(factory, current_user, offset, request.page_size),
+                    **read_options
+                )[0]
             else:
-                query = query.filter(Post.is_private == False)
-
-            posts_list = query.offset(request.page * request.page_size).limit(request.page_size).all()
-            time_now = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-            for post in posts_list:
-                producer.send('post_likes', {
-                    'post_id': post.id,
-                    'user_id': dict(context.invocation_metadata()).get('current_user', ''),
-                    'liked_at': time_now,
-                })
-            producer.flush()
+                # scatter-gather: с каждого шарда берём первые offset + page_size постов
+                # в общем порядке и сливаем отсортированные списки
+                per_shard = shards.scatter(
+                    lambda factory: list_visible_posts(factory, current_user, 0, offset + request.page_size),
+                    **read_options
+                )
+                merged = heapq.merge(*per_shard, key=lambda p: (p.created_at, p.id))
+                posts_list = list(itertools.islice(merged, offset, offset + request.page_size))
+            time_now = datetime.datetime.utcnow()
+            send_events('post_likes', [{
+                'post_id': str(post.id),
+                'user_id': dict(context.invocation_metadata()).get('current_user', ''),
+                'liked_at': time_now,
+            } for post in posts_list])
 
             proto_posts = [post_to_proto(p) for p in posts_list]
             return posts_pb2.ListPostsResponse(posts=proto_posts)
@@ -174,13 +316,14 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Database error: {str(e)}")
             return posts_pb2.ListPostsResponse()
-        finally:
-            session.close()
 
     def LikePost(self, request, context):
-        session = SessionLocal()
+        post_id = parse_uuid(request.post_id)
+        if post_id is None:
+            return post_not_found(context, posts_pb2.LikeResponse())
+        session = shards.session_for(post_id)
         try:
-            post = session.query(Post).filter(Post.id == request.post_id).first()
+            post = session.query(Post).filter(Post.id == post_id).first()
             if post is None:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details('Post not found')
@@ -194,19 +337,25 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
                     context.set_details('Access denied: private post')
                     session.close()
                     return posts_pb2.LikeResponse()
+            post_created_at = post.created_at
         except SQLAlchemyError as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Database error: {str(e)}")
             session.close()
             return posts_pb2.LikeResponse()
+        session.close()
 
-        session = SessionLocal()
+        session = shards.session_for(post_id)
         user = dict(context.invocation_metadata()).get('current_user', '')
-        like = PostLike(user_id=user, post_id=request.post_id)
+        like = PostLike(user_id=user, post_id=post_id)
         try:
+            lock_like(session, user, post_id)
+            if like_exists(session, user, post_id, post_created_at):
+                raise AlreadyLiked()
             session.add(like)
             session.commit()
-        except IntegrityError:
+            shards.replica_set_for(post_id).mark_written(post_id)
+        except (IntegrityError, AlreadyLiked):
             session.rollback()
             context.set_code(grpc.StatusCode.ALREADY_EXISTS)
             context.set_details('Post already liked by user')
@@ -219,18 +368,20 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             session.close()
             return posts_pb2.LikeResponse()
 
-        producer.send('post_likes', {
-            'post_id': request.post_id,
+        send_event('post_likes', {
+            'post_id': str(post_id),
             'user_id': dict(context.invocation_metadata()).get('current_user', ''),
-            'liked_at': datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+            'liked_at': datetime.datetime.utcnow()
         })
-        producer.flush()
         return posts_pb2.LikeResponse(message='Like recorded')
 
     def CreateComment(self, request, context):
-        session = SessionLocal()
+        post_id = parse_uuid(request.post_id)
+        if post_id is None:
+            return post_not_found(context, posts_pb2.CreateCommentResponse())
+        session = shards.session_for(post_id)
         try:
-            post = session.query(Post).filter(Post.id == request.post_id).first()
+            post = session.query(Post).filter(Post.id == post_id).first()
             if post is None:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details('Post not found')
@@ -254,7 +405,7 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
         now = datetime.datetime.utcnow()
 
         new_comment = Comment(
-            post_id=request.post_id,
+            post_id=post_id,
             user_id=request.user_id,
             content=request.content,
             created_at=now
@@ -262,31 +413,26 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
         session.add(new_comment)
         session.commit()
         session.refresh(new_comment)
+        shards.replica_set_for(post_id).mark_written(post_id)
 
-        producer.send('post_comments', {
-            'post_id': new_comment.post_id,
-            'comment_id': new_comment.id,
+        send_event('post_comments', {
+            'post_id': str(new_comment.post_id),
+            'comment_id': str(new_comment.id),
             'user_id': new_comment.user_id,
             'content': new_comment.content,
-            'commented_at': now.strftime("%Y-%m-%d %H:%M:%S")
+            'commented_at': now
         })
-        producer.flush()
         session.close()
 
-        return posts_pb2.CreateCommentResponse(
-            comment=posts_pb2.Comment(
-                id=new_comment.id,
-                post_id=new_comment.post_id,
-                user_id=new_comment.user_id,
-                content=new_comment.content,
-                created_at=new_comment.created_at.isoformat()
-            )
-        )
+        return posts_pb2.CreateCommentResponse(comment=comment_to_proto(new_comment))
 
     def ListComments(self, request, context):
-        session = SessionLocal()
+        post_id = parse_uuid(request.post_id)
+        if post_id is None:
+            return post_not_found(context, posts_pb2.ListCommentsResponse())
+        session = shards.read_session_for(post_id, wants_primary(context))
         try:
-            post = session.query(Post).filter(Post.id == request.post_id).first()
+            post = session.query(Post).filter(Post.id == post_id).first()
             if post is None:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details('Post not found')
@@ -307,29 +453,82 @@ class PostService(posts_pb2_grpc.PostServiceServicer):
             session.close()
             return posts_pb2.ListCommentsResponse()
 
+        # Комментарии не старше поста: условие по ключу секционирования отсекает партиции
+        # за месяцы до публикации поста
         comments = (
             session.query(Comment)
-            .filter(Comment.post_id == request.post_id)
+            .filter(Comment.post_id == post_id, Comment.created_at >= post.created_at)
+            .order_by(Comment.created_at, Comment.id)
             .offset(request.page * request.page_size)
             .limit(request.page_size)
             .all()
         )
-        proto_comments = [
-            posts_pb2.Comment(
-                id=c.id,
-                post_id=c.post_id,
-                user_id=c.user_id,
-                content=c.content,
-                created_at=c.created_at.isoformat()
-            ) for c in comments
-        ]
+        proto_comments = [comment_to_proto(c) for c in comments]
         session.close()
         return posts_pb2.ListCommentsResponse(comments=proto_comments)
 
 
+def ping_shard(session_factory):
+    session = session_factory()
+    try:
+        session.execute(text("SELECT 1"))
+        return True
+    except SQLAlchemyError:
+        return False
+    finally:
+        session.close()
+
+
+def check_dependencies():
+    database_ok = all(shards.scatter(ping_shard))
+    try:
+        kafka_ok = get_producer().bootstrap_connected()
+    except KafkaError:
+        kafka_ok = False
+    return database_ok and kafka_ok
+
+
+def watch_health(health_servicer):
+    while True:
+        status = (health_pb2.HealthCheckResponse.SERVING if check_dependencies()
+                  else health_pb2.HealthCheckResponse.NOT_SERVING)
+        health_servicer.set("", status)
+        health_servicer.set("posts.PostService", status)
+        time.sleep(HEALTH_CHECK_INTERVAL)
+
+
+def maintain_partitions():
+    while True:
+        for shard, engine in enumerate(shards.engines):
+            try:
+                ensure_partitions(engine)
+                if PARTITION_RETENTION_MONTHS:
+                    archive_partitions(engine, int(PARTITION_RETENTION_MONTHS), PARTITION_ARCHIVE_DIR, shard)
+            except (SQLAlchemyError, OSError) as e:
+                logger.warning("Partition maintenance failed: %s", e)
+        time.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+
+def wait_for_db():
+    """Схема создаётся до приёма запросов; пока база недоступна, попытка повторяется."""
+    while True:
+        try:
+            init_db()
+            return
+        except SQLAlchemyError as e:
+            logger.warning("Database is not available yet, retrying in %s s: %s", DB_INIT_RETRY_INTERVAL, e)
+            time.sleep(DB_INIT_RETRY_INTERVAL)
+
+
 def serve():
+    logging.basicConfig(level=logging.INFO)
+    wait_for_db()
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
     posts_pb2_grpc.add_PostServiceServicer_to_server(PostService(), server)
+    health_servicer = health.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
     server.add_insecure_port('[::]:50051')
     server.start()
+    threading.Thread(target=watch_health, args=(health_servicer,), daemon=True).start()
+    threading.Thread(target=maintain_partitions, daemon=True).start()
     server.wait_for_termination()
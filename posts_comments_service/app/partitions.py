@@ -0,0 +1,189 @@
+"""
+Обслуживание помесячных партиций comments и post_likes (только PostgreSQL).
+
+    python -m app.partitions ensure [--months-ahead 3]
+    python -m app.partitions archive --retention-months 12 --archive-dir /archive
+
+ensure создаёт партиции текущего и следующих месяцев, archive отсоединяет партиции
+старше retention-months, выгружает их в <archive-dir>/shard<N>/<партиция>.csv.gz и удаляет: имена
+партиций на шардах совпадают, поэтому у каждого шарда свой каталог. Legacy-партиция
+из migrations/001 (вся история до перевода) архивируется так же, когда её верхняя граница
+оказывается старше retention-months.
+"""
+import argparse
+import datetime
+import gzip
+import logging
+import os
+import re
+
+from sqlalchemy import text
+
+PARTITIONED_TABLES = ("comments", "post_likes")
+PARTITION_NAME_RE = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})_(?P<month>\d{2})$")
+PARTITION_BOUND_RE = re.compile(r"FROM \((?:'(?P<start>[^']+)'|MINVALUE)\) TO \((?:'(?P<end>[^']+)'|MAXVALUE)\)")
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(value):
+    return datetime.datetime(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def ensure_partitions(engine, months_ahead=3, now=None):
+    """Создаёт партиции с текущего месяца на months_ahead вперёд и DEFAULT-партицию на случай сбоя обслуживания."""
+    if engine.dialect.name != "postgresql":
+        return []
+    current = month_start(now or datetime.datetime.utcnow())
+    created = []
+    with engine.begin() as connection:
+        for table in PARTITIONED_TABLES:
+            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+            bounds = partition_bounds(connection, table)
+            for offset in range(months_ahead + 1):
+                start = add_months(current, offset)
+                end = add_months(start, 1)
+                # месяц может быть уже покрыт, например legacy-партицией после миграции
+                if any((low is None or low < end) and (high is None or start < high) for low, high in bounds):
+                    continue
+                name = partition_name(table, start)
+                connection.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+                ))
+                created.append(name)
+    for name in created:
+        logger.info("Created partition %s", name)
+    return created
+
+
+def attached_partitions(connection, table):
+    rows = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        # regclass — таблица из search_path, а не одноимённые таблицы других схем
+        "WHERE pg_inherits.inhparent = CAST(:table AS regclass)"
+    ), {"table": table})
+    return [row[0] for row in rows]
+
+
+def partition_ranges(connection, table):
+    """Партиция -> диапазон [start, end) для присоединённых партиций; None — MINVALUE/MAXVALUE,
+    DEFAULT не учитывается."""
+    rows = connection.execute(text(
+        "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        # regclass — таблица из search_path, а не одноимённые таблицы других схем
+        "WHERE pg_inherits.inhparent = CAST(:table AS regclass)"
+    ), {"table": table})
+    ranges = {}
+    for name, expression in rows:
+        match = PARTITION_BOUND_RE.search(expression or "")
+        if match:
+            start, end = match.group("start"), match.group("end")
+            ranges[name] = (datetime.datetime.fromisoformat(start) if start else None,
+                            datetime.datetime.fromisoformat(end) if end else None)
+    return ranges
+
+
+def partition_bounds(connection, table):
+    return list(partition_ranges(connection, table).values())
+
+
+def monthly_partitions(connection, table):
+    """Все помесячные партиции таблицы, включая уже отсоединённые, но ещё не выгруженные."""
+    rows = connection.execute(text(
+        "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE :pattern"
+    ), {"pattern": f"{table}_p%"})
+    partitions = []
+    for (name,) in rows:
+        match = PARTITION_NAME_RE.match(name)
+        if match and match.group("table") == table:
+            partitions.append((name, datetime.datetime(int(match.group("year")), int(match.group("month")), 1)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def expired_partitions(connection, table, cutoff):
+    """
+    Партиции таблицы, целиком лежащие до cutoff: помесячные — по имени, legacy — по верхней границе.
+    Отсоединённые, но ещё не выгруженные (сбой прошлого запуска) тоже попадают сюда.
+    """
+    expired = [name for name, month in monthly_partitions(connection, table) if month < cutoff]
+    legacy = f"{table}_legacy"
+    exists = connection.execute(text(
+        "SELECT 1 FROM pg_tables WHERE schemaname = current_schema() AND tablename = :name"
+    ), {"name": legacy}).first()
+    if exists:
+        ranges = partition_ranges(connection, table)
+        end = ranges[legacy][1] if legacy in ranges else cutoff
+        if end is not None and end <= cutoff:
+            expired.insert(0, legacy)
+    return expired
+
+
+def archive_partitions(engine, retention_months, archive_dir, shard=0, now=None):
+    if engine.dialect.name != "postgresql":
+        return []
+    cutoff = add_months(month_start(now or datetime.datetime.utcnow()), -retention_months)
+    archive_dir = os.path.join(archive_dir, f"shard{shard}")
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = []
+    for table in PARTITIONED_TABLES:
+        with engine.connect() as connection:
+            partitions = expired_partitions(connection, table, cutoff)
+            attached = set(attached_partitions(connection, table))
+        for name in partitions:
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            # существующий архив не перезаписывается: партиция остаётся в базе до разбора вручную
+            if os.path.exists(path):
+                raise FileExistsError(f"Archive {path} already exists, partition {name} is kept")
+            # Сначала отсоединяем: запросы к родительской таблице перестают видеть партицию,
+            # а при сбое выгрузки данные остаются в отдельной таблице до следующего запуска
+            if name in attached:
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            raw = engine.raw_connection()
+            try:
+                with gzip.open(path + ".tmp", "wb") as archive:
+                    raw.cursor().copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+                os.replace(path + ".tmp", path)
+                raw.cursor().execute(f"DROP TABLE {name}")
+                raw.commit()
+            finally:
+                raw.close()
+            logger.info("Archived partition %s to %s", name, path)
+            archived.append(name)
+    return archived
+
+
+def main():
+    from .models import shards
+
+    parser = argparse.ArgumentParser(description="Maintain monthly partitions of comments and post_likes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ensure_parser = subparsers.add_parser("ensure")
+    ensure_parser.add_argument("--months-ahead", type=int, default=3)
+    archive_parser = subparsers.add_parser("archive")
+    archive_parser.add_argument("--retention-months", type=int, required=True)
+    archive_parser.add_argument("--archive-dir", required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for shard, engine in enumerate(shards.engines):
+        if args.command == "ensure":
+            ensure_partitions(engine, args.months_ahead)
+        else:
+            archive_partitions(engine, args.retention_months, args.archive_dir, shard)
+
+
+if __name__ == "__main__":
+    main()
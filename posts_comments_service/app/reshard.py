@@ -0,0 +1,84 @@
+"""
+Перенос постов (вместе с комментариями и лайками) между раскладками шардов.
+
+    python -m app.reshard --from-urls URL1,URL2 --to-urls URL1,URL2,URL3,URL4 [--delete]
+
+Копируются только посты, у которых по новой раскладке меняется база.
+Повторный запуск безопасен: записи в целевом шарде перезаписываются через merge.
+После переключения сервиса на новую раскладку запустите с --delete,
+чтобы удалить перенесённые записи из старых шардов.
+"""
+import argparse
+import logging
+
+from .models import Base, Comment, Post, PostLike
+from .sharding import ShardRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def reshard(source, target, source_urls, target_urls, batch_size=500, delete=False):
+    moved = 0
+    for source_index, source_factory in enumerate(source.session_factories):
+        session = source_factory()
+        try:
+            last_id = None
+            while True:
+                query = session.query(Post).order_by(Post.id)
+                if last_id is not None:
+                    query = query.filter(Post.id > last_id)
+                batch = query.limit(batch_size).all()
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                for post in batch:
+                    target_index = target.index_for(post.id)
+                    if target_urls[target_index] == source_urls[source_index]:
+                        continue
+                    comments = session.query(Comment).filter(Comment.post_id == post.id).all()
+                    likes = session.query(PostLike).filter(PostLike.post_id == post.id).all()
+                    target_session = target.session_factories[target_index]()
+                    try:
+                        target_session.merge(post)
+                        target_session.flush()
+                        for row in comments + likes:
+                            target_session.merge(row)
+                        target_session.commit()
+                    finally:
+                        target_session.close()
+                    if delete:
+                        for row in comments + likes:
+                            session.delete(row)
+                        session.flush()
+                        session.delete(post)
+                    moved += 1
+                if delete:
+                    session.commit()
+                session.expunge_all()
+            logger.info("Shard %d processed, %d posts moved so far", source_index, moved)
+        finally:
+            session.close()
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move posts between shard layouts")
+    parser.add_argument("--from-urls", required=True, help="current shard URLs, comma separated")
+    parser.add_argument("--to-urls", required=True, help="new shard URLs, comma separated")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--delete", action="store_true", help="delete moved rows from source shards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    source_urls = [url.strip() for url in args.from_urls.split(",") if url.strip()]
+    target_urls = [url.strip() for url in args.to_urls.split(",") if url.strip()]
+    source = ShardRegistry.from_urls(source_urls)
+    target = ShardRegistry.from_urls(target_urls)
+    for engine in target.engines:
+        Base.metadata.create_all(bind=engine)
+    moved = reshard(source, target, source_urls, target_urls, args.batch_size, args.delete)
+    logger.info("Done, %d posts moved", moved)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import functools
+import hashlib
+from concurrent import futures
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .replicas import ReplicaSet
+
+
+def shard_index(post_id, shard_count):
+    """Стабильный номер шарда для поста: не зависит от процесса и PYTHONHASHSEED."""
+    digest = hashlib.md5(str(post_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def make_session_factory(url, **engine_kwargs):
+    return sessionmaker(autocommit=False, autoflush=False, bind=create_engine(url, **engine_kwargs))
+
+
+class ShardRegistry:
+    """
+    Набор шардов posts_db. Пост, его комментарии и лайки живут в одном шарде,
+    который выбирается по хэшу post_id. Каждый шард — ReplicaSet (primary и реплики).
+    """
+
+    def __init__(self, shards):
+        self.replica_sets = [shard if isinstance(shard, ReplicaSet) else ReplicaSet(shard) for shard in shards]
+        if not self.replica_sets:
+            raise ValueError("At least one shard is required")
+        # сразу, а не при первом scatter: его вызывают параллельно потоки gRPC-сервера
+        self._executor = futures.ThreadPoolExecutor(max_workers=len(self.replica_sets))
+
+    @classmethod
+    def from_urls(cls, urls, replica_urls=None, replica_options=None, **engine_kwargs):
+        replica_urls = replica_urls or [[] for _ in urls]
+        if len(replica_urls) != len(urls):
+            raise ValueError("Replica URL groups must match the number of shards")
+        shards = []
+        for url, replicas in zip(urls, replica_urls):
+            shards.append(ReplicaSet(
+                make_session_factory(url, **engine_kwargs),
+                [make_session_factory(replica, **engine_kwargs) for replica in replicas],
+                **(replica_options or {})
+            ))
+        return cls(shards)
+
+    def __len__(self):
+        return len(self.replica_sets)
+
+    @property
+    def session_factories(self):
+        return [replica_set.primary for replica_set in self.replica_sets]
+
+    @property
+    def engines(self):
+        return [factory.kw["bind"] for factory in self.session_factories]
+
+    def index_for(self, post_id):
+        return shard_index(post_id, len(self.replica_sets))
+
+    def replica_set_for(self, post_id):
+        return self.replica_sets[self.index_for(post_id)]
+
+    def session_for(self, post_id):
+        return self.replica_set_for(post_id).primary()
+
+    def read_session_for(self, post_id, use_primary=False):
+        return self.replica_set_for(post_id).read_session(key=post_id, use_primary=use_primary)
+
+    def scatter(self, fn, read=False, key=None, use_primary=False):
+        """
+        Вызывает fn(session_factory) на всех шардах параллельно, результаты — в порядке шардов.
+        При read=True fn получает фабрику сессий для чтения с реплик.
+        """
+        if read:
+            factories = [functools.partial(replica_set.read_session, key, use_primary)
+                         for replica_set in self.replica_sets]
+        else:
+            factories = self.session_factories
+        if len(factories) == 1:
+            return [fn(factories[0])]
+        return list(self._executor.map(fn, factories))
@@ -0,0 +1,100 @@
+"""
+Пропускная способность записи CreatePost в зависимости от числа шардов.
+
+    python -m benchmarks.bench_sharding [--posts 4000] [--clients 8]
+
+По умолчанию каждый шард — отдельный файл SQLite (запись в SQLite
+сериализуется на уровне файла, как запись на одном сервере Postgres
+упирается в один primary). Для замера на Postgres передайте список баз
+через POSTS_BENCH_DB_URLS (шарды берутся из его начала).
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent import futures
+
+import app.handlers as server_module
+from app.models import Base
+from app.sharding import ShardRegistry
+import posts_pb2
+
+
+class NullProducer:
+    def send(self, topic, value, key=None):
+        pass
+
+    def flush(self):
+        pass
+
+
+class BenchContext:
+    def set_code(self, code):
+        raise RuntimeError(f"CreatePost failed: {code}")
+
+    def set_details(self, details):
+        pass
+
+    def invocation_metadata(self):
+        return ()
+
+
+def shard_urls(count, tmpdir):
+    urls = os.getenv("POSTS_BENCH_DB_URLS")
+    if urls:
+        return urls.split(",")[:count]
+    return [f"sqlite:///{tmpdir}/shard_{count}_{i}.db" for i in range(count)]
+
+
+def prepare(urls):
+    registry = ShardRegistry.from_urls(urls, **engine_kwargs(urls))
+    for engine in registry.engines:
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+
+
+def engine_kwargs(urls):
+    if urls[0].startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False, "timeout": 60}}
+    return {}
+
+
+def worker(urls, count):
+    # Отдельный процесс на клиента, чтобы генератор нагрузки не упирался в GIL
+    server_module.shards = ShardRegistry.from_urls(urls, **engine_kwargs(urls))
+    server_module.producer = NullProducer()
+    service = server_module.PostService()
+    request = posts_pb2.CreatePostRequest(title="bench", description="bench", creator_id="bench")
+    context = BenchContext()
+    for _ in range(count):
+        service.CreatePost(request, context)
+
+
+def run(shard_count, posts, clients, tmpdir):
+    urls = shard_urls(shard_count, tmpdir)
+    prepare(urls)
+    per_client = posts // clients
+    with futures.ProcessPoolExecutor(max_workers=clients) as executor:
+        started = time.perf_counter()
+        list(executor.map(worker, [urls] * clients, [per_client] * clients))
+        elapsed = time.perf_counter() - started
+    return per_client * clients / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=4000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--shards", default="1,2,4")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        baseline = None
+        for shard_count in [int(n) for n in args.shards.split(",")]:
+            throughput = run(shard_count, args.posts, args.clients, tmpdir)
+            baseline = baseline or throughput
+            print(f"shards={shard_count}: {throughput:8.1f} posts/s  (x{throughput / baseline:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+-- Перевод существующих comments и post_likes на помесячное секционирование по created_at.
+-- Старая таблица без копирования данных становится партицией comments_legacy/post_likes_legacy
+-- для всего, что создано до начала текущего месяца; новые партиции создаёт `python -m app.partitions ensure`.
+-- Длинные шаги (построение индексов, проверка ограничений) выполняются без эксклюзивной блокировки,
+-- эксклюзивная блокировка берётся только на переименование и ATTACH в последней транзакции.
+-- Выполнять через psql (CONCURRENTLY не работает внутри транзакции): psql -f 001_partition_comments_and_likes.sql
+
+-- 1. Индексы под первичные ключи секционированных таблиц
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS comments_legacy_pkey ON comments (id, created_at);
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS post_likes_legacy_pkey ON post_likes (user_id, post_id, created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS comments_legacy_post_id_created_at ON comments (post_id, created_at);
+
+-- 2. Ограничения, доказывающие, что все строки попадают в диапазон legacy-партиции:
+--    тогда SET NOT NULL и ATTACH не сканируют таблицу. NOT VALID + VALIDATE не блокирует запись.
+--    Граница legacy-партиции — начало следующего месяца: текущий месяц дописывается в legacy.
+SELECT date_trunc('month', now() + interval '1 month') AS legacy_bound \gset
+
+UPDATE comments SET created_at = '1970-01-01' WHERE created_at IS NULL;
+UPDATE post_likes SET created_at = '1970-01-01' WHERE created_at IS NULL;
+
+ALTER TABLE comments ADD CONSTRAINT comments_legacy_range
+    CHECK (created_at IS NOT NULL AND created_at < :'legacy_bound') NOT VALID;
+ALTER TABLE comments VALIDATE CONSTRAINT comments_legacy_range;
+ALTER TABLE post_likes ADD CONSTRAINT post_likes_legacy_range
+    CHECK (created_at IS NOT NULL AND created_at < :'legacy_bound') NOT VALID;
+ALTER TABLE post_likes VALIDATE CONSTRAINT post_likes_legacy_range;
+
+-- 3. Переключение
+BEGIN;
+SET LOCAL lock_timeout = '5s';
+
+ALTER TABLE comments RENAME TO comments_legacy;
+ALTER TABLE comments_legacy ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE comments_legacy DROP CONSTRAINT comments_pkey;
+
+CREATE TABLE comments (
+    id VARCHAR NOT NULL,
+    post_id VARCHAR NOT NULL REFERENCES posts (id),
+    user_id VARCHAR NOT NULL,
+    content VARCHAR NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE INDEX ix_comments_post_id_created_at ON comments (post_id, created_at);
+
+ALTER TABLE comments ATTACH PARTITION comments_legacy FOR VALUES FROM (MINVALUE) TO (:'legacy_bound');
+
+ALTER TABLE post_likes RENAME TO post_likes_legacy;
+ALTER TABLE post_likes_legacy ALTER COLUMN created_at SET NOT NULL;
+-- PostgreSQL мог свести одинаковые PRIMARY KEY и UNIQUE в одно ограничение с любым из имён
+ALTER TABLE post_likes_legacy DROP CONSTRAINT IF EXISTS uq_user_post_like;
+ALTER TABLE post_likes_legacy DROP CONSTRAINT IF EXISTS post_likes_pkey;
+
+CREATE TABLE post_likes (
+    user_id VARCHAR NOT NULL,
+    post_id VARCHAR NOT NULL REFERENCES posts (id),
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (user_id, post_id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE INDEX ix_post_likes_post_id_user_id ON post_likes (post_id, user_id);
+
+ALTER TABLE post_likes ATTACH PARTITION post_likes_legacy FOR VALUES FROM (MINVALUE) TO (:'legacy_bound');
+
+COMMIT;
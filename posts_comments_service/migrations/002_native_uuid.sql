@@ -0,0 +1,238 @@
+-- Перевод posts.id, comments.id, comments.post_id и post_likes.post_id с varchar на нативный uuid
+-- (16 байт вместо 37, сравнение без учёта collation). Выполняется после 001, без остановки записи:
+--   1-3. теневые столбцы *_uuid, триггер заполняет их для новых строк, старые дозаполняются пачками;
+--   4.   индексы и NOT NULL-проверки для новых столбцов строятся без эксклюзивной блокировки;
+--   5.   короткая транзакция меняет столбцы местами и пересоздаёт ключи на готовых индексах;
+--   6.   внешние ключи проверяются после переключения, не блокируя запись.
+-- На время миграции остановить `python -m app.partitions` (партиции, созданные после шага 4,
+-- получат индексы при переключении, но уже с полным построением). Новую версию сервиса
+-- выкладывать сразу после шага 5.
+-- Выполнять через psql (CONCURRENTLY и COMMIT в процедуре не работают внутри транзакции):
+--   psql -f 002_native_uuid.sql
+\set ON_ERROR_STOP on
+
+-- 1. Теневые столбцы: без DEFAULT это изменение только каталога
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS id_uuid uuid;
+ALTER TABLE comments ADD COLUMN IF NOT EXISTS id_uuid uuid, ADD COLUMN IF NOT EXISTS post_id_uuid uuid;
+ALTER TABLE post_likes ADD COLUMN IF NOT EXISTS post_id_uuid uuid;
+
+-- 2. Новые и изменённые строки получают uuid сразу
+CREATE OR REPLACE FUNCTION try_uuid(value text) RETURNS uuid AS $$
+BEGIN
+    RETURN value::uuid;
+EXCEPTION WHEN invalid_text_representation THEN
+    RETURN NULL;
+END $$ LANGUAGE plpgsql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION posts_fill_uuid() RETURNS trigger AS $$
+BEGIN
+    NEW.id_uuid := try_uuid(NEW.id);
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION comments_fill_uuid() RETURNS trigger AS $$
+BEGIN
+    NEW.id_uuid := try_uuid(NEW.id);
+    NEW.post_id_uuid := try_uuid(NEW.post_id);
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION post_likes_fill_uuid() RETURNS trigger AS $$
+BEGIN
+    NEW.post_id_uuid := try_uuid(NEW.post_id);
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_fill_uuid ON posts;
+CREATE TRIGGER posts_fill_uuid BEFORE INSERT OR UPDATE ON posts
+    FOR EACH ROW EXECUTE FUNCTION posts_fill_uuid();
+DROP TRIGGER IF EXISTS comments_fill_uuid ON comments;
+CREATE TRIGGER comments_fill_uuid BEFORE INSERT OR UPDATE ON comments
+    FOR EACH ROW EXECUTE FUNCTION comments_fill_uuid();
+DROP TRIGGER IF EXISTS post_likes_fill_uuid ON post_likes;
+CREATE TRIGGER post_likes_fill_uuid BEFORE INSERT OR UPDATE ON post_likes
+    FOR EACH ROW EXECUTE FUNCTION post_likes_fill_uuid();
+
+-- 3. Дозаполнение существующих строк пачками по первичному ключу, каждая пачка — своя транзакция
+CREATE OR REPLACE PROCEDURE backfill_uuid_columns(batch_size integer DEFAULT 5000) AS $$
+DECLARE
+    last_id text := '';
+    last_post_id text := '';
+    last_created timestamp := '-infinity';
+BEGIN
+    LOOP
+        WITH batch AS (
+            SELECT id FROM posts WHERE id > last_id ORDER BY id LIMIT batch_size
+        ), updated AS (
+            UPDATE posts SET id_uuid = try_uuid(posts.id) FROM batch WHERE posts.id = batch.id
+            RETURNING posts.id
+        )
+        SELECT max(id) INTO last_id FROM updated;
+        COMMIT;
+        EXIT WHEN last_id IS NULL;
+    END LOOP;
+
+    last_id := '';
+    LOOP
+        WITH batch AS (
+            SELECT id, created_at FROM comments WHERE (id, created_at) > (last_id, last_created)
+            ORDER BY id, created_at LIMIT batch_size
+        ), updated AS (
+            UPDATE comments SET id_uuid = try_uuid(comments.id), post_id_uuid = try_uuid(comments.post_id)
+            FROM batch WHERE comments.id = batch.id AND comments.created_at = batch.created_at
+            RETURNING comments.id, comments.created_at
+        )
+        SELECT id, created_at INTO last_id, last_created FROM updated ORDER BY id DESC, created_at DESC LIMIT 1;
+        COMMIT;
+        EXIT WHEN last_id IS NULL;
+    END LOOP;
+
+    last_id := '';
+    last_created := '-infinity';
+    LOOP
+        WITH batch AS (
+            SELECT user_id, post_id, created_at FROM post_likes
+            WHERE (user_id, post_id, created_at) > (last_id, last_post_id, last_created)
+            ORDER BY user_id, post_id, created_at LIMIT batch_size
+        ), updated AS (
+            UPDATE post_likes SET post_id_uuid = try_uuid(post_likes.post_id)
+            FROM batch WHERE post_likes.user_id = batch.user_id AND post_likes.post_id = batch.post_id
+                AND post_likes.created_at = batch.created_at
+            RETURNING post_likes.user_id, post_likes.post_id, post_likes.created_at
+        )
+        SELECT user_id, post_id, created_at INTO last_id, last_post_id, last_created
+        FROM updated ORDER BY user_id DESC, post_id DESC, created_at DESC LIMIT 1;
+        COMMIT;
+        EXIT WHEN last_id IS NULL;
+    END LOOP;
+END $$ LANGUAGE plpgsql;
+
+CALL backfill_uuid_columns();
+
+-- Строки, id которых не является UUID, нужно исправить или удалить вручную: с ними шаг 4 упадёт
+SELECT 'posts' AS table_name, count(*) AS invalid_ids FROM posts WHERE id_uuid IS NULL
+UNION ALL
+SELECT 'comments', count(*) FROM comments WHERE id_uuid IS NULL OR post_id_uuid IS NULL
+UNION ALL
+SELECT 'post_likes', count(*) FROM post_likes WHERE post_id_uuid IS NULL;
+
+-- 4. Индексы под будущие ключи и проверки NOT NULL. На секционированных таблицах CONCURRENTLY
+--    возможен только по партициям; проверки тоже ставятся на партиции, NOT VALID + VALIDATE не блокируют запись.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS posts_id_uuid_pkey ON posts (id_uuid);
+ALTER TABLE posts DROP CONSTRAINT IF EXISTS posts_id_uuid_not_null;
+ALTER TABLE posts ADD CONSTRAINT posts_id_uuid_not_null CHECK (id_uuid IS NOT NULL) NOT VALID;
+ALTER TABLE posts VALIDATE CONSTRAINT posts_id_uuid_not_null;
+
+SELECT format('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS %I ON %I (id_uuid, created_at)',
+              child.relname || '_uuid_pkey', child.relname),
+       format('CREATE INDEX CONCURRENTLY IF NOT EXISTS %I ON %I (post_id_uuid, created_at)',
+              child.relname || '_uuid_post_id', child.relname),
+       format('ALTER TABLE %I DROP CONSTRAINT IF EXISTS %I', child.relname, child.relname || '_uuid_not_null'),
+       format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (id_uuid IS NOT NULL AND post_id_uuid IS NOT NULL) NOT VALID',
+              child.relname, child.relname || '_uuid_not_null'),
+       format('ALTER TABLE %I VALIDATE CONSTRAINT %I', child.relname, child.relname || '_uuid_not_null')
+FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE pg_inherits.inhparent = 'comments'::regclass
+\gexec
+
+SELECT format('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS %I ON %I (user_id, post_id_uuid, created_at)',
+              child.relname || '_uuid_pkey', child.relname),
+       format('CREATE INDEX CONCURRENTLY IF NOT EXISTS %I ON %I (post_id_uuid, user_id)',
+              child.relname || '_uuid_post_id', child.relname),
+       format('ALTER TABLE %I DROP CONSTRAINT IF EXISTS %I', child.relname, child.relname || '_uuid_not_null'),
+       format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (post_id_uuid IS NOT NULL) NOT VALID',
+              child.relname, child.relname || '_uuid_not_null'),
+       format('ALTER TABLE %I VALIDATE CONSTRAINT %I', child.relname, child.relname || '_uuid_not_null')
+FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE pg_inherits.inhparent = 'post_likes'::regclass
+\gexec
+
+-- 5. Переключение: только изменения каталога, данные не переписываются
+BEGIN;
+SET LOCAL lock_timeout = '5s';
+LOCK TABLE posts, comments, post_likes IN ACCESS EXCLUSIVE MODE;
+
+DROP TRIGGER posts_fill_uuid ON posts;
+DROP TRIGGER comments_fill_uuid ON comments;
+DROP TRIGGER post_likes_fill_uuid ON post_likes;
+
+-- Внешние ключи ссылаются на старый posts.id, после переключения они создаются заново
+DO $$
+DECLARE
+    constraint_row record;
+BEGIN
+    FOR constraint_row IN
+        SELECT conrelid::regclass AS table_name, conname FROM pg_constraint
+        WHERE contype = 'f' AND confrelid = 'posts'::regclass AND conparentid = 0
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', constraint_row.table_name, constraint_row.conname);
+    END LOOP;
+END $$;
+
+ALTER TABLE posts DROP CONSTRAINT posts_pkey;
+-- дубль первичного ключа, который создавал index=True в старой модели
+DROP INDEX IF EXISTS ix_posts_id;
+ALTER TABLE posts ALTER COLUMN id_uuid SET NOT NULL;
+ALTER TABLE posts DROP CONSTRAINT posts_id_uuid_not_null;
+ALTER TABLE posts DROP COLUMN id;
+ALTER TABLE posts RENAME COLUMN id_uuid TO id;
+ALTER TABLE posts ADD CONSTRAINT posts_pkey PRIMARY KEY USING INDEX posts_id_uuid_pkey;
+
+ALTER TABLE comments DROP CONSTRAINT comments_pkey;
+DROP INDEX ix_comments_post_id_created_at;
+ALTER TABLE comments ALTER COLUMN id_uuid SET NOT NULL, ALTER COLUMN post_id_uuid SET NOT NULL;
+ALTER TABLE comments DROP COLUMN id, DROP COLUMN post_id;
+ALTER TABLE comments RENAME COLUMN id_uuid TO id;
+ALTER TABLE comments RENAME COLUMN post_id_uuid TO post_id;
+
+ALTER TABLE post_likes DROP CONSTRAINT post_likes_pkey;
+DROP INDEX ix_post_likes_post_id_user_id;
+ALTER TABLE post_likes ALTER COLUMN post_id_uuid SET NOT NULL;
+ALTER TABLE post_likes DROP COLUMN post_id;
+ALTER TABLE post_likes RENAME COLUMN post_id_uuid TO post_id;
+
+-- Первичный ключ секционированной таблицы подхватывает первичные ключи партиций, а не просто
+-- уникальные индексы, поэтому сначала ключи ставятся на партиции поверх построенных индексов.
+-- Внешние ключи партиций создаются NOT VALID и начинают действовать для новых строк сразу.
+DO $$
+DECLARE
+    partition_row record;
+BEGIN
+    FOR partition_row IN
+        SELECT parent.relname AS parent_name, child.relname AS child_name
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname IN ('comments', 'post_likes')
+    LOOP
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT IF EXISTS %I',
+                       partition_row.child_name, partition_row.child_name || '_uuid_not_null');
+        IF to_regclass(partition_row.child_name || '_uuid_pkey') IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I PRIMARY KEY USING INDEX %I',
+                           partition_row.child_name, partition_row.child_name || '_pkey',
+                           partition_row.child_name || '_uuid_pkey');
+        END IF;
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I FOREIGN KEY (post_id) REFERENCES posts (id) NOT VALID',
+                       partition_row.child_name, partition_row.child_name || '_post_id_fkey');
+    END LOOP;
+END $$;
+
+ALTER TABLE comments ADD PRIMARY KEY (id, created_at);
+CREATE INDEX ix_comments_post_id_created_at ON comments (post_id, created_at);
+ALTER TABLE post_likes ADD PRIMARY KEY (user_id, post_id, created_at);
+CREATE INDEX ix_post_likes_post_id_user_id ON post_likes (post_id, user_id);
+
+COMMIT;
+
+-- 6. Проверка внешних ключей партиций (SHARE UPDATE EXCLUSIVE, запись не блокируется)
+--    и общий ключ на родительской таблице, который подхватывает уже проверенные ключи партиций
+SELECT format('ALTER TABLE %I VALIDATE CONSTRAINT %I', child.relname, child.relname || '_post_id_fkey')
+FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE pg_inherits.inhparent IN ('comments'::regclass, 'post_likes'::regclass)
+\gexec
+
+ALTER TABLE comments ADD CONSTRAINT comments_post_id_fkey FOREIGN KEY (post_id) REFERENCES posts (id);
+ALTER TABLE post_likes ADD CONSTRAINT post_likes_post_id_fkey FOREIGN KEY (post_id) REFERENCES posts (id);
+
+DROP PROCEDURE backfill_uuid_columns(integer);
+DROP FUNCTION posts_fill_uuid(), comments_fill_uuid(), post_likes_fill_uuid(), try_uuid(text);
@@ -6,6 +6,7 @@ from kafka.errors import KafkaError
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.models import Base, Post
+from app.sharding import ShardRegistry
 from app.handlers import PostService
 import posts_pb2
 
@@ -52,12 +53,15 @@ def consume_messages(topic, timeout=5):
 
 @pytest.fixture
 def service(monkeypatch):
+    import app.events
     import app.handlers
-    monkeypatch.setattr(app.handlers, 'SessionLocal', TestingSessionLocal)
+    monkeypatch.setattr(app.handlers, 'shards', ShardRegistry([TestingSessionLocal]))
+    # Тесты читают JSON из исходных топиков
+    monkeypatch.setattr(app.events, 'EVENT_FORMAT', 'json')
 
     producer = KafkaProducer(
         bootstrap_servers=['kafka:9092'],
-        value_serializer=lambda v: json.dumps(v).encode('utf-8')
+        key_serializer=lambda k: k.encode('utf-8')
     )
     monkeypatch.setattr(app.handlers, 'producer', producer)
 
@@ -84,9 +88,8 @@ def test_post(clean_db):
     import uuid
     session = TestingSessionLocal()
     try:
-        post_id = f"kafka_test_post_{str(uuid.uuid4())[:8]}"
         post = Post(
-            id=post_id,
+            id=uuid.uuid4(),
             title="Kafka Test Post",
             description="Test description",
             creator_id="test_user",
@@ -102,11 +105,11 @@ def test_post(clean_db):
 
 
 def test_get_post_sends_view_event(service, test_post):
-    request = posts_pb2.GetPostRequest(id=test_post.id)
+    request = posts_pb2.GetPostRequest(id=str(test_post.id))
     context = DummyContext()
     response = service.GetPost(request, context)
 
-    assert response.post.id == test_post.id
+    assert response.post.id == str(test_post.id)
     assert response.post.title == "Kafka Test Post"
 
     time.sleep(1)
@@ -114,13 +117,13 @@ def test_get_post_sends_view_event(service, test_post):
     assert len(messages) > 0
 
     view_event = messages[0]
-    assert view_event['post_id'] == test_post.id
+    assert view_event['post_id'] == str(test_post.id)
     assert view_event['user_id'] == "test_user"
     assert 'viewed_at' in view_event
 
 
 def test_like_post_sends_like_event(service, test_post):
-    request = posts_pb2.LikeRequest(post_id=test_post.id)
+    request = posts_pb2.LikeRequest(post_id=str(test_post.id))
     context = DummyContext()
     response = service.LikePost(request, context)
     assert response.message == "Like recorded"
@@ -131,14 +134,14 @@ def test_like_post_sends_like_event(service, test_post):
     assert len(messages) > 0
 
     like_event = messages[0]
-    assert like_event['post_id'] == test_post.id
+    assert like_event['post_id'] == str(test_post.id)
     assert like_event['user_id'] == "test_user"
     assert 'liked_at' in like_event
 
 
 def test_create_comment_sends_comment_event(service, test_post):
     request = posts_pb2.CreateCommentRequest(
-        post_id=test_post.id,
+        post_id=str(test_post.id),
         user_id="commenter",
         content="Test Kafka comment"
     )
@@ -146,13 +149,13 @@ def test_create_comment_sends_comment_event(service, test_post):
     response = service.CreateComment(request, context)
 
     assert response.comment.content == "Test Kafka comment"
-    assert response.comment.post_id == test_post.id
+    assert response.comment.post_id == str(test_post.id)
 
     time.sleep(1)
     messages = consume_messages('post_comments')
     assert len(messages) > 0
     comment_event = messages[0]
-    assert comment_event['post_id'] == test_post.id
+    assert comment_event['post_id'] == str(test_post.id)
     assert comment_event['user_id'] == "commenter"
     assert comment_event['content'] == "Test Kafka comment"
     assert 'comment_id' in comment_event
@@ -1,8 +1,11 @@
+import uuid
+
 import pytest
 import grpc
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.models import Base, Post, Comment, PostLike
+from app.sharding import ShardRegistry
 from app.handlers import PostService
 import posts_pb2
 
@@ -36,10 +39,10 @@ def db_session():
 @pytest.fixture
 def service(db_session, monkeypatch):
     import app.handlers
-    monkeypatch.setattr(app.handlers, 'SessionLocal', TestingSessionLocal)
+    monkeypatch.setattr(app.handlers, 'shards', ShardRegistry([TestingSessionLocal]))
 
     class MockProducer:
-        def send(self, topic, data): pass
+        def send(self, topic, data, key=None): pass
 
         def flush(self): pass
 
@@ -66,7 +69,7 @@ def test_create_post_integration(service, db_session):
 
 def test_like_post_integration(service, db_session):
     post = Post(
-        id="test_post_id",
+        id=uuid.uuid4(),
         title="Test",
         description="Desc",
         creator_id="test_user"
@@ -85,7 +88,7 @@ def test_like_post_integration(service, db_session):
 
 def test_create_comment_integration(service, db_session):
     post = Post(
-        id="comment_test_id",
+        id=uuid.uuid4(),
         title="Test",
         description="Desc",
         creator_id="test_user"
@@ -0,0 +1,153 @@
+import datetime
+import gzip
+import os
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from app.models import Base, Comment, Post
+from app.partitions import add_months, archive_partitions, attached_partitions, ensure_partitions, partition_name
+from app.sharding import make_session_factory
+
+# Проверка на настоящем PostgreSQL: POSTS_TEST_DB_URL=postgresql://... pytest tests/test_partitions.py
+POSTGRES_URL = os.getenv("POSTS_TEST_DB_URL")
+
+
+def test_add_months():
+    assert add_months(datetime.datetime(2025, 11, 1), 3) == datetime.datetime(2026, 2, 1)
+    assert add_months(datetime.datetime(2025, 1, 1), -1) == datetime.datetime(2024, 12, 1)
+
+
+def test_partition_name():
+    assert partition_name("comments", datetime.datetime(2025, 3, 1)) == "comments_p2025_03"
+
+
+@pytest.fixture
+def pg_session_factory():
+    if not POSTGRES_URL:
+        pytest.skip("POSTS_TEST_DB_URL is not set")
+    factory = make_session_factory(POSTGRES_URL)
+    engine = factory.kw["bind"]
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS comments, post_likes, posts CASCADE"))
+    Base.metadata.create_all(bind=engine)
+    yield factory
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS comments, post_likes, posts CASCADE"))
+
+
+def test_partition_lifecycle(pg_session_factory, tmp_path):
+    engine = pg_session_factory.kw["bind"]
+    created = ensure_partitions(engine, months_ahead=2, now=datetime.datetime(2025, 1, 15))
+    assert "comments_p2025_01" in created and "post_likes_p2025_03" in created
+
+    post_id = uuid.uuid4()
+    session = pg_session_factory()
+    session.add(Post(id=post_id, title="t", description="d", creator_id="u", created_at=datetime.datetime(2025, 1, 2)))
+    session.flush()
+    session.add_all([
+        Comment(post_id=post_id, user_id="u", content="old", created_at=datetime.datetime(2025, 1, 3)),
+        Comment(post_id=post_id, user_id="u", content="new", created_at=datetime.datetime(2025, 3, 3)),
+    ])
+    session.commit()
+
+    plan = "\n".join(row[0] for row in session.execute(text(
+        "EXPLAIN SELECT * FROM comments WHERE post_id = :post_id AND created_at >= '2025-02-01'"
+    ), {"post_id": post_id}))
+    session.close()
+    assert "comments_p2025_03" in plan
+    assert "comments_p2025_01" not in plan
+
+    archived = archive_partitions(engine, retention_months=1, archive_dir=str(tmp_path),
+                                  now=datetime.datetime(2025, 3, 10))
+    assert "comments_p2025_01" in archived
+    with gzip.open(tmp_path / "shard0" / "comments_p2025_01.csv.gz", "rt") as archive:
+        assert "old" in archive.read()
+
+    session = pg_session_factory()
+    assert [c.content for c in session.query(Comment).all()] == ["new"]
+    session.close()
+
+
+def test_legacy_partition_archived_after_retention(pg_session_factory, tmp_path):
+    engine = pg_session_factory.kw["bind"]
+    # как после migrations/001: вся прежняя таблица — одна партиция до начала месяца перевода
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE comments_legacy PARTITION OF comments FOR VALUES FROM (MINVALUE) TO ('2025-01-01')"
+        ))
+    ensure_partitions(engine, months_ahead=2, now=datetime.datetime(2025, 1, 15))
+
+    post_id = uuid.uuid4()
+    session = pg_session_factory()
+    session.add(Post(id=post_id, title="t", description="d", creator_id="u", created_at=datetime.datetime(2024, 6, 1)))
+    session.flush()
+    session.add(Comment(post_id=post_id, user_id="u", content="legacy", created_at=datetime.datetime(2024, 6, 2)))
+    session.commit()
+    session.close()
+
+    # граница legacy-партиции (2025-01-01) позже отсечки 2024-12-01: партиция остаётся
+    archived = archive_partitions(engine, retention_months=3, archive_dir=str(tmp_path),
+                                  now=datetime.datetime(2025, 3, 10))
+    assert "comments_legacy" not in archived
+
+    archived = archive_partitions(engine, retention_months=2, archive_dir=str(tmp_path),
+                                  now=datetime.datetime(2025, 3, 10))
+    assert archived[0] == "comments_legacy"
+    with gzip.open(tmp_path / "shard0" / "comments_legacy.csv.gz", "rt") as archive:
+        assert "legacy" in archive.read()
+    session = pg_session_factory()
+    assert session.query(Comment).count() == 0
+    session.close()
+
+
+@pytest.fixture
+def second_shard_factory(pg_session_factory):
+    # второй шард — отдельная схема той же базы: имена таблиц и партиций совпадают, как на настоящих шардах
+    engine = pg_session_factory.kw["bind"]
+    with engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA IF EXISTS shard1 CASCADE"))
+        connection.execute(text("CREATE SCHEMA shard1"))
+    factory = make_session_factory(POSTGRES_URL, connect_args={"options": "-csearch_path=shard1"})
+    Base.metadata.create_all(bind=factory.kw["bind"])
+    yield factory
+    factory.kw["bind"].dispose()
+    with engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA IF EXISTS shard1 CASCADE"))
+
+
+def test_archives_of_shards_do_not_overwrite_each_other(pg_session_factory, second_shard_factory, tmp_path):
+    now = datetime.datetime(2025, 3, 10)
+    for shard, factory in enumerate((pg_session_factory, second_shard_factory)):
+        ensure_partitions(factory.kw["bind"], months_ahead=2, now=datetime.datetime(2025, 1, 15))
+        post_id = uuid.uuid4()
+        session = factory()
+        session.add(Post(id=post_id, title="t", description="d", creator_id="u",
+                         created_at=datetime.datetime(2025, 1, 2)))
+        session.flush()
+        session.add(Comment(post_id=post_id, user_id="u", content=f"shard {shard}",
+                            created_at=datetime.datetime(2025, 1, 3)))
+        session.commit()
+        session.close()
+
+    for shard, factory in enumerate((pg_session_factory, second_shard_factory)):
+        archived = archive_partitions(factory.kw["bind"], retention_months=1, archive_dir=str(tmp_path),
+                                      shard=shard, now=now)
+        assert "comments_p2025_01" in archived
+    for shard in (0, 1):
+        with gzip.open(tmp_path / f"shard{shard}" / "comments_p2025_01.csv.gz", "rt") as archive:
+            assert f"shard {shard}" in archive.read()
+
+
+def test_existing_archive_is_not_overwritten(pg_session_factory, tmp_path):
+    engine = pg_session_factory.kw["bind"]
+    ensure_partitions(engine, months_ahead=2, now=datetime.datetime(2025, 1, 15))
+    (tmp_path / "shard0").mkdir()
+    (tmp_path / "shard0" / "comments_p2025_01.csv.gz").write_bytes(b"earlier")
+
+    with pytest.raises(FileExistsError):
+        archive_partitions(engine, retention_months=1, archive_dir=str(tmp_path), now=datetime.datetime(2025, 3, 10))
+    assert (tmp_path / "shard0" / "comments_p2025_01.csv.gz").read_bytes() == b"earlier"
+    with engine.connect() as connection:
+        assert "comments_p2025_01" in attached_partitions(connection, "comments")
@@ -1,9 +1,14 @@
 import pytest
 import datetime
+import json
+import uuid
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.models import Base, Post
+from app.sharding import ShardRegistry
 from app.handlers import PostService, post_to_proto
+from app import events
+import events_pb2
 import posts_pb2
 import grpc
 
@@ -15,7 +20,27 @@ Base.metadata.create_all(bind=engine)
 
 import app.handlers as server_module
 
-server_module.SessionLocal = TestingSessionLocal
+server_module.shards = ShardRegistry([TestingSessionLocal])
+
+
+class DummyProducer:
+    def __init__(self):
+        self.sent = []
+        self.keys = []
+
+    def send(self, topic, value, key=None):
+        self.sent.append((topic, value))
+        self.keys.append(key)
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def producer(monkeypatch):
+    dummy = DummyProducer()
+    monkeypatch.setattr(server_module, "producer", dummy)
+    return dummy
 
 
 class DummyContext:
@@ -75,6 +100,18 @@ def test_get_post(service, context):
     assert get_response.post.title == "Test Post"
 
 
+def test_get_post_id_forms(service, context):
+    create_request = posts_pb2.CreatePostRequest(title="Test Post", description="Description", creator_id="testuser")
+    post_id = service.CreatePost(create_request, context).post.id
+
+    # id хранится как uuid, поэтому запись в верхнем регистре указывает на тот же пост
+    get_response = service.GetPost(posts_pb2.GetPostRequest(id=post_id.upper()), context)
+    assert get_response.post.id == post_id
+
+    service.GetPost(posts_pb2.GetPostRequest(id="not-a-uuid"), context)
+    assert context.code == grpc.StatusCode.NOT_FOUND
+
+
 def test_update_post(service, context):
     create_request = posts_pb2.CreatePostRequest(
         title="Original Title",
@@ -431,3 +468,74 @@ def test_list_comments_nonexistent(service, context):
     list_req = posts_pb2.ListCommentsRequest(post_id='nope', page=0, page_size=10)
     list_resp = service.ListComments(list_req, context)
     assert context.code == grpc.StatusCode.NOT_FOUND
+
+
+def test_view_event_sent(service, context, producer):
+    create_req = posts_pb2.CreatePostRequest(
+        title='Viewed', description='x', creator_id='user', is_private=False, tags=[]
+    )
+    post_id = service.CreatePost(create_req, context).post.id
+    context.metadata = (('current_user', 'viewer'),)
+    service.GetPost(posts_pb2.GetPostRequest(id=post_id), context)
+    topic, value = producer.sent[-1]
+    assert topic == 'post_views_v2'
+    event = events_pb2.PostView.FromString(value)
+    assert str(uuid.UUID(bytes=event.post_id)) == post_id
+    assert event.user_id == 'viewer'
+    assert abs(event.viewed_at - datetime.datetime.now(datetime.timezone.utc).timestamp()) < 60
+    assert event.viewed_at_ms // 1000 == event.viewed_at
+    assert uuid.UUID(bytes=event.event_id).version == 4
+    assert producer.keys[-1] == post_id
+
+
+def test_events_get_distinct_ids(service, context, producer):
+    post_id = service.CreatePost(posts_pb2.CreatePostRequest(
+        title='Viewed twice', description='x', creator_id='user', is_private=False, tags=[]
+    ), context).post.id
+    service.GetPost(posts_pb2.GetPostRequest(id=post_id), context)
+    service.GetPost(posts_pb2.GetPostRequest(id=post_id), context)
+    first, second = [events_pb2.PostView.FromString(value) for _, value in producer.sent[-2:]]
+    assert first.event_id != second.event_id
+
+
+def test_comment_event_sent_as_json(service, context, producer, monkeypatch):
+    monkeypatch.setattr(events, "EVENT_FORMAT", "json")
+    create_req = posts_pb2.CreatePostRequest(
+        title='Commented', description='x', creator_id='user', is_private=False, tags=[]
+    )
+    post_id = service.CreatePost(create_req, context).post.id
+    service.CreateComment(posts_pb2.CreateCommentRequest(post_id=post_id, user_id='commenter', content='hi'), context)
+    topic, value = producer.sent[-1]
+    assert topic == 'post_comments'
+    event = json.loads(value)
+    assert (event['post_id'], event['user_id'], event['content']) == (post_id, 'commenter', 'hi')
+    datetime.datetime.strptime(event['commented_at'], "%Y-%m-%d %H:%M:%S.%f")
+    uuid.UUID(event['event_id'])
+
+
+def test_get_post_when_kafka_unavailable(service, context, monkeypatch):
+    def unavailable():
+        raise server_module.NoBrokersAvailable()
+
+    monkeypatch.setattr(server_module, "get_producer", unavailable)
+    create_req = posts_pb2.CreatePostRequest(
+        title='No Kafka', description='x', creator_id='user', is_private=False, tags=[]
+    )
+    post_id = service.CreatePost(create_req, context).post.id
+    response = service.GetPost(posts_pb2.GetPostRequest(id=post_id), context)
+    assert response.post.id == post_id
+    assert context.code is None
+
+
+def test_wait_for_db_retries_until_schema_created(monkeypatch):
+    attempts = []
+
+    def init_db():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise server_module.SQLAlchemyError("connection refused")
+
+    monkeypatch.setattr(server_module, "init_db", init_db)
+    monkeypatch.setattr(server_module, "DB_INIT_RETRY_INTERVAL", 0)
+    server_module.wait_for_db()
+    assert len(attempts) == 3
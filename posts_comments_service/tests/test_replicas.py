@@ -0,0 +1,111 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.handlers as server_module
+from app.handlers import PostService
+from app.models import Base
+from app.replicas import ReplicaSet
+from app.sharding import ShardRegistry
+import posts_pb2
+
+
+def make_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+class DummyProducer:
+    def send(self, topic, value, key=None):
+        pass
+
+    def flush(self):
+        pass
+
+
+class DummyContext:
+    def __init__(self, metadata=(("current_user", "user"),)):
+        self.code = None
+        self.details = None
+        self.metadata = metadata
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+    def invocation_metadata(self):
+        return self.metadata
+
+
+def test_reads_round_robin_over_replicas():
+    primary, first, second = make_factory(), make_factory(), make_factory()
+    replica_set = ReplicaSet(primary, [first, second], lag_probe=lambda factory: 0)
+    binds = [replica_set.read_session().get_bind() for _ in range(4)]
+    assert binds == [first.kw["bind"], second.kw["bind"], first.kw["bind"], second.kw["bind"]]
+
+
+def test_lagging_replica_is_skipped():
+    primary, fresh, lagging = make_factory(), make_factory(), make_factory()
+    lags = {fresh: 0.5, lagging: 30}
+    replica_set = ReplicaSet(primary, [lagging, fresh], max_lag=5, lag_probe=lambda factory: lags[factory])
+    assert {replica_set.read_session().get_bind() for _ in range(4)} == {fresh.kw["bind"]}
+
+    lags[fresh] = 60
+    replica_set.lag_check_interval = 0
+    assert replica_set.read_session().get_bind() is primary.kw["bind"]
+
+
+def test_recent_writes_read_from_primary():
+    primary, replica = make_factory(), make_factory()
+    replica_set = ReplicaSet(primary, [replica], read_your_writes_window=60, lag_probe=lambda factory: 0)
+    replica_set.mark_written("post-1")
+    assert replica_set.read_session(key="post-1").get_bind() is primary.kw["bind"]
+    assert replica_set.read_session(key="post-2").get_bind() is replica.kw["bind"]
+    assert replica_set.read_session(key="post-2", use_primary=True).get_bind() is primary.kw["bind"]
+
+
+@pytest.fixture
+def replica_set(monkeypatch):
+    replica_set = ReplicaSet(make_factory(), [make_factory()], read_your_writes_window=60,
+                             lag_probe=lambda factory: 0)
+    monkeypatch.setattr(server_module, "shards", ShardRegistry([replica_set]))
+    monkeypatch.setattr(server_module, "producer", DummyProducer())
+    return replica_set
+
+
+def test_get_post_routing(replica_set):
+    service = PostService()
+    request = posts_pb2.CreatePostRequest(title="t", description="d", creator_id="user")
+    post_id = service.CreatePost(request, DummyContext()).post.id
+
+    # Только что созданный пост читается из primary, хотя реплика его ещё не получила
+    context = DummyContext()
+    assert service.GetPost(posts_pb2.GetPostRequest(id=post_id), context).post.id == post_id
+    assert len(service.ListPosts(posts_pb2.ListPostsRequest(page=0, page_size=10), context).posts) == 1
+
+    replica_set.read_your_writes_window = 0
+    context = DummyContext()
+    service.GetPost(posts_pb2.GetPostRequest(id=post_id), context)
+    assert context.code == server_module.grpc.StatusCode.NOT_FOUND
+
+    context = DummyContext((("current_user", "user"), ("read_primary", "1")))
+    assert service.GetPost(posts_pb2.GetPostRequest(id=post_id), context).post.id == post_id
+
+
+@pytest.mark.parametrize("write", ["update", "delete"])
+def test_post_writes_pin_creator_list_to_primary(replica_set, write):
+    service = PostService()
+    request = posts_pb2.CreatePostRequest(title="t", description="d", creator_id="user")
+    post_id = service.CreatePost(request, DummyContext()).post.id
+    replica_set._recent_writes.clear()
+
+    if write == "update":
+        service.UpdatePost(posts_pb2.UpdatePostRequest(id=post_id, title="new"), DummyContext())
+    else:
+        service.DeletePost(posts_pb2.DeletePostRequest(id=post_id), DummyContext())
+    # ListPosts автора после правки или удаления не должен читать отстающую реплику
+    assert replica_set.recently_written("user:user")
@@ -0,0 +1,139 @@
+from concurrent import futures
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.handlers as server_module
+from app.handlers import PostService
+from app.models import Base, Post, Comment, PostLike
+from app.reshard import reshard
+from app.sharding import ShardRegistry, shard_index
+import posts_pb2
+
+
+def make_registry(count):
+    factories = []
+    for _ in range(count):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        factories.append(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+    return ShardRegistry(factories)
+
+
+class DummyProducer:
+    def send(self, topic, value, key=None):
+        pass
+
+    def flush(self):
+        pass
+
+
+class DummyContext:
+    def __init__(self, user="user"):
+        self.code = None
+        self.details = None
+        self.metadata = (("current_user", user),)
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+    def invocation_metadata(self):
+        return self.metadata
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = make_registry(3)
+    monkeypatch.setattr(server_module, "shards", registry)
+    monkeypatch.setattr(server_module, "producer", DummyProducer())
+    return registry
+
+
+def count_rows(registry, model):
+    counts = []
+    for factory in registry.session_factories:
+        session = factory()
+        counts.append(session.query(model).count())
+        session.close()
+    return counts
+
+
+def create_post(service, title, creator="user", is_private=False):
+    request = posts_pb2.CreatePostRequest(title=title, description="d", creator_id=creator,
+                                          is_private=is_private, tags=[])
+    return service.CreatePost(request, DummyContext(creator)).post
+
+
+def test_shard_index_is_stable():
+    assert shard_index("5f0c7a4e-3c1f-4a55-9a57-7d4bb5a8d4c1", 4) == shard_index(
+        "5f0c7a4e-3c1f-4a55-9a57-7d4bb5a8d4c1", 4)
+    assert {shard_index(str(i), 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def test_post_comments_and_likes_are_colocated(registry):
+    service = PostService()
+    post = create_post(service, "Colocated")
+    context = DummyContext()
+    service.CreateComment(posts_pb2.CreateCommentRequest(post_id=post.id, user_id="user", content="c"), context)
+    service.LikePost(posts_pb2.LikeRequest(post_id=post.id, user_id="user"), context)
+
+    index = registry.index_for(post.id)
+    for model in (Post, Comment, PostLike):
+        counts = count_rows(registry, model)
+        assert counts[index] == 1
+        assert sum(counts) == 1
+
+    response = service.ListComments(posts_pb2.ListCommentsRequest(post_id=post.id, page=0, page_size=10), context)
+    assert [c.content for c in response.comments] == ["c"]
+
+
+def test_scatter_from_many_threads_shares_one_executor():
+    registry = make_registry(3)
+    executor = registry._executor
+    with futures.ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: registry.scatter(lambda factory: factory), range(32)))
+    assert all(result == registry.session_factories for result in results)
+    assert registry._executor is executor
+    assert len(executor._threads) <= 3
+
+
+def test_list_posts_scatter_gather(registry):
+    service = PostService()
+    created = [create_post(service, f"Post {i}").id for i in range(12)]
+    create_post(service, "Hidden", creator="other", is_private=True)
+    assert all(count > 0 for count in count_rows(registry, Post))
+
+    context = DummyContext()
+    pages = []
+    for page in range(4):
+        response = service.ListPosts(posts_pb2.ListPostsRequest(page=page, page_size=5), context)
+        pages.append([p.id for p in response.posts])
+    assert [len(p) for p in pages] == [5, 5, 2, 0]
+    assert sum(pages, []) == created
+
+
+def test_reshard_moves_posts_with_children(registry):
+    service = PostService()
+    posts = [create_post(service, f"Post {i}").id for i in range(20)]
+    context = DummyContext()
+    for post_id in posts:
+        service.CreateComment(posts_pb2.CreateCommentRequest(post_id=post_id, user_id="user", content="c"), context)
+
+    target = ShardRegistry(registry.session_factories + make_registry(2).session_factories)
+    source_urls = ["a", "b", "c"]
+    target_urls = ["a", "b", "c", "d", "e"]
+    moved = reshard(registry, target, source_urls, target_urls, batch_size=7, delete=True)
+
+    assert moved == sum(1 for post_id in posts if target.index_for(post_id) != registry.index_for(post_id))
+    assert sum(count_rows(target, Post)) == 20
+    assert sum(count_rows(target, Comment)) == 20
+    for post_id in posts:
+        session = target.session_for(post_id)
+        assert session.query(Post).filter(Post.id == post_id).count() == 1
+        assert session.query(Comment).filter(Comment.post_id == post_id).count() == 1
+        session.close()
@@ -1,22 +1,52 @@
+-- Сырые события. post_id и comment_id — UUID из posts_service (16 байт вместо 36 символов). user_id —
+-- имя пользователя: различных имён много, поэтому ZSTD сжимает его лучше, чем LowCardinality.
+-- Время сжимается Delta + ZSTD: внутри поста события идут по возрастанию времени.
+-- Партиции помесячные; части старше 90 дней TTL переносит на холодный том политики hot_cold
+-- (stats_clickhouse/config.d/storage.xml). Проекция by_user — копия лайков и комментариев в порядке
+-- user_id для запросов по пользователю; у просмотров её нет: в порядке user_id post_id почти не
+-- сжимается, и копия была бы больше самой таблицы. Текст комментариев здесь не хранится — он нужен
+-- только posts_service. Перевод существующих таблиц — stats_clickhouse/migrations/001_events_layout.sql,
+-- сравнение со старой схемой — stats_service/benchmarks/bench_events_layout.py.
+-- event_id — идентификатор события от продюсера, время — с миллисекундами. Повторно доставленное событие
+-- совпадает с первым по всему ключу сортировки, и ReplacingMergeTree оставляет одну строку при слияниях;
+-- до слияния запросы считают события через uniqExact(event_id), а не count(), и FINAL не нужен.
+-- Проекция by_user при слиянии с удалением повторов перестраивается (deduplicate_merge_projection_mode).
+-- non_replicated_deduplication_window — отбрасывание повторной вставки того же блока
+-- (insert_deduplication_token воркера app.ingest). Перевод таблиц — migrations/003_event_ids.sql.
 CREATE TABLE IF NOT EXISTS likes (
-    user_id String,
-    post_id String,
-    liked_at DateTime
-) ENGINE = MergeTree()
-ORDER BY (post_id, liked_at);
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    event_id UUID,
+    liked_at DateTime64(3) CODEC(Delta, ZSTD(1)),
+    PROJECTION by_user (SELECT * ORDER BY user_id, liked_at)
+) ENGINE = ReplacingMergeTree()
+PARTITION BY toYYYYMM(liked_at)
+ORDER BY (post_id, liked_at, event_id)
+TTL toDateTime(liked_at) + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold', non_replicated_deduplication_window = 1000,
+    deduplicate_merge_projection_mode = 'rebuild';
 
 CREATE TABLE IF NOT EXISTS views (
-    user_id String,
-    post_id String,
-    viewed_at DateTime
-) ENGINE = MergeTree()
-ORDER BY (post_id, viewed_at);
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    event_id UUID,
+    viewed_at DateTime64(3) CODEC(Delta, ZSTD(1))
+) ENGINE = ReplacingMergeTree()
+PARTITION BY toYYYYMM(viewed_at)
+ORDER BY (post_id, viewed_at, event_id)
+TTL toDateTime(viewed_at) + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold', non_replicated_deduplication_window = 1000;
 
 CREATE TABLE IF NOT EXISTS comments (
-    user_id String,
-    post_id String,
-    comment_id String,
-    content String,
-    commented_at DateTime
-) ENGINE = MergeTree()
-ORDER BY (post_id, commented_at);
\ No newline at end of file
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    comment_id UUID,
+    event_id UUID,
+    commented_at DateTime64(3) CODEC(Delta, ZSTD(1)),
+    PROJECTION by_user (SELECT * ORDER BY user_id, commented_at)
+) ENGINE = ReplacingMergeTree()
+PARTITION BY toYYYYMM(commented_at)
+ORDER BY (post_id, commented_at, event_id)
+TTL toDateTime(commented_at) + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold', non_replicated_deduplication_window = 1000,
+    deduplicate_merge_projection_mode = 'rebuild';
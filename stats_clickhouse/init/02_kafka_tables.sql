@@ -1,37 +1,228 @@
+-- Чтение топиков событий. Продюсеры задают ключ post_id, поэтому события поста лежат в одной партиции.
+-- Каждый из kafka_num_consumers консьюмеров читает свои партиции и в своём потоке
+-- (kafka_thread_per_consumer) пишет блоки до kafka_max_block_size строк; консьюмеров не больше,
+-- чем партиций топика (kafka/create_topics.sh), лишние простаивают.
+-- Сообщения, которые не разбираются, не останавливают чтение партиции
+-- (kafka_handle_error_mode = 'stream'): они попадают в kafka_dead_letters.
+-- kafka_* читают JSON из исходных топиков, kafka_*_v2 — protobuf (events.proto из
+-- stats_clickhouse/format_schemas) из топиков *_v2; и те и другие пишут в одни и те же *_stream.
 CREATE TABLE IF NOT EXISTS kafka_likes (
     user_id String,
     post_id String,
-    liked_at DateTime
+    event_id String,
+    liked_at DateTime64(3)
 ) ENGINE = Kafka
 SETTINGS
     kafka_broker_list = 'kafka:9092',
     kafka_topic_list = 'post_likes',
     kafka_group_name = 'clickhouse-group-likes',
     kafka_format = 'JSONEachRow',
-    kafka_num_consumers = 1;
+    kafka_num_consumers = 2,
+    kafka_thread_per_consumer = 1,
+    kafka_max_block_size = 262144,
+    kafka_poll_max_batch_size = 65536,
+    kafka_handle_error_mode = 'stream';
 
 CREATE TABLE IF NOT EXISTS kafka_views (
     user_id String,
     post_id String,
-    viewed_at DateTime
+    event_id String,
+    viewed_at DateTime64(3)
 ) ENGINE = Kafka
 SETTINGS
     kafka_broker_list = 'kafka:9092',
     kafka_topic_list = 'post_views',
     kafka_group_name = 'clickhouse-group-views',
     kafka_format = 'JSONEachRow',
-    kafka_num_consumers = 1;
+    kafka_num_consumers = 4,
+    kafka_thread_per_consumer = 1,
+    kafka_max_block_size = 262144,
+    kafka_poll_max_batch_size = 65536,
+    kafka_handle_error_mode = 'stream';
 
 CREATE TABLE IF NOT EXISTS kafka_comments (
     user_id String,
     post_id String,
     comment_id String,
     content String,
-    commented_at DateTime
+    event_id String,
+    commented_at DateTime64(3)
 ) ENGINE = Kafka
 SETTINGS
     kafka_broker_list = 'kafka:9092',
     kafka_topic_list = 'post_comments',
     kafka_group_name = 'clickhouse-group-comments',
     kafka_format = 'JSONEachRow',
-    kafka_num_consumers = 1;
\ No newline at end of file
+    kafka_num_consumers = 2,
+    kafka_thread_per_consumer = 1,
+    kafka_max_block_size = 262144,
+    kafka_poll_max_batch_size = 65536,
+    kafka_handle_error_mode = 'stream';
+
+-- Идентификаторы в protobuf — 16 байт UUID. Время берётся из *_ms, у сообщений без него — из секундного
+-- поля. У сообщений без event_id (в JSON-топиках тоже) он пустой, идентификатор назначают представления 03
+CREATE TABLE IF NOT EXISTS kafka_likes_v2 (
+    user_id String,
+    post_id FixedString(16),
+    event_id FixedString(16),
+    liked_at DateTime,
+    liked_at_ms Int64
+) ENGINE = Kafka
+SETTINGS
+    kafka_broker_list = 'kafka:9092',
+    kafka_topic_list = 'post_likes_v2',
+    kafka_group_name = 'clickhouse-group-likes-v2',
+    kafka_format = 'ProtobufSingle',
+    kafka_schema = 'events.proto:PostLike',
+    kafka_num_consumers = 2,
+    kafka_thread_per_consumer = 1,
+    kafka_max_block_size = 262144,
+    kafka_poll_max_batch_size = 65536,
+    kafka_handle_error_mode = 'stream';
+
+CREATE TABLE IF NOT EXISTS kafka_views_v2 (
+    user_id String,
+    post_id FixedString(16),
+    event_id FixedString(16),
+    viewed_at DateTime,
+    viewed_at_ms Int64
+) ENGINE = Kafka
+SETTINGS
+    kafka_broker_list = 'kafka:9092',
+    kafka_topic_list = 'post_views_v2',
+    kafka_group_name = 'clickhouse-group-views-v2',
+    kafka_format = 'ProtobufSingle',
+    kafka_schema = 'events.proto:PostView',
+    kafka_num_consumers = 4,
+    kafka_thread_per_consumer = 1,
+    kafka_max_block_size = 262144,
+    kafka_poll_max_batch_size = 65536,
+    kafka_handle_error_mode = 'stream';
+
+CREATE TABLE IF NOT EXISTS kafka_comments_v2 (
+    user_id String,
+    post_id FixedString(16),
+    comment_id FixedString(16),
+    event_id FixedString(16),
+    commented_at DateTime,
+    commented_at_ms Int64
+) ENGINE = Kafka
+SETTINGS
+    kafka_broker_list = 'kafka:9092',
+    kafka_topic_list = 'post_comments_v2',
+    kafka_group_name = 'clickhouse-group-comments-v2',
+    kafka_format = 'ProtobufSingle',
+    kafka_schema = 'events.proto:PostComment',
+    kafka_num_consumers = 2,
+    kafka_thread_per_consumer = 1,
+    kafka_max_block_size = 262144,
+    kafka_poll_max_batch_size = 65536,
+    kafka_handle_error_mode = 'stream';
+
+-- Разобранные события. Null-таблицы ничего не хранят: из них читают представления 03–07, так что
+-- у Kafka-таблицы одно представление для событий и всё прочитанное либо доходит до всех таблиц, либо
+-- перечитывается целиком.
+CREATE TABLE IF NOT EXISTS likes_stream (
+    user_id String,
+    post_id String,
+    event_id String,
+    liked_at DateTime64(3)
+) ENGINE = Null;
+
+CREATE TABLE IF NOT EXISTS views_stream (
+    user_id String,
+    post_id String,
+    event_id String,
+    viewed_at DateTime64(3)
+) ENGINE = Null;
+
+CREATE TABLE IF NOT EXISTS comments_stream (
+    user_id String,
+    post_id String,
+    comment_id String,
+    event_id String,
+    commented_at DateTime64(3)
+) ENGINE = Null;
+
+-- Неразобранные сообщения: исходный текст (protobuf — в base64) и ошибка, хранятся 30 дней
+CREATE TABLE IF NOT EXISTS kafka_dead_letters (
+    topic LowCardinality(String),
+    partition UInt64,
+    offset UInt64,
+    raw_message String CODEC(ZSTD(1)),
+    error String,
+    received_at DateTime
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(received_at)
+ORDER BY (topic, received_at)
+TTL received_at + INTERVAL 30 DAY;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_likes_stream TO likes_stream AS
+SELECT user_id, post_id, event_id, liked_at
+FROM kafka_likes
+WHERE length(_error) = 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_views_stream TO views_stream AS
+SELECT user_id, post_id, event_id, viewed_at
+FROM kafka_views
+WHERE length(_error) = 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_comments_stream TO comments_stream AS
+SELECT user_id, post_id, comment_id, event_id, commented_at
+FROM kafka_comments
+WHERE length(_error) = 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_likes_dead_letters TO kafka_dead_letters AS
+SELECT _topic AS topic, _partition AS partition, _offset AS offset,
+       _raw_message AS raw_message, _error AS error, now() AS received_at
+FROM kafka_likes
+WHERE length(_error) > 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_views_dead_letters TO kafka_dead_letters AS
+SELECT _topic AS topic, _partition AS partition, _offset AS offset,
+       _raw_message AS raw_message, _error AS error, now() AS received_at
+FROM kafka_views
+WHERE length(_error) > 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_comments_dead_letters TO kafka_dead_letters AS
+SELECT _topic AS topic, _partition AS partition, _offset AS offset,
+       _raw_message AS raw_message, _error AS error, now() AS received_at
+FROM kafka_comments
+WHERE length(_error) > 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_likes_v2_stream TO likes_stream AS
+SELECT user_id, UUIDNumToString(post_id) AS post_id, if(empty(event_id), '', UUIDNumToString(event_id)) AS event_id,
+       if(liked_at_ms = 0, toDateTime64(liked_at, 3), fromUnixTimestamp64Milli(liked_at_ms)) AS liked_at
+FROM kafka_likes_v2
+WHERE length(_error) = 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_views_v2_stream TO views_stream AS
+SELECT user_id, UUIDNumToString(post_id) AS post_id, if(empty(event_id), '', UUIDNumToString(event_id)) AS event_id,
+       if(viewed_at_ms = 0, toDateTime64(viewed_at, 3), fromUnixTimestamp64Milli(viewed_at_ms)) AS viewed_at
+FROM kafka_views_v2
+WHERE length(_error) = 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_comments_v2_stream TO comments_stream AS
+SELECT user_id, UUIDNumToString(post_id) AS post_id, UUIDNumToString(comment_id) AS comment_id,
+       if(empty(event_id), '', UUIDNumToString(event_id)) AS event_id,
+       if(commented_at_ms = 0, toDateTime64(commented_at, 3), fromUnixTimestamp64Milli(commented_at_ms)) AS commented_at
+FROM kafka_comments_v2
+WHERE length(_error) = 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_likes_v2_dead_letters TO kafka_dead_letters AS
+SELECT _topic AS topic, _partition AS partition, _offset AS offset,
+       base64Encode(_raw_message) AS raw_message, _error AS error, now() AS received_at
+FROM kafka_likes_v2
+WHERE length(_error) > 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_views_v2_dead_letters TO kafka_dead_letters AS
+SELECT _topic AS topic, _partition AS partition, _offset AS offset,
+       base64Encode(_raw_message) AS raw_message, _error AS error, now() AS received_at
+FROM kafka_views_v2
+WHERE length(_error) > 0;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_comments_v2_dead_letters TO kafka_dead_letters AS
+SELECT _topic AS topic, _partition AS partition, _offset AS offset,
+       base64Encode(_raw_message) AS raw_message, _error AS error, now() AS received_at
+FROM kafka_comments_v2
+WHERE length(_error) > 0;
@@ -1,11 +1,83 @@
+-- Повторно доставленные события (повтор отправки у продюсера, повторное чтение топика) отбрасываются до
+-- сырых таблиц и счётчиков 04–07: из *_stream в *_deduplicated проходят только события, которых ещё нет в
+-- сырой таблице. Повтор совпадает с первым событием по post_id, времени и event_id, поэтому он ищется по
+-- ключу сортировки сырой таблицы — только среди постов блока и в пределах его времени (в представлении
+-- *_stream — это вставляемый блок, и в подзапросах тоже). Повторы внутри блока отбрасывает LIMIT 1 BY.
+-- Сырые таблицы и счётчики пишутся из *_deduplicated, то есть после проверки.
+-- Событию без event_id назначается случайный: с нулевым разные события одного момента схлопнулись бы в одно
+CREATE TABLE IF NOT EXISTS likes_deduplicated (
+    user_id String,
+    post_id String,
+    event_id String,
+    liked_at DateTime64(3)
+) ENGINE = Null;
+
+CREATE TABLE IF NOT EXISTS views_deduplicated (
+    user_id String,
+    post_id String,
+    event_id String,
+    viewed_at DateTime64(3)
+) ENGINE = Null;
+
+CREATE TABLE IF NOT EXISTS comments_deduplicated (
+    user_id String,
+    post_id String,
+    comment_id String,
+    event_id String,
+    commented_at DateTime64(3)
+) ENGINE = Null;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_likes_deduplicated TO likes_deduplicated AS
+SELECT user_id, post_id, event_id, liked_at
+FROM (
+    SELECT user_id, post_id, toString(ifNull(toUUIDOrNull(event_id), generateUUIDv4())) AS event_id, liked_at
+    FROM likes_stream
+)
+WHERE (toUUIDOrZero(post_id), toUUID(event_id)) NOT IN (
+    SELECT post_id, event_id FROM likes
+    WHERE post_id IN (SELECT toUUIDOrZero(post_id) FROM likes_stream)
+      AND liked_at BETWEEN (SELECT min(liked_at) FROM likes_stream) AND (SELECT max(liked_at) FROM likes_stream)
+)
+LIMIT 1 BY event_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_views_deduplicated TO views_deduplicated AS
+SELECT user_id, post_id, event_id, viewed_at
+FROM (
+    SELECT user_id, post_id, toString(ifNull(toUUIDOrNull(event_id), generateUUIDv4())) AS event_id, viewed_at
+    FROM views_stream
+)
+WHERE (toUUIDOrZero(post_id), toUUID(event_id)) NOT IN (
+    SELECT post_id, event_id FROM views
+    WHERE post_id IN (SELECT toUUIDOrZero(post_id) FROM views_stream)
+      AND viewed_at BETWEEN (SELECT min(viewed_at) FROM views_stream) AND (SELECT max(viewed_at) FROM views_stream)
+)
+LIMIT 1 BY event_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_comments_deduplicated TO comments_deduplicated AS
+SELECT user_id, post_id, comment_id, event_id, commented_at
+FROM (
+    SELECT user_id, post_id, comment_id, toString(ifNull(toUUIDOrNull(event_id), generateUUIDv4())) AS event_id,
+           commented_at
+    FROM comments_stream
+)
+WHERE (toUUIDOrZero(post_id), toUUID(event_id)) NOT IN (
+    SELECT post_id, event_id FROM comments
+    WHERE post_id IN (SELECT toUUIDOrZero(post_id) FROM comments_stream)
+      AND commented_at BETWEEN (SELECT min(commented_at) FROM comments_stream)
+                           AND (SELECT max(commented_at) FROM comments_stream)
+)
+LIMIT 1 BY event_id;
+
+-- Некорректный UUID превращается в нулевой, а не останавливает чтение топика
 CREATE MATERIALIZED VIEW IF NOT EXISTS mv_likes TO likes AS
-SELECT user_id, post_id, liked_at
-FROM kafka_likes;
+SELECT user_id, toUUIDOrZero(post_id) AS post_id, toUUID(event_id) AS event_id, liked_at
+FROM likes_deduplicated;
 
 CREATE MATERIALIZED VIEW IF NOT EXISTS mv_views TO views AS
-SELECT user_id, post_id, viewed_at
-FROM kafka_views;
+SELECT user_id, toUUIDOrZero(post_id) AS post_id, toUUID(event_id) AS event_id, viewed_at
+FROM views_deduplicated;
 
 CREATE MATERIALIZED VIEW IF NOT EXISTS mv_comments TO comments AS
-SELECT user_id, post_id, comment_id, content, commented_at
-FROM kafka_comments;
\ No newline at end of file
+SELECT user_id, toUUIDOrZero(post_id) AS post_id, toUUIDOrZero(comment_id) AS comment_id,
+       toUUID(event_id) AS event_id, commented_at
+FROM comments_deduplicated;
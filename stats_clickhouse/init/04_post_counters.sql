@@ -0,0 +1,28 @@
+-- Счётчики событий по постам: SummingMergeTree складывает строки с одинаковым post_id при слияниях,
+-- поэтому читать нужно через sum(). Заполняются из *_deduplicated,
+-- как и сырые таблицы: повторно доставленные события туда не доходят (03).
+-- Повтор вставки с тем же insert_deduplication_token (app.ingest) отбрасывается здесь и в таблицах 05–07
+-- (non_replicated_deduplication_window), поэтому повторённая вставка не удваивает счётчики.
+CREATE TABLE IF NOT EXISTS post_counters (
+    post_id String,
+    views UInt64,
+    likes UInt64,
+    comments UInt64
+) ENGINE = SummingMergeTree()
+ORDER BY post_id
+SETTINGS non_replicated_deduplication_window = 1000;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_counters_views TO post_counters AS
+SELECT post_id, count() AS views, 0 AS likes, 0 AS comments
+FROM views_deduplicated
+GROUP BY post_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_counters_likes TO post_counters AS
+SELECT post_id, 0 AS views, count() AS likes, 0 AS comments
+FROM likes_deduplicated
+GROUP BY post_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_counters_comments TO post_counters AS
+SELECT post_id, 0 AS views, 0 AS likes, count() AS comments
+FROM comments_deduplicated
+GROUP BY post_id;
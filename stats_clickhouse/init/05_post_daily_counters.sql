@@ -0,0 +1,27 @@
+-- Посуточные счётчики по постам для истории просмотров, лайков и комментариев.
+-- Строки текущего дня приходят частями и схлопываются фоновыми слияниями, поэтому читать через sum() ... GROUP BY.
+CREATE TABLE IF NOT EXISTS post_daily_counters (
+    post_id String,
+    date Date,
+    views UInt64,
+    likes UInt64,
+    comments UInt64
+) ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (post_id, date)
+SETTINGS non_replicated_deduplication_window = 1000;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_daily_counters_views TO post_daily_counters AS
+SELECT post_id, toDate(viewed_at) AS date, count() AS views, 0 AS likes, 0 AS comments
+FROM views_deduplicated
+GROUP BY post_id, date;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_daily_counters_likes TO post_daily_counters AS
+SELECT post_id, toDate(liked_at) AS date, 0 AS views, count() AS likes, 0 AS comments
+FROM likes_deduplicated
+GROUP BY post_id, date;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_daily_counters_comments TO post_daily_counters AS
+SELECT post_id, toDate(commented_at) AS date, 0 AS views, 0 AS likes, count() AS comments
+FROM comments_deduplicated
+GROUP BY post_id, date;
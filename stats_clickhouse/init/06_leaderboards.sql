@@ -0,0 +1,79 @@
+-- Счётчики для рейтингов GetTopTenPosts/GetTopTenUsers. За всё время посты берутся из post_counters,
+-- пользователи — из user_counters; для окон до недели — почасовые таблицы, старше 8 дней удаляются по TTL.
+CREATE TABLE IF NOT EXISTS user_counters (
+    user_id String,
+    views UInt64,
+    likes UInt64,
+    comments UInt64
+) ENGINE = SummingMergeTree()
+ORDER BY user_id
+SETTINGS non_replicated_deduplication_window = 1000;
+
+CREATE TABLE IF NOT EXISTS post_hourly_counters (
+    hour DateTime,
+    post_id String,
+    views UInt64,
+    likes UInt64,
+    comments UInt64
+) ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMMDD(hour)
+ORDER BY (hour, post_id)
+TTL hour + INTERVAL 8 DAY
+SETTINGS non_replicated_deduplication_window = 1000;
+
+CREATE TABLE IF NOT EXISTS user_hourly_counters (
+    hour DateTime,
+    user_id String,
+    views UInt64,
+    likes UInt64,
+    comments UInt64
+) ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMMDD(hour)
+ORDER BY (hour, user_id)
+TTL hour + INTERVAL 8 DAY
+SETTINGS non_replicated_deduplication_window = 1000;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_user_counters_views TO user_counters AS
+SELECT user_id, count() AS views, 0 AS likes, 0 AS comments
+FROM views_deduplicated
+GROUP BY user_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_user_counters_likes TO user_counters AS
+SELECT user_id, 0 AS views, count() AS likes, 0 AS comments
+FROM likes_deduplicated
+GROUP BY user_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_user_counters_comments TO user_counters AS
+SELECT user_id, 0 AS views, 0 AS likes, count() AS comments
+FROM comments_deduplicated
+GROUP BY user_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_hourly_counters_views TO post_hourly_counters AS
+SELECT toStartOfHour(viewed_at) AS hour, post_id, count() AS views, 0 AS likes, 0 AS comments
+FROM views_deduplicated
+GROUP BY hour, post_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_hourly_counters_likes TO post_hourly_counters AS
+SELECT toStartOfHour(liked_at) AS hour, post_id, 0 AS views, count() AS likes, 0 AS comments
+FROM likes_deduplicated
+GROUP BY hour, post_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_hourly_counters_comments TO post_hourly_counters AS
+SELECT toStartOfHour(commented_at) AS hour, post_id, 0 AS views, 0 AS likes, count() AS comments
+FROM comments_deduplicated
+GROUP BY hour, post_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_user_hourly_counters_views TO user_hourly_counters AS
+SELECT toStartOfHour(viewed_at) AS hour, user_id, count() AS views, 0 AS likes, 0 AS comments
+FROM views_deduplicated
+GROUP BY hour, user_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_user_hourly_counters_likes TO user_hourly_counters AS
+SELECT toStartOfHour(liked_at) AS hour, user_id, 0 AS views, count() AS likes, 0 AS comments
+FROM likes_deduplicated
+GROUP BY hour, user_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_user_hourly_counters_comments TO user_hourly_counters AS
+SELECT toStartOfHour(commented_at) AS hour, user_id, 0 AS views, 0 AS likes, count() AS comments
+FROM comments_deduplicated
+GROUP BY hour, user_id;
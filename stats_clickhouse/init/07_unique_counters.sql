@@ -0,0 +1,29 @@
+-- Уникальные зрители, лайкнувшие и комментаторы по постам и дням: состояния uniqCombined (HyperLogLog
+-- с точным режимом для малых множеств), ошибка около 1%, размер состояния ограничен. Состояния за разные
+-- дни и части объединяются uniqCombinedMerge(), поэтому повторная вставка тех же событий не меняет результат.
+CREATE TABLE IF NOT EXISTS post_unique_daily (
+    post_id String,
+    date Date,
+    viewers AggregateFunction(uniqCombined, String),
+    likers AggregateFunction(uniqCombined, String),
+    commenters AggregateFunction(uniqCombined, String)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (post_id, date)
+SETTINGS non_replicated_deduplication_window = 1000;
+
+-- Незаполненные столбцы получают пустое состояние
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_unique_daily_views TO post_unique_daily AS
+SELECT post_id, toDate(viewed_at) AS date, uniqCombinedState(user_id) AS viewers
+FROM views_deduplicated
+GROUP BY post_id, date;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_unique_daily_likes TO post_unique_daily AS
+SELECT post_id, toDate(liked_at) AS date, uniqCombinedState(user_id) AS likers
+FROM likes_deduplicated
+GROUP BY post_id, date;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_post_unique_daily_comments TO post_unique_daily AS
+SELECT post_id, toDate(commented_at) AS date, uniqCombinedState(user_id) AS commenters
+FROM comments_deduplicated
+GROUP BY post_id, date;
@@ -0,0 +1,83 @@
+-- Перевод likes, views и comments на схему 01_create_main_tables.sql: UUID вместо String, ZSTD,
+-- Delta + ZSTD для времени, помесячные партиции, проекция by_user, перенос старых частей на холодный том,
+-- без текста комментариев. Нужны политика hot_cold (stats_clickhouse/config.d/storage.xml, сервер
+-- перезапустить после её добавления) и база Atomic (по умолчанию). События не теряются:
+--   1. Kafka-таблицы отсоединяются: чтение топиков останавливается, offset'ы групп сохраняются,
+--      новые события копятся в Kafka, а сырые таблицы и счётчики больше не меняются;
+--   2. события копируются в таблицы новой схемы, таблицы меняются местами, старые остаются как *_old;
+--   3. Kafka-таблицы подключаются и дочитывают топики. mv_likes, mv_views и mv_comments пишут в таблицы
+--      по имени, то есть уже в новые: до замены запроса post_id приводится к UUID обычным CAST, а content
+--      отбрасывается. Блок с некорректным UUID не записывается и перечитывается после замены запроса.
+-- Новую версию stats_service выкладывать сразу после миграции: в запросах к сырым таблицам post_id — UUID.
+-- *_old удалить после проверки (DROP TABLE likes_old и т.д.).
+--   clickhouse-client --database stats_db --multiquery < 001_events_layout.sql
+
+-- 1. Остановить загрузку
+DETACH TABLE kafka_likes;
+DETACH TABLE kafka_views;
+DETACH TABLE kafka_comments;
+
+-- 2. Таблицы новой схемы (как в 01_create_main_tables.sql)
+CREATE TABLE likes_new (
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    liked_at DateTime CODEC(Delta, ZSTD(1)),
+    PROJECTION by_user (SELECT * ORDER BY user_id, liked_at)
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(liked_at)
+ORDER BY (post_id, liked_at)
+TTL liked_at + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold';
+
+CREATE TABLE views_new (
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    viewed_at DateTime CODEC(Delta, ZSTD(1))
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(viewed_at)
+ORDER BY (post_id, viewed_at)
+TTL viewed_at + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold';
+
+CREATE TABLE comments_new (
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    comment_id UUID,
+    commented_at DateTime CODEC(Delta, ZSTD(1)),
+    PROJECTION by_user (SELECT * ORDER BY user_id, commented_at)
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(commented_at)
+ORDER BY (post_id, commented_at)
+TTL commented_at + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold';
+
+-- Один INSERT на таблицу: блок может содержать события многих месяцев
+INSERT INTO likes_new SELECT user_id, toUUIDOrZero(post_id), liked_at FROM likes
+SETTINGS max_partitions_per_insert_block = 1000;
+INSERT INTO views_new SELECT user_id, toUUIDOrZero(post_id), viewed_at FROM views
+SETTINGS max_partitions_per_insert_block = 1000;
+INSERT INTO comments_new SELECT user_id, toUUIDOrZero(post_id), toUUIDOrZero(comment_id), commented_at FROM comments
+SETTINGS max_partitions_per_insert_block = 1000;
+
+EXCHANGE TABLES likes AND likes_new;
+EXCHANGE TABLES views AND views_new;
+EXCHANGE TABLES comments AND comments_new;
+
+RENAME TABLE likes_new TO likes_old, views_new TO views_old, comments_new TO comments_old;
+
+-- 3. Возобновить загрузку, запросы представлений — как в 03_materialized_views.sql
+ATTACH TABLE kafka_likes;
+ATTACH TABLE kafka_views;
+ATTACH TABLE kafka_comments;
+
+ALTER TABLE mv_likes MODIFY QUERY
+SELECT user_id, toUUIDOrZero(post_id) AS post_id, liked_at
+FROM kafka_likes;
+
+ALTER TABLE mv_views MODIFY QUERY
+SELECT user_id, toUUIDOrZero(post_id) AS post_id, viewed_at
+FROM kafka_views;
+
+ALTER TABLE mv_comments MODIFY QUERY
+SELECT user_id, toUUIDOrZero(post_id) AS post_id, toUUIDOrZero(comment_id) AS comment_id, commented_at
+FROM kafka_comments;
@@ -0,0 +1,115 @@
+-- Перевод событий на схему с event_id и временем с миллисекундами (01–07): сырые таблицы — ReplacingMergeTree
+-- с event_id в ключе сортировки, *_stream и Kafka-таблицы — с event_id и DateTime64(3), таблицы счётчиков —
+-- с non_replicated_deduplication_window. Выполнять после 002_kafka_ingestion.sql. События не теряются:
+--   1. удаляются представления, читающие Kafka-таблицы, и сами Kafka-таблицы (как в 002): чтение топиков
+--      останавливается, offset'ы групп сохраняются. Воркер app.ingest, если он используется, остановить;
+--   2. в *_stream добавляется event_id, время — DateTime64(3);
+--   3. события копируются в сырые таблицы новой схемы, уже загруженным событиям назначаются случайные
+--      event_id; таблицы меняются местами, старые остаются как *_old. Представления 03 пишут в таблицы по
+--      имени, их запросы заменяются на запросы 03_materialized_views.sql;
+--   4. таблицам счётчиков включается отбрасывание повторных вставок;
+--   5. повторно выполняется init-скрипт 02: Kafka-таблицы новой схемы продолжают с offset'ов групп.
+-- *_old удалить после проверки (DROP TABLE likes_old и т.д.).
+--   clickhouse-client --database stats_db --multiquery < 003_event_ids.sql
+--   clickhouse-client --database stats_db --multiquery < ../init/02_kafka_tables.sql
+
+-- 1. Остановить загрузку
+DROP TABLE mv_likes_stream;
+DROP TABLE mv_views_stream;
+DROP TABLE mv_comments_stream;
+DROP TABLE mv_likes_dead_letters;
+DROP TABLE mv_views_dead_letters;
+DROP TABLE mv_comments_dead_letters;
+DROP TABLE mv_likes_v2_stream;
+DROP TABLE mv_views_v2_stream;
+DROP TABLE mv_comments_v2_stream;
+DROP TABLE mv_likes_v2_dead_letters;
+DROP TABLE mv_views_v2_dead_letters;
+DROP TABLE mv_comments_v2_dead_letters;
+
+DROP TABLE kafka_likes;
+DROP TABLE kafka_views;
+DROP TABLE kafka_comments;
+DROP TABLE kafka_likes_v2;
+DROP TABLE kafka_views_v2;
+DROP TABLE kafka_comments_v2;
+
+-- 2. Разобранные события
+ALTER TABLE likes_stream ADD COLUMN event_id String AFTER post_id, MODIFY COLUMN liked_at DateTime64(3);
+ALTER TABLE views_stream ADD COLUMN event_id String AFTER post_id, MODIFY COLUMN viewed_at DateTime64(3);
+ALTER TABLE comments_stream ADD COLUMN event_id String AFTER comment_id, MODIFY COLUMN commented_at DateTime64(3);
+
+-- 3. Сырые события (как в 01_create_main_tables.sql)
+CREATE TABLE likes_new (
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    event_id UUID,
+    liked_at DateTime64(3) CODEC(Delta, ZSTD(1)),
+    PROJECTION by_user (SELECT * ORDER BY user_id, liked_at)
+) ENGINE = ReplacingMergeTree()
+PARTITION BY toYYYYMM(liked_at)
+ORDER BY (post_id, liked_at, event_id)
+TTL toDateTime(liked_at) + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold', non_replicated_deduplication_window = 1000,
+    deduplicate_merge_projection_mode = 'rebuild';
+
+CREATE TABLE views_new (
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    event_id UUID,
+    viewed_at DateTime64(3) CODEC(Delta, ZSTD(1))
+) ENGINE = ReplacingMergeTree()
+PARTITION BY toYYYYMM(viewed_at)
+ORDER BY (post_id, viewed_at, event_id)
+TTL toDateTime(viewed_at) + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold', non_replicated_deduplication_window = 1000;
+
+CREATE TABLE comments_new (
+    user_id String CODEC(ZSTD(1)),
+    post_id UUID CODEC(ZSTD(1)),
+    comment_id UUID,
+    event_id UUID,
+    commented_at DateTime64(3) CODEC(Delta, ZSTD(1)),
+    PROJECTION by_user (SELECT * ORDER BY user_id, commented_at)
+) ENGINE = ReplacingMergeTree()
+PARTITION BY toYYYYMM(commented_at)
+ORDER BY (post_id, commented_at, event_id)
+TTL toDateTime(commented_at) + INTERVAL 90 DAY TO VOLUME 'cold'
+SETTINGS storage_policy = 'hot_cold', non_replicated_deduplication_window = 1000,
+    deduplicate_merge_projection_mode = 'rebuild';
+
+INSERT INTO likes_new SELECT user_id, post_id, generateUUIDv4(), liked_at FROM likes
+SETTINGS max_partitions_per_insert_block = 1000;
+INSERT INTO views_new SELECT user_id, post_id, generateUUIDv4(), viewed_at FROM views
+SETTINGS max_partitions_per_insert_block = 1000;
+INSERT INTO comments_new SELECT user_id, post_id, comment_id, generateUUIDv4(), commented_at FROM comments
+SETTINGS max_partitions_per_insert_block = 1000;
+
+EXCHANGE TABLES likes AND likes_new;
+EXCHANGE TABLES views AND views_new;
+EXCHANGE TABLES comments AND comments_new;
+
+RENAME TABLE likes_new TO likes_old, views_new TO views_old, comments_new TO comments_old;
+
+ALTER TABLE mv_likes MODIFY QUERY
+SELECT user_id, toUUIDOrZero(post_id) AS post_id,
+       ifNull(toUUIDOrNull(event_id), generateUUIDv4()) AS event_id, liked_at
+FROM likes_stream;
+
+ALTER TABLE mv_views MODIFY QUERY
+SELECT user_id, toUUIDOrZero(post_id) AS post_id,
+       ifNull(toUUIDOrNull(event_id), generateUUIDv4()) AS event_id, viewed_at
+FROM views_stream;
+
+ALTER TABLE mv_comments MODIFY QUERY
+SELECT user_id, toUUIDOrZero(post_id) AS post_id, toUUIDOrZero(comment_id) AS comment_id,
+       ifNull(toUUIDOrNull(event_id), generateUUIDv4()) AS event_id, commented_at
+FROM comments_stream;
+
+-- 4. Отбрасывание повторных вставок в счётчики
+ALTER TABLE post_counters MODIFY SETTING non_replicated_deduplication_window = 1000;
+ALTER TABLE post_daily_counters MODIFY SETTING non_replicated_deduplication_window = 1000;
+ALTER TABLE user_counters MODIFY SETTING non_replicated_deduplication_window = 1000;
+ALTER TABLE post_hourly_counters MODIFY SETTING non_replicated_deduplication_window = 1000;
+ALTER TABLE user_hourly_counters MODIFY SETTING non_replicated_deduplication_window = 1000;
+ALTER TABLE post_unique_daily MODIFY SETTING non_replicated_deduplication_window = 1000;
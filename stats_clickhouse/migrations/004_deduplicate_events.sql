@@ -0,0 +1,46 @@
+-- Отбрасывание повторно доставленных событий до сырых таблиц и счётчиков (03_materialized_views.sql):
+-- представления 03–07 читают *_deduplicated вместо *_stream. Выполнять после 003_event_ids.sql. События не теряются:
+--   1. удаляются представления, читающие Kafka-таблицы: чтение топиков останавливается, offset'ы групп
+--      сохраняются. Воркер app.ingest, если он используется, остановить;
+--   2. удаляются представления 03–07, повторно выполняются init-скрипты 03–07 — они создают *_deduplicated
+--      и представления по новым запросам;
+--   3. повторно выполняется 02_kafka_tables.sql: чтение продолжается с offset'ов групп (воркер — запустить).
+--   clickhouse-client --database stats_db --multiquery < 004_deduplicate_events.sql
+--   for f in ../init/0[3-7]_*.sql ../init/02_kafka_tables.sql; do clickhouse-client --database stats_db --multiquery < $f; done
+
+-- 1. Остановить загрузку
+DROP TABLE mv_likes_stream;
+DROP TABLE mv_views_stream;
+DROP TABLE mv_comments_stream;
+DROP TABLE mv_likes_dead_letters;
+DROP TABLE mv_views_dead_letters;
+DROP TABLE mv_comments_dead_letters;
+DROP TABLE mv_likes_v2_stream;
+DROP TABLE mv_views_v2_stream;
+DROP TABLE mv_comments_v2_stream;
+DROP TABLE mv_likes_v2_dead_letters;
+DROP TABLE mv_views_v2_dead_letters;
+DROP TABLE mv_comments_v2_dead_letters;
+
+-- 2. Представления сырых таблиц и счётчиков
+DROP TABLE mv_likes;
+DROP TABLE mv_views;
+DROP TABLE mv_comments;
+DROP TABLE mv_post_counters_views;
+DROP TABLE mv_post_counters_likes;
+DROP TABLE mv_post_counters_comments;
+DROP TABLE mv_post_daily_counters_views;
+DROP TABLE mv_post_daily_counters_likes;
+DROP TABLE mv_post_daily_counters_comments;
+DROP TABLE mv_user_counters_views;
+DROP TABLE mv_user_counters_likes;
+DROP TABLE mv_user_counters_comments;
+DROP TABLE mv_post_hourly_counters_views;
+DROP TABLE mv_post_hourly_counters_likes;
+DROP TABLE mv_post_hourly_counters_comments;
+DROP TABLE mv_user_hourly_counters_views;
+DROP TABLE mv_user_hourly_counters_likes;
+DROP TABLE mv_user_hourly_counters_comments;
+DROP TABLE mv_post_unique_daily_views;
+DROP TABLE mv_post_unique_daily_likes;
+DROP TABLE mv_post_unique_daily_comments;
@@ -0,0 +1,303 @@
+"""
+Асинхронный режим StatsService (STATS_SERVING_MODE=async): grpc.aio и асинхронный клиент
+ClickHouse. Независимые подзапросы одного RPC выполняются параллельно через asyncio.gather,
+остаток дедлайна RPC передаётся в ClickHouse как max_execution_time.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import threading
+import time
+
+import grpc
+import clickhouse_connect
+
+import stats_pb2
+import stats_pb2_grpc
+
+from . import handlers
+from .handlers import (deadline, daily_history, metrics_history, minute_history, packed_history, post_stats_delta,
+                       post_stats_response, post_stats_snapshot, posts_stats_response, recent_activity_query,
+                       recent_activity_response, recent_comments, recent_comments_history, recent_comments_packed,
+                       series_response, top_query, uniques_query, window_response)
+from .history import BUCKET_SECONDS, TIME_FORMATS, history_query, metrics_history_query
+from .history_cache import merge, since
+from .queries import execute_async, query_stats
+from .recent import run as run_recent
+from .stream import STREAM_INTERVAL, STREAM_SNAPSHOT_INTERVAL, PostStatsStreams, TooManyStreams
+from .watermark import run as run_watermark
+
+# GetPostsStats делит список постов на части такого размера и запрашивает их параллельно
+BATCH_CHUNK_POSTS = int(os.getenv("STATS_BATCH_CHUNK_POSTS", "100"))
+
+logger = logging.getLogger(__name__)
+
+# Подписка StreamPostStats — корутина, а не поток сервера: ограничение только STATS_MAX_STREAMS
+streams = PostStatsStreams()
+
+# Создаётся при первом запросе
+async_client = None
+_client_lock = asyncio.Lock()
+
+
+async def create_async_client():
+    # Один HTTP-клиент без сессии, запросы выполняются в executor_threads потоках
+    return await clickhouse_connect.get_async_client(host=handlers.CLICKHOUSE_HOST,
+                                                     port=handlers.CLICKHOUSE_PORT,
+                                                     username=handlers.CLICKHOUSE_USER_NAME,
+                                                     password=handlers.CLICKHOUSE_PASSWORD,
+                                                     database=handlers.CLICKHOUSE_DB,
+                                                     compress=handlers.parse_compress(handlers.CLICKHOUSE_COMPRESS),
+                                                     autogenerate_session_id=False,
+                                                     pool_mgr=handlers.http_pool_manager,
+                                                     executor_threads=handlers.CLICKHOUSE_POOL_SIZE
+                                                     )
+
+
+async def get_client():
+    global async_client
+    async with _client_lock:
+        if async_client is None:
+            async_client = await create_async_client()
+    return async_client
+
+
+def chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+class AsyncStatsService(stats_pb2_grpc.StatsServiceServicer):
+    async def GetPostStats(self, request, context):
+        try:
+            client = await get_client()
+            timeout = deadline(context)
+            result, uniques = await asyncio.gather(
+                execute_async(client, "post_stats", timeout=timeout, post_id=request.post_id),
+                execute_async(client, uniques_query(request.approximate), timeout=timeout, post_ids=[request.post_id]),
+            )
+            return post_stats_response(request.post_id, result.result_rows[0], uniques.result_rows)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PostStatsResponse()
+
+    async def GetPostsStats(self, request, context):
+        post_ids = list(dict.fromkeys(request.post_ids))
+        if len(post_ids) > handlers.MAX_BATCH_POSTS:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"At most {handlers.MAX_BATCH_POSTS} post ids per request")
+            return stats_pb2.PostsStatsResponse()
+        if not post_ids:
+            return stats_pb2.PostsStatsResponse()
+        try:
+            client = await get_client()
+            timeout = deadline(context)
+            parts = chunks(post_ids, BATCH_CHUNK_POSTS)
+            # счётчики и уникальные пользователи всех частей — одновременно
+            results = await asyncio.gather(*[
+                execute_async(client, name, timeout=timeout, post_ids=chunk)
+                for name in ("posts_stats", uniques_query(request.approximate)) for chunk in parts
+            ])
+            counts, uniques = results[:len(parts)], results[len(parts):]
+            return posts_stats_response(post_ids, [row for result in counts for row in result.result_rows],
+                                        [row for result in uniques for row in result.result_rows])
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PostsStatsResponse()
+
+    async def _daily_series(self, column, post_id, context):
+        cached = handlers.history_cache.get(post_id, column)
+        closed_before = handlers.watermark.closed_before()
+        result = await execute_async(await get_client(), "daily_history_since", timeout=deadline(context),
+                                     metric=column, post_id=post_id, since=since(cached))
+        return merge(handlers.history_cache, post_id, column, cached, result.np_result, closed_before)
+
+    async def _get_daily_stats(self, column, request, context):
+        return daily_history(await self._daily_series(column, request.post_id, context))
+
+    async def GetPostViewsHistory(self, request, context):
+        try:
+            history = await self._get_daily_stats("views", request, context)
+            return stats_pb2.PostHistoryResponse(history=history)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PostHistoryResponse()
+
+    async def GetPostLikesHistory(self, request, context):
+        try:
+            history = await self._get_daily_stats("likes", request, context)
+            return stats_pb2.PostHistoryResponse(history=history)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PostHistoryResponse()
+
+    async def GetPostCommentsHistory(self, request, context):
+        try:
+            history = await self._get_daily_stats("comments", request, context)
+            return stats_pb2.PostHistoryResponse(history=history)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PostHistoryResponse()
+
+    async def GetPostRecentComments(self, request, context):
+        window = recent_comments(request.post_id)
+        if window is not None:
+            return recent_comments_history(*window)
+        try:
+            result = await execute_async(await get_client(), "recent_comments",
+                                         timeout=deadline(context), post_id=request.post_id)
+            return stats_pb2.PostHistoryResponse(history=minute_history(result.result_rows))
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PostHistoryResponse()
+
+    async def GetPostPackedHistory(self, request, context):
+        try:
+            series = await self._daily_series(handlers.SORT_COLUMNS[request.metric], request.post_id, context)
+            return series_response(series)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PackedHistoryResponse()
+
+    async def GetPostRecentCommentsPacked(self, request, context):
+        window = recent_comments(request.post_id)
+        if window is not None:
+            return recent_comments_packed(*window)
+        try:
+            result = await execute_async(await get_client(), "recent_comments_packed",
+                                         timeout=deadline(context), post_id=request.post_id)
+            return packed_history(result, handlers.MINUTE_SECONDS, '%Y-%m-%d %H:%M')
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PackedHistoryResponse()
+
+    async def GetPostHistory(self, request, context):
+        try:
+            name, parameters = history_query(request, handlers.SORT_COLUMNS.get(request.metric),
+                                             datetime.datetime.utcnow())
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return stats_pb2.PackedHistoryResponse()
+        try:
+            if request.granularity == stats_pb2.DAY:
+                series = await self._daily_series(parameters["metric"], request.post_id, context)
+                return window_response(series, parameters["start"], parameters["end"])
+            result = await execute_async(await get_client(), name, timeout=deadline(context), **parameters)
+            return packed_history(result, BUCKET_SECONDS[request.granularity], TIME_FORMATS[request.granularity])
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PackedHistoryResponse()
+
+    async def GetPostMetricsHistory(self, request, context):
+        try:
+            name, parameters = metrics_history_query(request, datetime.datetime.utcnow())
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return stats_pb2.MetricsHistoryResponse()
+        try:
+            result = await execute_async(await get_client(), name, timeout=deadline(context), **parameters)
+            return metrics_history(result, BUCKET_SECONDS[request.granularity], TIME_FORMATS[request.granularity])
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.MetricsHistoryResponse()
+
+    async def GetPostRecentActivity(self, request, context):
+        window = handlers.recent.window(request.post_id)
+        if window is not None:
+            return recent_activity_response(*window)
+        try:
+            name, parameters = recent_activity_query(request.post_id, datetime.datetime.utcnow())
+            result = await execute_async(await get_client(), name, timeout=deadline(context), **parameters)
+            return metrics_history(result, handlers.MINUTE_SECONDS, '%Y-%m-%d %H:%M')
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.MetricsHistoryResponse()
+
+    async def StreamPostStats(self, request, context):
+        try:
+            subscription = streams.subscribe(request.post_id, asyncio.get_running_loop())
+        except TooManyStreams as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return
+        try:
+            next_snapshot = time.monotonic()
+            while True:
+                if time.monotonic() >= next_snapshot:
+                    subscription.take()
+                    result = await execute_async(await get_client(), "post_stats", timeout=deadline(context),
+                                                 post_id=request.post_id)
+                    yield post_stats_snapshot(result.result_rows[0])
+                    next_snapshot = time.monotonic() + STREAM_SNAPSHOT_INTERVAL
+                    continue
+                deltas = await subscription.wait_async(next_snapshot - time.monotonic())
+                if any(deltas):
+                    yield post_stats_delta(deltas)
+                    await asyncio.sleep(STREAM_INTERVAL)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+        finally:
+            streams.unsubscribe(subscription)
+
+    async def _get_top(self, key, request, context):
+        name, parameters = top_query(key, request)
+        result = await execute_async(await get_client(), name, timeout=deadline(context), **parameters)
+        return [row[0] for row in result.result_rows]
+
+    async def GetTopTenPosts(self, request, context):
+        try:
+            return stats_pb2.TopTenPostsResponse(post_ids=await self._get_top("post", request, context))
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.TopTenPostsResponse()
+
+    async def GetTopTenUsers(self, request, context):
+        try:
+            return stats_pb2.TopTenUsersResponse(user_ids=await self._get_top("user", request, context))
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.TopTenUsersResponse()
+
+
+async def log_metrics():
+    while True:
+        await asyncio.sleep(handlers.METRICS_LOG_INTERVAL)
+        logger.info("History cache: %s, closed before %s",
+                    handlers.history_cache.stats(), handlers.watermark.closed_before())
+        logger.info("Recent activity: %s, streams: %s", handlers.recent.stats(), streams.stats())
+        for name, stats in query_stats().items():
+            logger.info("Query %s: %s", name, stats)
+
+
+async def serve():
+    logging.basicConfig(level=logging.INFO)
+    server = grpc.aio.server()
+    stats_pb2_grpc.add_StatsServiceServicer_to_server(AsyncStatsService(), server)
+    server.add_insecure_port('[::]:50050')
+    await server.start()
+    metrics = asyncio.create_task(log_metrics())
+    if handlers.HISTORY_CACHE_SIZE > 0:
+        # kafka-python блокирующий, поэтому водяной знак обновляется в отдельном потоке
+        threading.Thread(target=run_watermark, args=(handlers.watermark,), daemon=True).start()
+    if handlers.RECENT_CAPACITY > 0:
+        threading.Thread(target=run_recent, args=(handlers.recent, streams), daemon=True).start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        metrics.cancel()
@@ -0,0 +1,102 @@
+"""
+Заполнение таблиц счётчиков (ROLLUPS) и post_unique_daily по уже накопленным сырым событиям.
+
+    python -m app.backfill --until "2025-05-01 12:00:00"
+
+Материализованные представления считают события с момента своего создания, поэтому --until —
+время создания представлений: более ранние события досчитываются из likes, views и comments.
+Запускать один раз: повторный запуск за тот же период удвоит счётчики (уникальные пользователи
+в post_unique_daily при этом не изменятся). События читаются с FINAL, чтобы ещё не слитые повторы
+одного event_id не посчитались дважды.
+"""
+import argparse
+import datetime
+import logging
+
+EVENT_TABLES = {
+    "views": "viewed_at",
+    "likes": "liked_at",
+    "comments": "commented_at",
+}
+
+# Сырая таблица -> столбец уникальных пользователей в post_unique_daily
+UNIQUE_COLUMNS = {
+    "views": "viewers",
+    "likes": "likers",
+    "comments": "commenters",
+}
+
+# Таблица счётчиков -> её ключевые столбцы и выражения для них; {time} — время события
+ROLLUPS = {
+    "post_counters": [("post_id", "post_id")],
+    "post_daily_counters": [("post_id", "post_id"), ("date", "toDate({time})")],
+    "user_counters": [("user_id", "user_id")],
+    "post_hourly_counters": [("hour", "toStartOfHour({time})"), ("post_id", "post_id")],
+    "user_hourly_counters": [("hour", "toStartOfHour({time})"), ("user_id", "user_id")],
+}
+# Почасовые таблицы хранят 8 дней (TTL), более старые события в них не нужны
+HOURLY_RETENTION = datetime.timedelta(days=8)
+
+logger = logging.getLogger(__name__)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def month_ranges(start, end):
+    """Помесячные интервалы [from, to), покрывающие [start, end)."""
+    current = datetime.datetime(start.year, start.month, 1)
+    while current < end:
+        following = add_months(current, 1)
+        yield max(current, start), min(following, end)
+        current = following
+
+
+def backfill(client, until):
+    # По месяцам, чтобы GROUP BY по крупным таблицам не держал в памяти всю историю
+    for table, time_column in EVENT_TABLES.items():
+        first = client.query(
+            f"SELECT minOrNull({time_column}) FROM {table} WHERE {time_column} < {{until:DateTime}}",
+            parameters={"until": until}
+        ).result_rows[0][0]
+        if first is None:
+            continue
+        for start, end in month_ranges(first, until):
+            parameters = {"start": start, "end": end}
+            condition = f"{time_column} >= {{start:DateTime}} AND {time_column} < {{end:DateTime}}"
+            for target, keys in ROLLUPS.items():
+                if target.endswith("_hourly_counters") and end <= until - HOURLY_RETENTION:
+                    continue
+                columns = ", ".join(name for name, _ in keys)
+                expressions = ", ".join(f"{expression.format(time=time_column)} AS {name}"
+                                        for name, expression in keys)
+                client.command(
+                    f"INSERT INTO {target} ({columns}, {table}) "
+                    f"SELECT {expressions}, count() FROM {table} FINAL WHERE {condition} GROUP BY {columns}",
+                    parameters=parameters
+                )
+            client.command(
+                f"INSERT INTO post_unique_daily (post_id, date, {UNIQUE_COLUMNS[table]}) "
+                f"SELECT post_id, toDate({time_column}) AS date, uniqCombinedState(user_id) FROM {table} "
+                f"WHERE {condition} GROUP BY post_id, date",
+                parameters=parameters
+            )
+            logger.info("Backfilled %s for %s - %s", table, start, end)
+
+
+def main():
+    from .handlers import client
+
+    parser = argparse.ArgumentParser(description="Backfill stats counters from raw events")
+    parser.add_argument("--until", required=True, type=datetime.datetime.fromisoformat,
+                        help="creation time of the counter materialized views, e.g. '2025-05-01 12:00:00'")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    backfill(client, args.until)
+
+
+if __name__ == "__main__":
+    main()
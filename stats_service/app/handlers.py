@@ -1,57 +1,276 @@
 import grpc
 from concurrent import futures
+import datetime
+import logging
+import threading
+import time
 
 import stats_pb2
 import stats_pb2_grpc
 import os
 
 import clickhouse_connect
+import numpy as np
+from clickhouse_connect.driver import httputil
 
+from .history import BUCKET_SECONDS, TIME_FORMATS, history_query, metrics_history_query
+from .history_cache import DailyHistoryCache, merge, since
+from .pool import ClientPool
+from .queries import execute, query_stats
+from .recent import RECENT_CAPACITY, RECENT_MINUTES, RecentActivity, run as run_recent
+from .stream import MAX_STREAMS, STREAM_INTERVAL, STREAM_SNAPSHOT_INTERVAL, PostStatsStreams, TooManyStreams
+from .watermark import KafkaOffsets, LagWatermark, run as run_watermark
+
+CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "stats_clickhouse")
+CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "8123"))
 CLICKHOUSE_USER_NAME = os.getenv("CLICKHOUSE_USER_NAME", "default")
 CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
 CLICKHOUSE_DB = os.getenv("CLICKHOUSE_DB", "default")
+# true/false или алгоритм сжатия ответов: lz4, zstd, gzip
+CLICKHOUSE_COMPRESS = os.getenv("CLICKHOUSE_COMPRESS", "lz4")
+CLICKHOUSE_KEEPALIVE_IDLE = int(os.getenv("CLICKHOUSE_KEEPALIVE_IDLE", "30"))
+SERVER_WORKERS = int(os.getenv("STATS_SERVER_WORKERS", "4"))
+CLICKHOUSE_POOL_SIZE = int(os.getenv("CLICKHOUSE_POOL_SIZE", str(SERVER_WORKERS)))
+CLICKHOUSE_POOL_TIMEOUT = float(os.getenv("CLICKHOUSE_POOL_TIMEOUT", "5"))
+CLICKHOUSE_HEALTH_CHECK_INTERVAL = float(os.getenv("CLICKHOUSE_HEALTH_CHECK_INTERVAL", "30"))
+METRICS_LOG_INTERVAL = float(os.getenv("STATS_METRICS_LOG_INTERVAL", "60"))
+# 0 — без кэша закрытых дней
+HISTORY_CACHE_SIZE = int(os.getenv("STATS_HISTORY_CACHE_SIZE", "10000"))
+HISTORY_CACHE_DIR = os.getenv("STATS_HISTORY_CACHE_DIR") or None
+DEFAULT_TOP_LIMIT = 10
+MAX_TOP_LIMIT = int(os.getenv("STATS_MAX_TOP_LIMIT", "1000"))
+MAX_BATCH_POSTS = int(os.getenv("STATS_MAX_BATCH_POSTS", "500"))
+DAY_SECONDS = 24 * 60 * 60
+MINUTE_SECONDS = 60
 
-client = clickhouse_connect.get_client(host='stats_clickhouse',
-                                       port=8123,
-                                       username=CLICKHOUSE_USER_NAME,
-                                       password=CLICKHOUSE_PASSWORD,
-                                       database=CLICKHOUSE_DB
-                                       )
+SORT_COLUMNS = {
+    stats_pb2.VIEWS: "views",
+    stats_pb2.LIKES: "likes",
+    stats_pb2.COMMENTS: "comments"
+}
+TOP_WINDOW_HOURS = {
+    stats_pb2.ALL_TIME: None,
+    stats_pb2.LAST_HOUR: 1,
+    stats_pb2.LAST_DAY: 24,
+    stats_pb2.LAST_WEEK: 24 * 7,
+}
 
 
-class StatsService(stats_pb2_grpc.StatsServiceServicer):
-    def GetPostStats(self, request, context):
-        try:
-            likes_result = client.query(f"SELECT count() FROM likes WHERE post_id = '{request.post_id}'")
-            likes = likes_result.result_rows[0][0]
+logger = logging.getLogger(__name__)
+
+
+def parse_compress(value):
+    return {"true": True, "false": False}.get(value.lower(), value)
+
+
+# Общий для клиентов пул HTTP-соединений с TCP keepalive, по соединению на клиента
+http_pool_manager = httputil.get_pool_manager(keep_idle=CLICKHOUSE_KEEPALIVE_IDLE, maxsize=CLICKHOUSE_POOL_SIZE)
+
+
+def create_client():
+    # Без серверной сессии: запросы разных клиентов не блокируют друг друга
+    return clickhouse_connect.get_client(host=CLICKHOUSE_HOST,
+                                         port=CLICKHOUSE_PORT,
+                                         username=CLICKHOUSE_USER_NAME,
+                                         password=CLICKHOUSE_PASSWORD,
+                                         database=CLICKHOUSE_DB,
+                                         compress=parse_compress(CLICKHOUSE_COMPRESS),
+                                         autogenerate_session_id=False,
+                                         pool_mgr=http_pool_manager
+                                         )
+
+
+# Клиенты создаются при первом запросе, а не при импорте модуля
+client = ClientPool(create_client,
+                    size=CLICKHOUSE_POOL_SIZE,
+                    acquire_timeout=CLICKHOUSE_POOL_TIMEOUT,
+                    health_check_interval=CLICKHOUSE_HEALTH_CHECK_INTERVAL)
+
+history_cache = DailyHistoryCache(HISTORY_CACHE_SIZE, HISTORY_CACHE_DIR)
+watermark = LagWatermark(KafkaOffsets())
+recent = RecentActivity(RECENT_MINUTES, RECENT_CAPACITY)
+# Поток StreamPostStats занимает поток сервера на всё время подписки: не больше половины пула
+streams = PostStatsStreams(min(MAX_STREAMS, max(SERVER_WORKERS // 2, 1)))
+
+
+def deadline(context):
+    """Сколько секунд осталось до дедлайна RPC, None — дедлайн не задан."""
+    return context.time_remaining()
+
+
+def uniques_query(approximate):
+    """Шаблон уникальных пользователей: по состояниям uniqCombined или точный по сырым событиям."""
+    return "posts_uniques_approximate" if approximate else "posts_uniques"
+
+
+def post_stats_response(post_id, row, unique_rows):
+    views, likes, comments = row
+    viewers, likers, commenters = {row[0]: row[1:] for row in unique_rows}.get(post_id, (0, 0, 0))
+    return stats_pb2.PostStatsResponse(views=views, likes=likes, comments=comments, unique_viewers=viewers,
+                                       unique_likers=likers, unique_commenters=commenters)
+
+
+def posts_stats_response(post_ids, rows, unique_rows):
+    counters = {row[0]: row[1:] for row in rows}
+    uniques = {row[0]: row[1:] for row in unique_rows}
+    # в порядке запроса; посты без событий — с нулями
+    stats = []
+    for post_id in post_ids:
+        views, likes, comments = counters.get(post_id, (0, 0, 0))
+        viewers, likers, commenters = uniques.get(post_id, (0, 0, 0))
+        stats.append(stats_pb2.PostStats(post_id=post_id, views=views, likes=likes, comments=comments,
+                                         unique_viewers=viewers, unique_likers=likers,
+                                         unique_commenters=commenters))
+    return stats_pb2.PostsStatsResponse(stats=stats)
+
+
+def daily_history(series):
+    """DayStats за дни с событиями ряда DaySeries."""
+    if series.start is None:
+        return []
+    days = np.flatnonzero(series.counts)
+    dates = np.datetime_as_string(np.datetime64(series.start, "D") + days)
+    return [stats_pb2.DayStats(date=date, stat=stat) for date, stat in zip(dates, series.counts[days].tolist())]
+
+
+def series_response(series):
+    if series.start is None:
+        return stats_pb2.PackedHistoryResponse(bucket_seconds=DAY_SECONDS)
+    return stats_pb2.PackedHistoryResponse(start=series.start.strftime('%Y-%m-%d'), bucket_seconds=DAY_SECONDS,
+                                           counts=series.counts.tolist())
+
+
+def window_response(series, start, end):
+    return stats_pb2.PackedHistoryResponse(start=start.strftime('%Y-%m-%d'), bucket_seconds=DAY_SECONDS,
+                                           counts=series.window(start, end).tolist())
+
+
+def minute_history(rows):
+    return [stats_pb2.DayStats(date=minute.strftime('%Y-%m-%d %H:%M'), stat=stat) for minute, stat in rows]
+
+
+def packed_history(result, bucket_seconds, time_format):
+    # result.np_result — структурированный массив столбцов bucket и stat
+    columns = result.np_result
+    if len(columns) == 0:
+        return stats_pb2.PackedHistoryResponse(bucket_seconds=bucket_seconds)
+    return stats_pb2.PackedHistoryResponse(start=columns["bucket"][0].item().strftime(time_format),
+                                           bucket_seconds=bucket_seconds,
+                                           counts=columns["stat"].tolist())
+
+
+def metrics_history(result, bucket_seconds, time_format):
+    columns = result.np_result
+    if len(columns) == 0:
+        return stats_pb2.MetricsHistoryResponse(bucket_seconds=bucket_seconds)
+    return stats_pb2.MetricsHistoryResponse(start=columns["bucket"][0].item().strftime(time_format),
+                                            bucket_seconds=bucket_seconds,
+                                            views=columns["views"].tolist(),
+                                            likes=columns["likes"].tolist(),
+                                            comments=columns["comments"].tolist())
+
+
+def minute_label(minute):
+    return datetime.datetime.utcfromtimestamp(minute * MINUTE_SECONDS).strftime('%Y-%m-%d %H:%M')
+
+
+def recent_activity_response(start, counts):
+    """Окно RecentActivity.window в MetricsHistoryResponse."""
+    views, likes, comments = counts.tolist()
+    return stats_pb2.MetricsHistoryResponse(start=minute_label(start), bucket_seconds=MINUTE_SECONDS,
+                                            views=views, likes=likes, comments=comments)
+
+
+def recent_activity_query(post_id, now):
+    """То же окно из сырых событий: GetPostMetricsHistory по минутам с now - RECENT_MINUTES."""
+    from_time = (now - datetime.timedelta(minutes=recent.minutes)).isoformat()
+    request = stats_pb2.PostHistoryRequest(post_id=post_id, granularity=stats_pb2.MINUTE, from_time=from_time)
+    return metrics_history_query(request, now)
+
+
+def recent_comments(post_id):
+    """Комментарии по минутам за последний час и текущую минуту из памяти: (начало, counts) или None."""
+    window = recent.window(post_id) if recent.minutes >= 60 else None
+    if window is None:
+        return None
+    start, counts = window
+    return start + recent.minutes - 60, counts[2, -61:]
+
+
+def recent_comments_history(start, counts):
+    return stats_pb2.PostHistoryResponse(history=[stats_pb2.DayStats(date=minute_label(start + minute), stat=stat)
+                                                  for minute, stat in enumerate(counts.tolist()) if stat])
+
+
+def recent_comments_packed(start, counts):
+    return stats_pb2.PackedHistoryResponse(start=minute_label(start), bucket_seconds=MINUTE_SECONDS,
+                                           counts=counts.tolist())
+
+
+def post_stats_snapshot(row):
+    views, likes, comments = row
+    return stats_pb2.PostStatsUpdate(snapshot=True, views=views, likes=likes, comments=comments)
+
+
+def post_stats_delta(deltas):
+    views, likes, comments = deltas
+    return stats_pb2.PostStatsUpdate(views=views, likes=likes, comments=comments)
 
-            views_result = client.query(f"SELECT count() FROM views WHERE post_id = '{request.post_id}'")
-            views = views_result.result_rows[0][0]
 
-            comments_result = client.query(f"SELECT count() FROM comments WHERE post_id = '{request.post_id}'")
-            comments = comments_result.result_rows[0][0]
+def top_query(key, request):
+    """Имя шаблона и параметры запроса рейтинга по запросу GetTopTen*."""
+    column = SORT_COLUMNS[request.param]
+    limit = min(request.limit, MAX_TOP_LIMIT) if request.limit > 0 else DEFAULT_TOP_LIMIT
+    hours = TOP_WINDOW_HOURS[request.window]
+    suffix = "_approximate" if request.approximate else ""
+    if hours is None:
+        return f"top_{key}s{suffix}", {"metric": column, "limit": limit}
+    return f"top_{key}s_window{suffix}", {"metric": column, "limit": limit, "hours": hours}
 
-            return stats_pb2.PostStatsResponse(views=views, likes=likes, comments=comments)
+
+class StatsService(stats_pb2_grpc.StatsServiceServicer):
+    def GetPostStats(self, request, context):
+        try:
+            result = execute(client, "post_stats", timeout=deadline(context), post_id=request.post_id)
+            uniques = execute(client, uniques_query(request.approximate), timeout=deadline(context),
+                              post_ids=[request.post_id])
+            return post_stats_response(request.post_id, result.result_rows[0], uniques.result_rows)
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Database error: {str(e)}")
             return stats_pb2.PostStatsResponse()
 
-    def _get_daily_stats(self, table, post_id):
-        time_col = {'views': 'viewed_at', 'likes': 'liked_at', 'comments': 'commented_at'}
-        query = f"""
-        SELECT toDate({time_col[table]}) as date, count() as stat
-        FROM {table}
-        WHERE post_id = '{post_id}'
-        GROUP BY date
-        ORDER BY date
-        """
-        result = client.query(query)
-        return [stats_pb2.DayStats(date=row[0].strftime('%Y-%m-%d'), stat=row[1]) for row in result.result_rows]
+    def GetPostsStats(self, request, context):
+        post_ids = list(dict.fromkeys(request.post_ids))
+        if len(post_ids) > MAX_BATCH_POSTS:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"At most {MAX_BATCH_POSTS} post ids per request")
+            return stats_pb2.PostsStatsResponse()
+        if not post_ids:
+            return stats_pb2.PostsStatsResponse()
+        try:
+            result = execute(client, "posts_stats", timeout=deadline(context), post_ids=post_ids)
+            uniques = execute(client, uniques_query(request.approximate), timeout=deadline(context), post_ids=post_ids)
+            return posts_stats_response(post_ids, result.result_rows, uniques.result_rows)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PostsStatsResponse()
+
+    def _daily_series(self, column, post_id, context):
+        # закрытые дни — из кэша, из ClickHouse — только остальные
+        cached = history_cache.get(post_id, column)
+        closed_before = watermark.closed_before()
+        result = execute(client, "daily_history_since", timeout=deadline(context),
+                         metric=column, post_id=post_id, since=since(cached))
+        return merge(history_cache, post_id, column, cached, result.np_result, closed_before)
+
+    def _get_daily_stats(self, column, request, context):
+        return daily_history(self._daily_series(column, request.post_id, context))
 
     def GetPostViewsHistory(self, request, context):
         try:
-            history = self._get_daily_stats("views", request.post_id)
+            history = self._get_daily_stats("views", request, context)
             return stats_pb2.PostHistoryResponse(history=history)
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -60,7 +279,7 @@ class StatsService(stats_pb2_grpc.StatsServiceServicer):
 
     def GetPostLikesHistory(self, request, context):
         try:
-            history = self._get_daily_stats("likes", request.post_id)
+            history = self._get_daily_stats("likes", request, context)
             return stats_pb2.PostHistoryResponse(history=history)
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -69,7 +288,7 @@ class StatsService(stats_pb2_grpc.StatsServiceServicer):
 
     def GetPostCommentsHistory(self, request, context):
         try:
-            history = self._get_daily_stats("comments", request.post_id)
+            history = self._get_daily_stats("comments", request, context)
             return stats_pb2.PostHistoryResponse(history=history)
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -77,75 +296,153 @@ class StatsService(stats_pb2_grpc.StatsServiceServicer):
             return stats_pb2.PostHistoryResponse()
 
     def GetPostRecentComments(self, request, context):
+        window = recent_comments(request.post_id)
+        if window is not None:
+            return recent_comments_history(*window)
         try:
-            query = f"""
-                SELECT toStartOfMinute(commented_at) as minute, count() as stat
-                FROM comments
-                WHERE post_id = '{request.post_id}' AND commented_at > now() - INTERVAL 1 HOUR
-                GROUP BY minute
-                ORDER BY minute
-                """
-            result = client.query(query)
-            history = [
-                stats_pb2.DayStats(date=minute.strftime('%Y-%m-%d %H:%M'), stat=stat)
-                for minute, stat in result.result_rows
-            ]
-            return stats_pb2.PostHistoryResponse(history=history)
+            result = execute(client, "recent_comments", timeout=deadline(context), post_id=request.post_id)
+            return stats_pb2.PostHistoryResponse(history=minute_history(result.result_rows))
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Database error: {str(e)}")
             return stats_pb2.PostHistoryResponse()
 
+    def GetPostPackedHistory(self, request, context):
+        try:
+            return series_response(self._daily_series(SORT_COLUMNS[request.metric], request.post_id, context))
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PackedHistoryResponse()
+
+    def GetPostRecentCommentsPacked(self, request, context):
+        window = recent_comments(request.post_id)
+        if window is not None:
+            return recent_comments_packed(*window)
+        try:
+            result = execute(client, "recent_comments_packed", timeout=deadline(context), post_id=request.post_id)
+            return packed_history(result, MINUTE_SECONDS, '%Y-%m-%d %H:%M')
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PackedHistoryResponse()
+
+    def GetPostHistory(self, request, context):
+        try:
+            name, parameters = history_query(request, SORT_COLUMNS.get(request.metric), datetime.datetime.utcnow())
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return stats_pb2.PackedHistoryResponse()
+        try:
+            if request.granularity == stats_pb2.DAY:
+                series = self._daily_series(parameters["metric"], request.post_id, context)
+                return window_response(series, parameters["start"], parameters["end"])
+            result = execute(client, name, timeout=deadline(context), **parameters)
+            return packed_history(result, BUCKET_SECONDS[request.granularity], TIME_FORMATS[request.granularity])
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.PackedHistoryResponse()
+
+    def GetPostMetricsHistory(self, request, context):
+        try:
+            name, parameters = metrics_history_query(request, datetime.datetime.utcnow())
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return stats_pb2.MetricsHistoryResponse()
+        try:
+            result = execute(client, name, timeout=deadline(context), **parameters)
+            return metrics_history(result, BUCKET_SECONDS[request.granularity], TIME_FORMATS[request.granularity])
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.MetricsHistoryResponse()
+
+    def GetPostRecentActivity(self, request, context):
+        # из памяти, пока окно в ней полное; после рестарта, до прогрева — из ClickHouse
+        window = recent.window(request.post_id)
+        if window is not None:
+            return recent_activity_response(*window)
+        try:
+            name, parameters = recent_activity_query(request.post_id, datetime.datetime.utcnow())
+            result = execute(client, name, timeout=deadline(context), **parameters)
+            return metrics_history(result, MINUTE_SECONDS, '%Y-%m-%d %H:%M')
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+            return stats_pb2.MetricsHistoryResponse()
+
+    def StreamPostStats(self, request, context):
+        try:
+            subscription = streams.subscribe(request.post_id)
+        except TooManyStreams as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return
+        context.add_callback(subscription.close)
+        try:
+            next_snapshot = time.monotonic()
+            while context.is_active():
+                if time.monotonic() >= next_snapshot:
+                    # прибавки до снимка отбрасываются: ещё не загруженные в ClickHouse учтёт следующий снимок
+                    subscription.take()
+                    result = execute(client, "post_stats", timeout=deadline(context), post_id=request.post_id)
+                    yield post_stats_snapshot(result.result_rows[0])
+                    next_snapshot = time.monotonic() + STREAM_SNAPSHOT_INTERVAL
+                    continue
+                deltas = subscription.wait(next_snapshot - time.monotonic())
+                if any(deltas):
+                    yield post_stats_delta(deltas)
+                    time.sleep(STREAM_INTERVAL)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"Database error: {str(e)}")
+        finally:
+            streams.unsubscribe(subscription)
+
+    def _get_top(self, key, request, context):
+        name, parameters = top_query(key, request)
+        result = execute(client, name, timeout=deadline(context), **parameters)
+        return [row[0] for row in result.result_rows]
+
     def GetTopTenPosts(self, request, context):
-        param_map = {
-            stats_pb2.VIEWS: "views",
-            stats_pb2.LIKES: "likes",
-            stats_pb2.COMMENTS: "comments"
-        }
-        table = param_map[request.param]
-        try:
-            query = f"""
-            SELECT post_id, count() as cnt
-            FROM {table}
-            GROUP BY post_id
-            ORDER BY cnt DESC
-            LIMIT 10
-            """
-            result = client.query(query)
-            post_ids = [row[0] for row in result.result_rows]
-            return stats_pb2.TopTenPostsResponse(post_ids=post_ids)
+        try:
+            return stats_pb2.TopTenPostsResponse(post_ids=self._get_top("post", request, context))
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Database error: {str(e)}")
             return stats_pb2.TopTenPostsResponse()
 
     def GetTopTenUsers(self, request, context):
-        param_map = {
-            stats_pb2.VIEWS: "views",
-            stats_pb2.LIKES: "likes",
-            stats_pb2.COMMENTS: "comments"
-        }
-        table = param_map[request.param]
-        try:
-            query = f"""
-            SELECT user_id, count() as cnt
-            FROM {table}
-            GROUP BY user_id
-            ORDER BY cnt DESC
-            LIMIT 10
-            """
-            result = client.query(query)
-            user_ids = [row[0] for row in result.result_rows]
-            return stats_pb2.TopTenUsersResponse(user_ids=user_ids)
+        try:
+            return stats_pb2.TopTenUsersResponse(user_ids=self._get_top("user", request, context))
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Database error: {str(e)}")
             return stats_pb2.TopTenUsersResponse()
 
 
+def log_metrics():
+    while True:
+        time.sleep(METRICS_LOG_INTERVAL)
+        logger.info("ClickHouse pool: %s", client.stats())
+        logger.info("History cache: %s, closed before %s", history_cache.stats(), watermark.closed_before())
+        logger.info("Recent activity: %s, streams: %s", recent.stats(), streams.stats())
+        for name, stats in query_stats().items():
+            logger.info("Query %s: %s", name, stats)
+
+
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    logging.basicConfig(level=logging.INFO)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=SERVER_WORKERS))
     stats_pb2_grpc.add_StatsServiceServicer_to_server(StatsService(), server)
     server.add_insecure_port('[::]:50050')
     server.start()
+    threading.Thread(target=log_metrics, daemon=True).start()
+    if HISTORY_CACHE_SIZE > 0:
+        threading.Thread(target=run_watermark, args=(watermark,), daemon=True).start()
+    if RECENT_CAPACITY > 0:
+        threading.Thread(target=run_recent, args=(recent, streams), daemon=True).start()
     server.wait_for_termination()
@@ -0,0 +1,129 @@
+"""
+Выбор запроса для GetPostHistory и GetPostMetricsHistory: границы интервалов и самая дешёвая таблица для гранулярности.
+
+    MINUTE        — сырые события (views, likes, comments)
+    HOUR          — post_hourly_counters, если весь диапазон в пределах её TTL, иначе сырые события
+    DAY/WEEK/MONTH — post_daily_counters
+
+from и to округляются вниз до начала интервала; в ответ входят интервалы с from по to включительно,
+так что при to = сейчас последний интервал — текущий, ещё не завершённый.
+"""
+import datetime
+import os
+
+import stats_pb2
+
+from .backfill import EVENT_TABLES, HOURLY_RETENTION, add_months
+
+MAX_BUCKETS = int(os.getenv("STATS_MAX_HISTORY_BUCKETS", "10000"))
+
+BUCKET_SECONDS = {
+    stats_pb2.MINUTE: 60,
+    stats_pb2.HOUR: 60 * 60,
+    stats_pb2.DAY: 24 * 60 * 60,
+    stats_pb2.WEEK: 7 * 24 * 60 * 60,
+    stats_pb2.MONTH: 0,
+}
+# Диапазон по умолчанию, если from не задан
+DEFAULT_SPANS = {
+    stats_pb2.MINUTE: datetime.timedelta(hours=1),
+    stats_pb2.HOUR: datetime.timedelta(days=1),
+    stats_pb2.DAY: datetime.timedelta(days=30),
+    stats_pb2.WEEK: datetime.timedelta(weeks=26),
+    stats_pb2.MONTH: datetime.timedelta(days=365),
+}
+DATE_SOURCES = ("day", "week", "month")
+TIME_FORMATS = {
+    stats_pb2.MINUTE: '%Y-%m-%d %H:%M',
+    stats_pb2.HOUR: '%Y-%m-%d %H:%M',
+    stats_pb2.DAY: '%Y-%m-%d',
+    stats_pb2.WEEK: '%Y-%m-%d',
+    stats_pb2.MONTH: '%Y-%m-%d',
+}
+
+
+def parse_time(value):
+    """ISO 8601 в наивное время UTC; пустая строка — None."""
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def bucket_start(granularity, value):
+    if granularity == stats_pb2.MINUTE:
+        return value.replace(second=0, microsecond=0)
+    if granularity == stats_pb2.HOUR:
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = datetime.datetime(value.year, value.month, value.day)
+    if granularity == stats_pb2.WEEK:
+        # недели с понедельника, как toStartOfWeek(date, 1)
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == stats_pb2.MONTH:
+        return datetime.datetime(value.year, value.month, 1)
+    return day
+
+
+def next_bucket(granularity, value):
+    if granularity == stats_pb2.MONTH:
+        return add_months(value, 1)
+    return value + datetime.timedelta(seconds=BUCKET_SECONDS[granularity])
+
+
+def bucket_count(granularity, start, end):
+    if granularity == stats_pb2.MONTH:
+        return (end.year - start.year) * 12 + end.month - start.month
+    return int((end - start).total_seconds()) // BUCKET_SECONDS[granularity]
+
+
+def history_range(request, now):
+    """Начало первого интервала и конец последнего (не включительно)."""
+    if request.granularity not in BUCKET_SECONDS:
+        raise ValueError("Unknown granularity")
+    to_time = parse_time(request.to_time) or now
+    from_time = parse_time(request.from_time) or to_time - DEFAULT_SPANS[request.granularity]
+    if from_time > to_time:
+        raise ValueError("from must not be later than to")
+    start = bucket_start(request.granularity, from_time)
+    end = next_bucket(request.granularity, bucket_start(request.granularity, to_time))
+    if bucket_count(request.granularity, start, end) > MAX_BUCKETS:
+        raise ValueError(f"At most {MAX_BUCKETS} buckets per request")
+    return start, end
+
+
+def history_source(granularity, start, now):
+    """Суффикс шаблона: самая дешёвая таблица для гранулярности."""
+    if granularity == stats_pb2.HOUR and start >= now - HOURLY_RETENTION:
+        return "hour"
+    if granularity == stats_pb2.MINUTE:
+        return "minute_raw"
+    if granularity == stats_pb2.HOUR:
+        return "hour_raw"
+    return {stats_pb2.DAY: "day", stats_pb2.WEEK: "week", stats_pb2.MONTH: "month"}[granularity]
+
+
+def history_parameters(request, now):
+    start, end = history_range(request, now)
+    source = history_source(request.granularity, start, now)
+    if source in DATE_SOURCES:
+        # post_daily_counters хранит даты
+        start, end = start.date(), end.date()
+    return source, {"post_id": request.post_id, "start": start, "end": end}
+
+
+def history_query(request, column, now):
+    """Имя шаблона и параметры запроса для GetPostHistory; column — столбец метрики."""
+    if column is None:
+        raise ValueError("Unknown metric")
+    source, parameters = history_parameters(request, now)
+    if source.endswith("_raw"):
+        return f"history_{source}", {**parameters, "table": column, "time_column": EVENT_TABLES[column]}
+    return f"history_{source}", {**parameters, "metric": column}
+
+
+def metrics_history_query(request, now):
+    """Имя шаблона и параметры запроса для GetPostMetricsHistory: все метрики одним запросом."""
+    source, parameters = history_parameters(request, now)
+    return f"metrics_history_{source}", parameters
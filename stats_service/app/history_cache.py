@@ -0,0 +1,155 @@
+"""
+Кэш посуточной истории постов. Закрытые дни (до watermark.closed_before()) больше не меняются,
+поэтому их ряд по (post_id, метрика) хранится бессрочно: в памяти процесса (LRU на
+STATS_HISTORY_CACHE_SIZE рядов) и, если задан STATS_HISTORY_CACHE_DIR, в файлах каталога, который
+можно разделить между репликами. ClickHouse читается только с первого незакэшированного дня.
+
+После app.backfill за прошедшие дни каталог нужно очистить, а сервис перезапустить.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+EPOCH = datetime.date(1970, 1, 1)
+ONE_DAY = datetime.timedelta(days=1)
+
+
+class DaySeries:
+    """Плотный ряд по дням: counts[i] — значение за start + i дней; start None — событий нет."""
+
+    def __init__(self, start=None, counts=None):
+        self.start = start
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+
+    def extend(self, dates, stats, end=None):
+        """Ряд, продолженный днями dates (datetime64[D], по возрастанию) и, если задан end, нулями до end."""
+        start = self.start or (dates[0].item() if len(dates) else None)
+        if start is None:
+            return self
+        last = start + datetime.timedelta(days=len(self.counts))
+        if len(dates):
+            last = max(last, dates[-1].item() + ONE_DAY)
+        if end is not None:
+            last = max(last, end)
+        counts = np.zeros((last - start).days, dtype=np.int64)
+        counts[:len(self.counts)] = self.counts
+        counts[(dates - np.datetime64(start, "D")).astype(np.int64)] = stats
+        return DaySeries(start, counts)
+
+    def trimmed(self):
+        """Без нулей в конце, как HAVING stat > 0 + WITH FILL."""
+        nonzero = np.flatnonzero(self.counts)
+        if len(nonzero) == 0:
+            return DaySeries()
+        return DaySeries(self.start, self.counts[:nonzero[-1] + 1])
+
+    def window(self, start, end):
+        """Значения за дни [start, end), дни вне ряда — нули."""
+        counts = np.zeros((end - start).days, dtype=np.int64)
+        if self.start is not None:
+            low = max(start, self.start)
+            high = min(end, self.start + datetime.timedelta(days=len(self.counts)))
+            if low < high:
+                counts[(low - start).days:(high - start).days] = \
+                    self.counts[(low - self.start).days:(high - self.start).days]
+        return counts
+
+
+class DailyHistoryCache:
+    def __init__(self, size, directory=None):
+        self.size = size
+        self.directory = directory
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(":".join(key).encode()).hexdigest() + ".json")
+
+    def _load(self, key):
+        try:
+            with open(self._path(key)) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        start = datetime.date.fromisoformat(data["start"]) if data["start"] else None
+        return DaySeries(start, np.array(data["counts"], dtype=np.int64)), datetime.date.fromisoformat(data["until"])
+
+    def _save(self, key, entry):
+        series, until = entry
+        path = self._path(key)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"start": series.start.isoformat() if series.start else None,
+                       "until": until.isoformat(),
+                       "counts": series.counts.tolist()}, f)
+        os.replace(path + ".tmp", path)
+
+    def get(self, post_id, column):
+        """(ряд закрытых дней, первый незакэшированный день) или None."""
+        if self.size <= 0:
+            return None
+        key = (column, post_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._load(key) if self.directory else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def put(self, post_id, column, series, until):
+        if self.size <= 0:
+            return
+        key = (column, post_id)
+        with self._lock:
+            self._remember(key, (series, until))
+        if self.directory:
+            self._save(key, (series, until))
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "size": self.size, "hits": self.hits, "misses": self.misses}
+
+
+def since(cached):
+    """С какого дня читать ClickHouse при закэшированном cached."""
+    return cached[1] if cached else EPOCH
+
+
+def merge(cache, post_id, column, cached, columns, closed_before):
+    """
+    Полный ряд поста: закэшированные закрытые дни плюс прочитанные из ClickHouse (columns — результат
+    daily_history_since). Закрывшиеся с прошлого раза дни добавляются в кэш.
+    """
+    if len(columns):
+        dates, stats = columns["date"], columns["stat"]
+    else:
+        dates, stats = np.zeros(0, dtype="datetime64[D]"), np.zeros(0, dtype=np.int64)
+    series = cached[0] if cached else DaySeries()
+    if closed_before is not None and closed_before > since(cached):
+        split = np.searchsorted(dates, np.datetime64(closed_before, "D"))
+        series = series.extend(dates[:split], stats[:split], end=closed_before)
+        cache.put(post_id, column, series, closed_before)
+        dates, stats = dates[split:], stats[split:]
+    return series.extend(dates, stats).trimmed()
@@ -0,0 +1,328 @@
+"""
+Загрузка событий из Kafka в ClickHouse без Kafka-движка (например, в управляемом ClickHouse, где он отключён).
+
+    python -m app.ingest
+
+Воркер читает топики событий (JSON и protobuf *_v2) группой INGEST_GROUP и копит пачку до
+INGEST_BATCH_SIZE сообщений или INGEST_LINGER секунд с первого сообщения. Пачка раскладывается по
+столбцам и вставляется native-форматом clickhouse_connect в Null-таблицы *_stream: их представления
+(03–07) отбрасывают повторы по event_id и заполняют сырые таблицы и счётчики. Неразобранные сообщения пишутся в kafka_dead_letters.
+Offset'ы коммитятся только после успешной вставки всей пачки, неудачная вставка повторяется с тем же
+insert_deduplication_token (партиции и диапазоны offset'ов пачки), так что вставка, которая на самом
+деле прошла, повторно не записывается. Если воркер упал между вставкой и коммитом, пачка будет
+загружена ещё раз; её события отбросятся по event_id.
+
+Воркер заменяет Kafka-таблицы 02_kafka_tables.sql: при работающих mv_*_stream события посчитаются
+дважды, поэтому в ClickHouse создаются только таблицы из 02 (*_stream, kafka_dead_letters).
+Время событий — 'YYYY-MM-DD hh:mm:ss[.fff]' в UTC или unix-время в секундах, как у Kafka-движка на сервере
+в UTC; в protobuf — поле *_ms, у старых сообщений — секундное поле.
+"""
+import base64
+import json
+import logging
+import os
+import signal
+import time
+
+import events_pb2
+import numpy as np
+from clickhouse_connect.driver.exceptions import ClickHouseError
+from google.protobuf.message import DecodeError
+from kafka import ConsumerRebalanceListener, KafkaConsumer
+from kafka.errors import CommitFailedError
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092").split(",")
+INGEST_GROUP = os.getenv("INGEST_GROUP", "stats-ingest")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "50000"))
+INGEST_LINGER = float(os.getenv("INGEST_LINGER", "1"))
+INGEST_RETRY_BACKOFF = float(os.getenv("INGEST_RETRY_BACKOFF", "1"))
+
+# Null-таблица -> её столбцы; последний столбец — время события (DateTime64(3)), остальные String
+TABLES = {
+    "views_stream": ("user_id", "post_id", "event_id", "viewed_at"),
+    "likes_stream": ("user_id", "post_id", "event_id", "liked_at"),
+    "comments_stream": ("user_id", "post_id", "comment_id", "event_id", "commented_at"),
+}
+# Столбцы, которых может не быть в событиях, записанных до их появления
+OPTIONAL_COLUMNS = {"event_id": ""}
+# Топик -> Null-таблица и сообщение events.proto (None — JSON)
+TOPICS = {
+    "post_views": ("views_stream", None),
+    "post_likes": ("likes_stream", None),
+    "post_comments": ("comments_stream", None),
+    "post_views_v2": ("views_stream", events_pb2.PostView),
+    "post_likes_v2": ("likes_stream", events_pb2.PostLike),
+    "post_comments_v2": ("comments_stream", events_pb2.PostComment),
+}
+DEAD_LETTER_COLUMNS = ("topic", "partition", "offset", "raw_message", "error", "received_at")
+DEAD_LETTER_TYPES = ("String", "UInt64", "UInt64", "String", "String", "DateTime")
+MAX_DATETIME = 2 ** 32
+
+logger = logging.getLogger(__name__)
+
+
+def epoch_millis(values):
+    """Столбец времени (строки или числа — миллисекунды) в миллисекунды unix-времени и маска значений
+    от 1970 года до конца диапазона DateTime."""
+    try:
+        times = np.array(values, dtype="datetime64[ms]")
+    except (ValueError, TypeError, OverflowError):
+        times = np.array([_datetime64(value) for value in values], dtype="datetime64[ms]")
+    millis = times.astype(np.int64)
+    return millis, ~np.isnat(times) & (millis >= 0) & (millis < MAX_DATETIME * 1000)
+
+
+def _datetime64(value):
+    try:
+        return np.datetime64(value, "ms")
+    except (ValueError, TypeError, OverflowError):
+        return np.datetime64("NaT")
+
+
+def uuid_string(value):
+    """16 байт UUID в строку 'xxxxxxxx-xxxx-...'; пустое поле — пустая строка. Быстрее str(uuid.UUID(...))."""
+    if not value:
+        return ""
+    if len(value) != 16:
+        raise ValueError(f"Expected 16-byte UUID, got {len(value)} bytes")
+    h = value.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def decode(message, value, columns):
+    """Значения столбцов из JSON (message None) или сообщения events.proto; UUID из 16 байт — в строку."""
+    if message is None:
+        event = json.loads(value)
+        values = [event[name] if name not in OPTIONAL_COLUMNS else event.get(name, OPTIONAL_COLUMNS[name])
+                  for name in columns]
+        if not all(isinstance(field, str) for field in values[:-1]):
+            raise ValueError("Expected string identifiers")
+        if type(values[-1]) is int:
+            values[-1] *= 1000
+        return values
+    event = message.FromString(value)
+    values = [uuid_string(field) if isinstance(field, bytes) else field
+              for field in (getattr(event, name) for name in columns[:-1])]
+    time_column = columns[-1]
+    values.append(getattr(event, time_column + "_ms") or getattr(event, time_column) * 1000)
+    return values
+
+
+class Batch:
+    """Сообщения одной пачки, разложенные по столбцам таблиц *_stream."""
+
+    def __init__(self):
+        self.columns = {table: tuple([] for _ in columns) for table, columns in TABLES.items()}
+        # (topic, partition, offset, value) строк, чтобы отправить в kafka_dead_letters строку с плохим временем
+        self.sources = {table: [] for table in TABLES}
+        self.dead_letters = []
+        # (topic, partition) -> [первый, последний offset]: из них собирается insert_deduplication_token
+        self.offsets = {}
+        self.size = 0
+        self.bytes = 0
+        self.started = None
+
+    def add(self, record):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.size += 1
+        self.bytes += len(record.value or b"")
+        offsets = self.offsets.setdefault((record.topic, record.partition), [record.offset, record.offset])
+        offsets[0] = min(offsets[0], record.offset)
+        offsets[1] = max(offsets[1], record.offset)
+        table, message = TOPICS[record.topic]
+        try:
+            values = decode(message, record.value, TABLES[table])
+        except (ValueError, TypeError, KeyError, DecodeError) as e:
+            self.reject(record.topic, record.partition, record.offset, record.value, f"{type(e).__name__}: {e}")
+            return
+        for column, value in zip(self.columns[table], values):
+            column.append(value)
+        self.sources[table].append((record.topic, record.partition, record.offset, record.value))
+
+    def reject(self, topic, partition, offset, value, error):
+        if not isinstance(value, bytes):
+            raw_message = str(value)
+        elif TOPICS[topic][1] is None:
+            raw_message = value.decode("utf-8", "replace")
+        else:
+            raw_message = base64.b64encode(value).decode()
+        self.dead_letters.append([topic, partition, offset, raw_message, error, int(time.time())])
+
+    def inserts(self):
+        """Вставки пачки: [(таблица, столбцы, типы, данные по столбцам)], kafka_dead_letters — последней."""
+        inserts = []
+        for table, names in TABLES.items():
+            columns = self.columns[table]
+            if not columns[0]:
+                continue
+            strings = columns[:-1]
+            millis, valid = epoch_millis(columns[-1])
+            if not valid.all():
+                for index in np.flatnonzero(~valid):
+                    self.reject(*self.sources[table][index], f"Invalid {names[-1]}")
+                keep = np.flatnonzero(valid)
+                strings = [[column[i] for i in keep] for column in strings]
+                millis = millis[keep]
+            if len(millis):
+                types = ("String",) * len(strings) + ("DateTime64(3)",)
+                inserts.append((table, names, types, [*strings, millis.tolist()]))
+        if self.dead_letters:
+            rows = list(zip(*self.dead_letters))
+            inserts.append(("kafka_dead_letters", DEAD_LETTER_COLUMNS, DEAD_LETTER_TYPES, rows))
+        return inserts
+
+    def deduplication_token(self, table):
+        """Одинаковый для повторов вставки этой пачки в table: таблица и диапазоны offset'ов по партициям."""
+        ranges = ",".join(f"{topic}/{partition}/{first}-{last}"
+                          for (topic, partition), (first, last) in sorted(self.offsets.items()))
+        return f"{table}:{ranges}"
+
+
+class IngestMetrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.messages = 0
+        self.rows = 0
+        self.dead_letters = 0
+        self.bytes = 0
+        self.batches = 0
+        self.insert_seconds_total = 0.0
+        self.insert_seconds_max = 0.0
+        self.insert_errors = 0
+        self.commit_errors = 0
+
+    def record(self, batch, inserts, seconds):
+        self.messages += batch.size
+        self.bytes += batch.bytes
+        self.rows += sum(len(data[0]) for table, _, _, data in inserts if table != "kafka_dead_letters")
+        self.dead_letters += len(batch.dead_letters)
+        self.batches += 1
+        self.insert_seconds_total += seconds
+        self.insert_seconds_max = max(self.insert_seconds_max, seconds)
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "messages": self.messages,
+            "rows": self.rows,
+            "dead_letters": self.dead_letters,
+            "batches": self.batches,
+            "messages_per_second": round(self.messages / elapsed, 1),
+            "mb_per_second": round(self.bytes / elapsed / 2 ** 20, 3),
+            "insert_seconds_total": round(self.insert_seconds_total, 3),
+            "insert_seconds_max": round(self.insert_seconds_max, 3),
+            "insert_errors": self.insert_errors,
+            "commit_errors": self.commit_errors,
+        }
+
+
+class IngestWorker:
+    def __init__(self, consumer, client, batch_size=INGEST_BATCH_SIZE, linger=INGEST_LINGER,
+                 retry_backoff=INGEST_RETRY_BACKOFF):
+        self.consumer = consumer
+        self.client = client
+        self.batch_size = batch_size
+        self.linger = linger
+        self.retry_backoff = retry_backoff
+        self.batch = Batch()
+        self.metrics = IngestMetrics()
+        self.running = True
+
+    def poll(self):
+        """Одна выборка из Kafka; пачка вставляется, когда набрала batch_size сообщений или прошло linger секунд."""
+        timeout = self.linger
+        if self.batch.started is not None:
+            timeout = max(0.0, self.linger - (time.monotonic() - self.batch.started))
+        records = self.consumer.poll(timeout_ms=int(timeout * 1000), max_records=self.batch_size - self.batch.size)
+        for partition_records in records.values():
+            for record in partition_records:
+                self.batch.add(record)
+        if self.batch.size >= self.batch_size or (
+                self.batch.started is not None and time.monotonic() - self.batch.started >= self.linger):
+            self.flush()
+
+    def flush(self):
+        """Вставка накопленной пачки и коммит offset'ов прочитанных сообщений."""
+        batch, self.batch = self.batch, Batch()
+        if not batch.size:
+            return
+        inserts = batch.inserts()
+        started = time.perf_counter()
+        pending = list(inserts)
+        while pending:
+            table, columns, types, data = pending[0]
+            settings = {
+                "insert_deduplication_token": batch.deduplication_token(table),
+                "deduplicate_blocks_in_dependent_materialized_views": 1,
+            }
+            try:
+                self.client.insert(table, data, column_names=columns, column_type_names=types, column_oriented=True,
+                                   settings=settings)
+            except ClickHouseError as e:
+                # Повторяется только невставленная таблица: вставленные уже прошли через представления
+                self.metrics.insert_errors += 1
+                logger.warning("Failed to insert %d rows into %s: %s", len(data[0]), table, e)
+                if not self.running:
+                    return
+                time.sleep(self.retry_backoff)
+                continue
+            pending.pop(0)
+        self.metrics.record(batch, inserts, time.perf_counter() - started)
+        try:
+            self.consumer.commit()
+        except CommitFailedError as e:
+            # Партиции уже у другого воркера, он перечитает пачку с последнего коммита
+            self.metrics.commit_errors += 1
+            logger.warning("Failed to commit offsets after insert: %s", e)
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self, log_interval):
+        next_log = time.monotonic() + log_interval
+        while self.running:
+            self.poll()
+            if time.monotonic() >= next_log:
+                next_log = time.monotonic() + log_interval
+                logger.info("Ingest: %s", self.metrics.snapshot())
+        self.flush()
+
+
+class FlushOnRevoke(ConsumerRebalanceListener):
+    """Перед передачей партиций другому воркеру пачка вставляется и коммитится."""
+
+    def __init__(self, worker):
+        self.worker = worker
+
+    def on_partitions_revoked(self, revoked):
+        self.worker.flush()
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+
+def main():
+    from .handlers import METRICS_LOG_INTERVAL, create_client
+
+    logging.basicConfig(level=logging.INFO)
+    consumer = KafkaConsumer(
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        group_id=INGEST_GROUP,
+        enable_auto_commit=False,
+        auto_offset_reset="earliest",
+        max_poll_records=INGEST_BATCH_SIZE,
+    )
+    worker = IngestWorker(consumer, create_client())
+    consumer.subscribe(list(TOPICS), listener=FlushOnRevoke(worker))
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    try:
+        worker.run(METRICS_LOG_INTERVAL)
+    finally:
+        consumer.close(autocommit=False)
+        logger.info("Ingest stopped: %s", worker.metrics.snapshot())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,16 @@
+import asyncio
+import os
+
 from .handlers import serve
 
+# async — grpc.aio (app/aio.py), threads — синхронный grpc.server с пулом клиентов. По умолчанию async:
+# подписка StreamPostStats в нём корутина, а в threads занимает поток сервера
+SERVING_MODE = os.getenv("STATS_SERVING_MODE", "async")
+
 if __name__ == '__main__':
-    serve()
\ No newline at end of file
+    if SERVING_MODE == "async":
+        from .aio import serve as serve_async
+
+        asyncio.run(serve_async())
+    else:
+        serve()
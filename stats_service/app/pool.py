@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from clickhouse_connect.driver.exceptions import OperationalError
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ClientPool:
+    """
+    Пул клиентов ClickHouse для потоков gRPC-сервера: запрос берёт свободный клиент на время
+    выполнения. Клиенты создаются при первой необходимости (не больше size), клиент, простоявший
+    дольше health_check_interval, перед выдачей проверяется ping, а после сетевой ошибки
+    закрывается и при следующем запросе создаётся заново.
+    """
+
+    def __init__(self, factory, size=4, acquire_timeout=5.0, health_check_interval=30.0):
+        self.factory = factory
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._waits = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+    def _create_slot(self):
+        with self._lock:
+            if self._created >= self.size:
+                return False
+            self._created += 1
+            return True
+
+    def _new_client(self):
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, client):
+        with self._lock:
+            self._created -= 1
+            self._discarded += 1
+        # будит поток, ждущий в acquire: освободилось место под новый клиент
+        self._idle.put((None, 0))
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def _record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self._waits += 1
+            self._wait_seconds_total += seconds
+            self._wait_seconds_max = max(self._wait_seconds_max, seconds)
+            self._timeouts += int(timed_out)
+
+    def acquire(self):
+        started = time.perf_counter()
+        while True:
+            try:
+                client, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                if self._create_slot():
+                    client = self._new_client()
+                    self._record_wait(time.perf_counter() - started)
+                    return client
+                timeout = self.acquire_timeout - (time.perf_counter() - started)
+                try:
+                    client, released_at = self._idle.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    self._record_wait(time.perf_counter() - started, timed_out=True)
+                    raise PoolTimeout(f"No ClickHouse client available in {self.acquire_timeout}s")
+            if client is None:
+                continue
+            if time.monotonic() - released_at >= self.health_check_interval and not client.ping():
+                self._discard(client)
+                continue
+            self._record_wait(time.perf_counter() - started)
+            return client
+
+    def release(self, client):
+        self._idle.put((client, time.monotonic()))
+
+    @contextmanager
+    def client(self):
+        client = self.acquire()
+        try:
+            yield client
+        except OperationalError:
+            self._discard(client)
+            raise
+        except BaseException:
+            self.release(client)
+            raise
+        else:
+            self.release(client)
+
+    def query(self, *args, **kwargs):
+        with self.client() as client:
+            return client.query(*args, **kwargs)
+
+    def command(self, *args, **kwargs):
+        with self.client() as client:
+            return client.command(*args, **kwargs)
+
+    def ping(self):
+        try:
+            with self.client() as client:
+                return client.ping()
+        except Exception:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": self._idle.qsize(),
+                "waits": self._waits,
+                "wait_seconds_total": self._wait_seconds_total,
+                "wait_seconds_max": self._wait_seconds_max,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+            }
+
+    def close(self):
+        while True:
+            try:
+                client, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if client is None:
+                continue
+            with self._lock:
+                self._created -= 1
+            client.close()
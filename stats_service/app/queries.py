@@ -0,0 +1,366 @@
+"""
+Запросы stats_service к ClickHouse. Каждый запрос — именованный шаблон с серверной подстановкой
+параметров ({post_id:String}, {metric:Identifier}) и своими ограничениями; текст запроса не
+зависит от аргументов. По каждому шаблону собираются число вызовов, время и прочитанные строки.
+
+В сырых таблицах событий post_id — UUID, в таблицах счётчиков — String. Для сырых таблиц id
+переводится через toUUIDOrNull: строка, которая не является UUID, даёт пустой результат, а не ошибку,
+и не совпадает с нулевым UUID, под которым записаны события с некорректным post_id.
+
+Сырые таблицы — ReplacingMergeTree: повторно доставленное событие лежит там отдельной строкой до
+слияния, поэтому события считаются через uniqExact(event_id), а не count(), и FINAL не нужен.
+"""
+import logging
+import math
+import os
+import threading
+import time
+
+from .backfill import EVENT_TABLES, UNIQUE_COLUMNS
+
+MAX_EXECUTION_TIME = int(os.getenv("STATS_QUERY_MAX_EXECUTION_TIME", "5"))
+SLOW_QUERY_SECONDS = float(os.getenv("STATS_SLOW_QUERY_SECONDS", "1"))
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTemplate:
+    def __init__(self, name, sql, max_rows_to_read, columnar=False, **settings):
+        self.name = name
+        self.sql = sql
+        # columnar: результат — столбцы NumPy (result.np_result) вместо кортежей по строкам
+        self.query_options = {"use_numpy": True} if columnar else {}
+        self.settings = {
+            "max_execution_time": MAX_EXECUTION_TIME,
+            "max_rows_to_read": max_rows_to_read,
+            **settings,
+        }
+
+
+class QueryStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows_read = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_seconds": self.total_seconds,
+            "max_seconds": self.max_seconds,
+            "rows_read": self.rows_read,
+        }
+
+
+WINDOW_CONDITION = " AND hour >= toStartOfHour(now() - toIntervalHour({hours:UInt32}))"
+
+
+def raw_metrics_history(unit, function):
+    """Все метрики из сырых таблиц: UNION ALL событий с именем своей таблицы, повторы отбрасывает uniqExact."""
+    selects = []
+    for table, time_column in EVENT_TABLES.items():
+        selects.append(f"""
+            SELECT {function}({time_column}) AS bucket, event_id, '{table}' AS metric
+            FROM {table}
+            WHERE post_id = toUUIDOrNull({{post_id:String}})
+                AND {time_column} >= {{start:DateTime}} AND {time_column} < {{end:DateTime}}
+            """)
+    return QueryTemplate(
+        f"metrics_history_{unit.lower()}_raw",
+        f"""
+        SELECT bucket, {", ".join(f"uniqExactIf(event_id, metric = '{metric}') AS {metric}" for metric in EVENT_TABLES)}
+        FROM ({"UNION ALL".join(selects)})
+        GROUP BY bucket
+        ORDER BY bucket WITH FILL FROM {{start:DateTime}} TO {{end:DateTime}} STEP INTERVAL 1 {unit}
+        """,
+        max_rows_to_read=150_000_000,
+        columnar=True,
+    )
+
+
+def exact_uniques():
+    """Уникальные пользователи по сырым событиям: uniqExact держит в памяти всех пользователей постов."""
+    selects = " UNION ALL ".join(
+        f"SELECT toString(post_id) AS post_id, user_id, '{table}' AS metric FROM {table} "
+        f"WHERE post_id IN (SELECT toUUIDOrNull(arrayJoin({{post_ids:Array(String)}})))"
+        for table in EVENT_TABLES
+    )
+    columns = ", ".join(f"uniqExactIf(user_id, metric = '{table}') AS {column}"
+                        for table, column in UNIQUE_COLUMNS.items())
+    return QueryTemplate(
+        "posts_uniques",
+        f"""
+        SELECT post_id, {columns}
+        FROM ({selects})
+        GROUP BY post_id
+        """,
+        max_rows_to_read=150_000_000,
+    )
+
+
+TEMPLATES = {template.name: template for template in [
+    QueryTemplate(
+        "post_stats",
+        "SELECT sum(views), sum(likes), sum(comments) FROM post_counters WHERE post_id = {post_id:String}",
+        max_rows_to_read=10_000_000,
+    ),
+    QueryTemplate(
+        "posts_stats",
+        """
+        SELECT post_id, sum(views), sum(likes), sum(comments)
+        FROM post_counters
+        WHERE post_id IN {post_ids:Array(String)}
+        GROUP BY post_id
+        """,
+        max_rows_to_read=50_000_000,
+    ),
+    exact_uniques(),
+    # approximate: слияние состояний uniqCombined за дни поста вместо чтения всех событий
+    QueryTemplate(
+        "posts_uniques_approximate",
+        """
+        SELECT post_id, uniqCombinedMerge(viewers), uniqCombinedMerge(likers), uniqCombinedMerge(commenters)
+        FROM post_unique_daily
+        WHERE post_id IN {post_ids:Array(String)}
+        GROUP BY post_id
+        """,
+        max_rows_to_read=10_000_000,
+    ),
+    # sum() доскладывает ещё не слитые фоновыми слияниями строки, в основном за текущий день.
+    # since — первый день, которого нет в кэше закрытых дней (app/history_cache.py)
+    QueryTemplate(
+        "daily_history_since",
+        """
+        SELECT date, sum({metric:Identifier}) AS stat
+        FROM post_daily_counters
+        WHERE post_id = {post_id:String} AND date >= {since:Date}
+        GROUP BY date
+        HAVING stat > 0
+        ORDER BY date
+        """,
+        max_rows_to_read=10_000_000,
+        columnar=True,
+    ),
+    QueryTemplate(
+        "recent_comments",
+        """
+        SELECT toStartOfMinute(commented_at) as minute, uniqExact(event_id) as stat
+        FROM comments
+        WHERE post_id = toUUIDOrNull({post_id:String}) AND commented_at > now() - INTERVAL 1 HOUR
+        GROUP BY minute
+        ORDER BY minute
+        """,
+        max_rows_to_read=10_000_000,
+    ),
+    # Все 61 минута окна, включая текущую, даже если комментариев не было
+    QueryTemplate(
+        "recent_comments_packed",
+        """
+        SELECT toStartOfMinute(commented_at) AS bucket, uniqExact(event_id) AS stat
+        FROM comments
+        WHERE post_id = toUUIDOrNull({post_id:String}) AND commented_at > now() - INTERVAL 1 HOUR
+        GROUP BY bucket
+        ORDER BY bucket WITH FILL
+            FROM toStartOfMinute(now() - INTERVAL 1 HOUR)
+            TO toStartOfMinute(now()) + INTERVAL 1 MINUTE
+            STEP INTERVAL 1 MINUTE
+        """,
+        max_rows_to_read=10_000_000,
+        columnar=True,
+    ),
+    # GetPostHistory (app/history.py): start и end уже выровнены по интервалам, end не включается
+    QueryTemplate(
+        "history_hour",
+        """
+        SELECT hour AS bucket, sum({metric:Identifier}) AS stat
+        FROM post_hourly_counters
+        WHERE post_id = {post_id:String} AND hour >= {start:DateTime} AND hour < {end:DateTime}
+        GROUP BY bucket
+        ORDER BY bucket WITH FILL FROM {start:DateTime} TO {end:DateTime} STEP INTERVAL 1 HOUR
+        """,
+        max_rows_to_read=10_000_000,
+        columnar=True,
+    ),
+    *[QueryTemplate(
+        f"history_{unit.lower()}_raw",
+        f"""
+        SELECT {function}({{time_column:Identifier}}) AS bucket, uniqExact(event_id) AS stat
+        FROM {{table:Identifier}}
+        WHERE post_id = toUUIDOrNull({{post_id:String}})
+            AND {{time_column:Identifier}} >= {{start:DateTime}} AND {{time_column:Identifier}} < {{end:DateTime}}
+        GROUP BY bucket
+        ORDER BY bucket WITH FILL FROM {{start:DateTime}} TO {{end:DateTime}} STEP INTERVAL 1 {unit}
+        """,
+        max_rows_to_read=50_000_000,
+        columnar=True,
+    ) for unit, function in [("MINUTE", "toStartOfMinute"), ("HOUR", "toStartOfHour")]],
+    *[QueryTemplate(
+        f"history_{unit.lower()}",
+        f"""
+        SELECT {bucket} AS bucket, sum({{metric:Identifier}}) AS stat
+        FROM post_daily_counters
+        WHERE post_id = {{post_id:String}} AND date >= {{start:Date}} AND date < {{end:Date}}
+        GROUP BY bucket
+        ORDER BY bucket WITH FILL FROM {{start:Date}} TO {{end:Date}} STEP INTERVAL 1 {unit}
+        """,
+        max_rows_to_read=10_000_000,
+        columnar=True,
+    ) for unit, bucket in [("DAY", "date"), ("WEEK", "toStartOfWeek(date, 1)"), ("MONTH", "toStartOfMonth(date)")]],
+    # GetPostMetricsHistory: views, likes и comments по одним и тем же интервалам одним запросом
+    QueryTemplate(
+        "metrics_history_hour",
+        """
+        SELECT hour AS bucket, sum(views) AS views, sum(likes) AS likes, sum(comments) AS comments
+        FROM post_hourly_counters
+        WHERE post_id = {post_id:String} AND hour >= {start:DateTime} AND hour < {end:DateTime}
+        GROUP BY bucket
+        ORDER BY bucket WITH FILL FROM {start:DateTime} TO {end:DateTime} STEP INTERVAL 1 HOUR
+        """,
+        max_rows_to_read=10_000_000,
+        columnar=True,
+    ),
+    raw_metrics_history("MINUTE", "toStartOfMinute"),
+    raw_metrics_history("HOUR", "toStartOfHour"),
+    *[QueryTemplate(
+        f"metrics_history_{unit.lower()}",
+        f"""
+        SELECT {bucket} AS bucket, sum(views) AS views, sum(likes) AS likes, sum(comments) AS comments
+        FROM post_daily_counters
+        WHERE post_id = {{post_id:String}} AND date >= {{start:Date}} AND date < {{end:Date}}
+        GROUP BY bucket
+        ORDER BY bucket WITH FILL FROM {{start:Date}} TO {{end:Date}} STEP INTERVAL 1 {unit}
+        """,
+        max_rows_to_read=10_000_000,
+        columnar=True,
+    ) for unit, bucket in [("DAY", "date"), ("WEEK", "toStartOfWeek(date, 1)"), ("MONTH", "toStartOfMonth(date)")]],
+    QueryTemplate(
+        "top_posts",
+        """
+        SELECT post_id, sum({metric:Identifier}) as cnt
+        FROM post_counters
+        GROUP BY post_id
+        HAVING cnt > 0
+        ORDER BY cnt DESC, post_id
+        LIMIT {limit:UInt32}
+        """,
+        max_rows_to_read=100_000_000,
+    ),
+    # окно с точностью до часа: включается и неполный час на его начале
+    QueryTemplate(
+        "top_posts_window",
+        """
+        SELECT post_id, sum({metric:Identifier}) as cnt
+        FROM post_hourly_counters
+        WHERE hour >= toStartOfHour(now() - toIntervalHour({hours:UInt32}))
+        GROUP BY post_id
+        HAVING cnt > 0
+        ORDER BY cnt DESC, post_id
+        LIMIT {limit:UInt32}
+        """,
+        max_rows_to_read=100_000_000,
+    ),
+    QueryTemplate(
+        "top_users",
+        """
+        SELECT user_id, sum({metric:Identifier}) as cnt
+        FROM user_counters
+        GROUP BY user_id
+        HAVING cnt > 0
+        ORDER BY cnt DESC, user_id
+        LIMIT {limit:UInt32}
+        """,
+        max_rows_to_read=100_000_000,
+    ),
+    QueryTemplate(
+        "top_users_window",
+        """
+        SELECT user_id, sum({metric:Identifier}) as cnt
+        FROM user_hourly_counters
+        WHERE hour >= toStartOfHour(now() - toIntervalHour({hours:UInt32}))
+        GROUP BY user_id
+        HAVING cnt > 0
+        ORDER BY cnt DESC, user_id
+        LIMIT {limit:UInt32}
+        """,
+        max_rows_to_read=100_000_000,
+    ),
+    # approximate: topKWeighted хранит около 3 * limit счётчиков вместо хеш-таблицы по всем постам
+    # или пользователям; порядок по убыванию, редкие ошибки — у соседних по значению мест
+    *[QueryTemplate(
+        f"top_{key}s{suffix}_approximate",
+        f"""
+        SELECT arrayJoin(topKWeighted({{limit:UInt32}})({key}_id, {{metric:Identifier}})) AS {key}_id
+        FROM {table}
+        WHERE {{metric:Identifier}} > 0{condition}
+        """,
+        max_rows_to_read=100_000_000,
+    ) for key, suffix, table, condition in [
+        ("post", "", "post_counters", ""),
+        ("post", "_window", "post_hourly_counters", WINDOW_CONDITION),
+        ("user", "", "user_counters", ""),
+        ("user", "_window", "user_hourly_counters", WINDOW_CONDITION),
+    ]],
+]}
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record(name, seconds, rows_read, failed=False):
+    with _stats_lock:
+        stats = _stats.setdefault(name, QueryStats())
+        stats.calls += 1
+        stats.errors += int(failed)
+        stats.total_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.rows_read += rows_read
+    if seconds >= SLOW_QUERY_SECONDS:
+        logger.warning("Slow query %s: %.3fs, %d rows read", name, seconds, rows_read)
+
+
+def query_stats():
+    """Снимок метрик по шаблонам: {имя: {calls, errors, total_seconds, max_seconds, rows_read}}."""
+    with _stats_lock:
+        return {name: stats.as_dict() for name, stats in _stats.items()}
+
+
+def query_settings(template, timeout=None):
+    """Настройки шаблона; timeout — остаток дедлайна RPC, сокращает max_execution_time."""
+    settings = dict(template.settings)
+    if timeout is not None:
+        # max_execution_time целый, 0 — без ограничения, поэтому не меньше секунды
+        settings["max_execution_time"] = max(1, min(settings["max_execution_time"], math.ceil(timeout)))
+    return settings
+
+
+def _finish(name, started, result):
+    summary = getattr(result, "summary", None) or {}
+    record(name, time.perf_counter() - started, int(summary.get("read_rows", 0)))
+    return result
+
+
+def execute(client, name, timeout=None, **parameters):
+    template = TEMPLATES[name]
+    started = time.perf_counter()
+    try:
+        result = client.query(template.sql, parameters=parameters, settings=query_settings(template, timeout),
+                              **template.query_options)
+    except Exception:
+        record(name, time.perf_counter() - started, 0, failed=True)
+        raise
+    return _finish(name, started, result)
+
+
+async def execute_async(client, name, timeout=None, **parameters):
+    template = TEMPLATES[name]
+    started = time.perf_counter()
+    try:
+        result = await client.query(template.sql, parameters=parameters, settings=query_settings(template, timeout),
+                                    **template.query_options)
+    except Exception:
+        record(name, time.perf_counter() - started, 0, failed=True)
+        raise
+    return _finish(name, started, result)
@@ -0,0 +1,238 @@
+"""
+Активность постов за последние минуты в памяти: поминутные просмотры, лайки и комментарии за
+STATS_RECENT_MINUTES минут и текущую минуту, собранные прямо из топиков событий.
+
+У каждого поста — слот в массиве counts[слот, метрика, минута % (minutes + 1)]: кольцо, в котором
+при переходе к новой минуте обнуляются устаревшие ячейки. Слоты выдаются по LRU последнего события,
+так что вытесняются посты, дольше всех остававшиеся без событий; число слотов — STATS_RECENT_CAPACITY
+(uint32, 12 * (minutes + 1) байт на пост).
+
+Консьюмер читает топики без группы (у каждой реплики сервиса своё окно), при старте — с offset'ов
+начала окна (offsets_for_times). Пока он не дочитал до конечных offset'ов на момент старта, окно
+неполное, и RPC идут в ClickHouse. Минуты, события которых могли потеряться (вытеснен пост с событиями
+в окне), тоже отдаются из ClickHouse, пока не выйдут из окна. Повторно доставленные события
+отбрасываются по event_id среди последних STATS_RECENT_SEEN_EVENTS, как uniqExact(event_id) в запросах
+к сырым таблицам.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from kafka import KafkaConsumer, TopicPartition
+
+from .ingest import KAFKA_BOOTSTRAP_SERVERS, TABLES, TOPICS, Batch, epoch_millis
+
+RECENT_MINUTES = int(os.getenv("STATS_RECENT_MINUTES", "60"))
+# 0 — без окна в памяти, все запросы в ClickHouse
+RECENT_CAPACITY = int(os.getenv("STATS_RECENT_CAPACITY", "50000"))
+RECENT_POLL_RECORDS = int(os.getenv("STATS_RECENT_POLL_RECORDS", "10000"))
+# Повтор события приходит в ту же партицию вскоре после первого: помнить последние столько event_id
+RECENT_SEEN_EVENTS = int(os.getenv("STATS_RECENT_SEEN_EVENTS", "100000"))
+MINUTE_MS = 60 * 1000
+
+# Null-таблица ingest.TABLES -> индекс метрики в counts
+METRICS = {"views_stream": 0, "likes_stream": 1, "comments_stream": 2}
+
+logger = logging.getLogger(__name__)
+
+
+class RecentActivity:
+    def __init__(self, minutes=RECENT_MINUTES, capacity=RECENT_CAPACITY):
+        self.minutes = minutes
+        self.size = minutes + 1
+        self.capacity = capacity
+        self.counts = np.zeros((capacity, len(METRICS), self.size), dtype=np.uint32)
+        # последняя минута (от эпохи), записанная в слот
+        self.last_minute = np.zeros(capacity, dtype=np.int64)
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Пустое окно, например перед повторным чтением топиков с начала окна."""
+        with self._lock:
+            self.slots = collections.OrderedDict()
+            self.free = list(range(self.capacity))[::-1]
+            # с этой минуты в памяти все события; None — консьюмер ещё не дочитал
+            self.complete_from = None
+            # события до этой минуты могли быть вытеснены
+            self.evicted_before = 0
+
+    def mark_complete(self, minute):
+        with self._lock:
+            self.complete_from = minute
+
+    def _slot(self, post_id):
+        slot = self.slots.get(post_id)
+        if slot is not None:
+            self.slots.move_to_end(post_id)
+            return slot
+        if self.free:
+            slot = self.free.pop()
+        else:
+            _, slot = self.slots.popitem(last=False)
+            self.evictions += 1
+            # события вытесненного поста за эти минуты потеряны
+            self.evicted_before = max(self.evicted_before, int(self.last_minute[slot]) + 1)
+        self.slots[post_id] = slot
+        self.counts[slot] = 0
+        self.last_minute[slot] = 0
+        return slot
+
+    def add(self, metric, post_ids, minutes):
+        """События одной метрики: post_id и минута от эпохи каждого; события старше окна поста не считаются."""
+        minutes = np.asarray(minutes, dtype=np.int64)
+        if not len(minutes):
+            return
+        # последняя минута каждого поста в пачке
+        latest = {}
+        for post_id, minute in zip(post_ids, minutes.tolist()):
+            if minute > latest.get(post_id, -1):
+                latest[post_id] = minute
+        with self._lock:
+            slots = {}
+            for post_id, minute in latest.items():
+                slot = slots[post_id] = self._slot(post_id)
+                last = int(self.last_minute[slot])
+                if minute > last:
+                    # ячейки минут last+1..minute заняты устаревшими значениями
+                    stale = np.arange(max(last + 1, minute - self.size + 1), minute + 1) % self.size
+                    self.counts[slot, :, stale] = 0
+                    self.last_minute[slot] = minute
+            rows = np.fromiter((slots[post_id] for post_id in post_ids), dtype=np.int64, count=len(minutes))
+            keep = minutes > self.last_minute[rows] - self.size
+            np.add.at(self.counts, (rows[keep], metric, minutes[keep] % self.size), 1)
+
+    def _ready(self, start):
+        return self.complete_from is not None and start >= max(self.complete_from, self.evicted_before)
+
+    def window(self, post_id, now=None):
+        """Начало окна (минута от эпохи) и counts[метрика, минута] за minutes минут до текущей включительно;
+        None — окно в памяти неполное."""
+        end = int((now if now is not None else time.time()) // 60)
+        start = end - self.minutes
+        minutes = np.arange(start, end + 1)
+        with self._lock:
+            if not self._ready(start):
+                self.misses += 1
+                return None
+            self.hits += 1
+            slot = self.slots.get(post_id)
+            if slot is None:
+                return start, np.zeros((len(METRICS), self.size), dtype=np.uint32)
+            last = int(self.last_minute[slot])
+            counts = self.counts[slot][:, minutes % self.size]
+        counts[:, (minutes > last) | (minutes <= last - self.size)] = 0
+        return start, counts
+
+    def stats(self):
+        with self._lock:
+            return {
+                "posts": len(self.slots),
+                "capacity": self.capacity,
+                "evictions": self.evictions,
+                "hits": self.hits,
+                "misses": self.misses,
+                "complete_from": self.complete_from,
+                "evicted_before": self.evicted_before,
+            }
+
+
+class SeenEvents:
+    def __init__(self, size=RECENT_SEEN_EVENTS):
+        self.size = size
+        self.ids = collections.OrderedDict()
+        self.duplicates = 0
+
+    def first(self, event_id):
+        """False — событие с этим event_id уже было; события без event_id не сравниваются."""
+        if not event_id:
+            return True
+        if event_id in self.ids:
+            self.duplicates += 1
+            return False
+        self.ids[event_id] = None
+        if len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+        return True
+
+
+class RecentConsumer:
+    """Заполняет RecentActivity из топиков событий; окно полное, когда дочитаны конечные offset'ы на момент старта."""
+
+    def __init__(self, recent, consumer, streams=None):
+        self.recent = recent
+        self.consumer = consumer
+        # app.stream.PostStatsStreams: подписчикам — только новые события, не перечитанные при старте
+        self.streams = streams
+        self.targets = None
+        self.warm_from = None
+        self.seen = SeenEvents()
+
+    def start(self, now=None):
+        now_ms = int((now if now is not None else time.time()) * 1000)
+        partitions = [TopicPartition(topic, partition) for topic in TOPICS
+                      for partition in self.consumer.partitions_for_topic(topic) or ()]
+        self.consumer.assign(partitions)
+        # с запасом в минуту: окно начинается с начала минуты
+        since = now_ms - (self.recent.minutes + 1) * MINUTE_MS
+        offsets = self.consumer.offsets_for_times({tp: since for tp in partitions})
+        for tp in partitions:
+            if offsets.get(tp) is not None:
+                self.consumer.seek(tp, offsets[tp].offset)
+            else:
+                self.consumer.seek_to_end(tp)
+        self.targets = {tp: offset for tp, offset in self.consumer.end_offsets(partitions).items() if offset > 0}
+        self.warm_from = since // MINUTE_MS + 1
+        self._check_warm()
+
+    def _check_warm(self):
+        if self.targets is None:
+            return
+        if all(self.consumer.position(tp) >= offset for tp, offset in self.targets.items()):
+            self.targets = None
+            self.recent.mark_complete(self.warm_from)
+            logger.info("Recent activity is warm: %s", self.recent.stats())
+
+    def poll(self, timeout_ms=1000):
+        records = self.consumer.poll(timeout_ms=timeout_ms, max_records=RECENT_POLL_RECORDS)
+        publish = self.streams is not None and self.targets is None
+        batch = Batch()
+        for partition_records in records.values():
+            for record in partition_records:
+                batch.add(record)
+        for table, columns in batch.columns.items():
+            if not columns[0]:
+                continue
+            millis, valid = epoch_millis(columns[-1])
+            event_ids = columns[TABLES[table].index("event_id")]
+            keep = np.array([ok and self.seen.first(event_id) for event_id, ok in zip(event_ids, valid.tolist())],
+                            dtype=bool)
+            post_ids = [post_id for post_id, ok in zip(columns[1], keep.tolist()) if ok]
+            self.recent.add(METRICS[table], post_ids, millis[keep] // MINUTE_MS)
+            if publish:
+                self.streams.publish(METRICS[table], post_ids)
+        self._check_warm()
+
+
+def create_consumer():
+    return KafkaConsumer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS, enable_auto_commit=False)
+
+
+def run(recent, streams=None, create=create_consumer, retry_interval=5):
+    while True:
+        # после ошибки окно читается заново: события за время ошибки иначе пропали бы
+        recent.reset()
+        try:
+            reader = RecentConsumer(recent, create(), streams)
+            reader.start()
+            while True:
+                reader.poll()
+        except Exception as e:
+            logger.warning("Recent activity consumer failed: %s", e)
+            time.sleep(retry_interval)
@@ -0,0 +1,111 @@
+"""
+Подписки StreamPostStats. Прибавки счётчиков приходят из консьюмера app.recent (тех же событий, что
+попадают в окно активности) и копятся в подписке до отправки, так что медленный клиент получает
+одну сумму, а не очередь сообщений. Прибавки не согласованы с ClickHouse (загрузка туда отстаёт на
+секунды), поэтому поток периодически присылает счётчики целиком.
+"""
+import asyncio
+import os
+import threading
+
+STREAM_SNAPSHOT_INTERVAL = float(os.getenv("STATS_STREAM_SNAPSHOT_INTERVAL", "30"))
+# Не чаще одного сообщения с прибавками за столько секунд
+STREAM_INTERVAL = float(os.getenv("STATS_STREAM_INTERVAL", "0.5"))
+MAX_STREAMS = int(os.getenv("STATS_MAX_STREAMS", "1000"))
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, post_id, loop=None):
+        self.post_id = post_id
+        self.deltas = [0, 0, 0]
+        self.closed = False
+        self._condition = threading.Condition()
+        # для grpc.aio: консьюмер будит корутину через цикл событий
+        self._loop = loop
+        self._event = asyncio.Event() if loop is not None else None
+
+    def add(self, metric, count):
+        with self._condition:
+            self.deltas[metric] += count
+            self._condition.notify()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:
+                # цикл событий уже закрыт, подписка вот-вот удалится
+                pass
+
+    def close(self):
+        """Клиент отключился: ожидающий wait возвращается сразу."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+    def take(self):
+        """Накопленные прибавки (views, likes, comments), счётчик подписки обнуляется."""
+        with self._condition:
+            deltas, self.deltas = self.deltas, [0, 0, 0]
+        if self._event is not None:
+            self._event.clear()
+        return deltas
+
+    def wait(self, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: any(self.deltas) or self.closed, timeout)
+        return self.take()
+
+    async def wait_async(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.take()
+
+
+class PostStatsStreams:
+    def __init__(self, max_streams=MAX_STREAMS):
+        self.max_streams = max_streams
+        self._subscriptions = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, post_id, loop=None):
+        subscription = Subscription(post_id, loop)
+        with self._lock:
+            if self._count >= self.max_streams:
+                raise TooManyStreams(f"At most {self.max_streams} streams")
+            self._subscriptions.setdefault(post_id, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.post_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            self._count -= 1
+            if not subscriptions:
+                del self._subscriptions[subscription.post_id]
+
+    def publish(self, metric, post_ids):
+        """События одной метрики: прибавки подписчикам постов из post_ids."""
+        with self._lock:
+            if not self._subscriptions:
+                return
+            counts = {}
+            for post_id in post_ids:
+                if post_id in self._subscriptions:
+                    counts[post_id] = counts.get(post_id, 0) + 1
+            targets = [(subscription, count) for post_id, count in counts.items()
+                       for subscription in self._subscriptions[post_id]]
+        for subscription, count in targets:
+            subscription.add(metric, count)
+
+    def stats(self):
+        with self._lock:
+            return {"posts": len(self._subscriptions), "streams": self._count}
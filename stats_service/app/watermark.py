@@ -0,0 +1,107 @@
+"""
+Водяной знак загрузки событий: момент, до которого всё отправленное в Kafka уже записано в ClickHouse.
+
+Раз в STATS_WATERMARK_INTERVAL секунд запоминаются конечные offset'ы топиков событий; как только
+группы Kafka-движка ClickHouse (02_kafka_tables.sql) закоммитили offset'ы не меньше запомненных,
+все события, отправленные до этого момента, уже в таблицах. Если события загружает воркер app.ingest
+(STATS_INGESTION=worker), проверяется его группа INGEST_GROUP. День считается закрытым, когда водяной
+знак прошёл его конец с запасом STATS_CLOSED_DAY_GRACE на расхождение часов и задержку отправки.
+"""
+import collections
+import datetime
+import logging
+import os
+import threading
+import time
+
+from kafka import KafkaAdminClient, KafkaConsumer, TopicPartition
+
+from .ingest import INGEST_GROUP, TOPICS
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092").split(",")
+# Топик -> группа Kafka-движка ClickHouse
+KAFKA_ENGINE_GROUPS = {
+    "post_views": "clickhouse-group-views",
+    "post_likes": "clickhouse-group-likes",
+    "post_comments": "clickhouse-group-comments",
+    "post_views_v2": "clickhouse-group-views-v2",
+    "post_likes_v2": "clickhouse-group-likes-v2",
+    "post_comments_v2": "clickhouse-group-comments-v2",
+}
+# engine — Kafka-движок ClickHouse, worker — воркер app.ingest
+INGESTION = os.getenv("STATS_INGESTION", "engine")
+WATERMARK_INTERVAL = float(os.getenv("STATS_WATERMARK_INTERVAL", "30"))
+CLOSED_DAY_GRACE = datetime.timedelta(seconds=float(os.getenv("STATS_CLOSED_DAY_GRACE", "300")))
+
+logger = logging.getLogger(__name__)
+
+
+def ingestion_groups(ingestion=None):
+    """Топик -> группа, которая загружает его в ClickHouse."""
+    if (ingestion or INGESTION) == "worker":
+        return {topic: INGEST_GROUP for topic in TOPICS}
+    return KAFKA_ENGINE_GROUPS
+
+
+class KafkaOffsets:
+    """Конечные и закоммиченные загружающими группами offset'ы по партициям топиков событий."""
+
+    def __init__(self, bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS, groups=None):
+        self.bootstrap_servers = bootstrap_servers
+        self.groups = groups if groups is not None else ingestion_groups()
+        self._consumer = None
+        self._admin = None
+
+    def __call__(self):
+        if self._consumer is None:
+            self._consumer = KafkaConsumer(bootstrap_servers=self.bootstrap_servers, enable_auto_commit=False)
+            self._admin = KafkaAdminClient(bootstrap_servers=self.bootstrap_servers)
+        partitions = {
+            topic: [TopicPartition(topic, partition) for partition in self._consumer.partitions_for_topic(topic) or ()]
+            for topic in self.groups
+        }
+        # сначала конечные offset'ы: всё, что отправлено до этого момента, лежит ниже них
+        ends = self._consumer.end_offsets([tp for tps in partitions.values() for tp in tps])
+        committed = {}
+        for topic, group in self.groups.items():
+            offsets = self._admin.list_consumer_group_offsets(group, partitions=partitions[topic])
+            committed.update({tp: meta.offset for tp, meta in offsets.items()})
+        return ends, committed
+
+
+def caught_up(committed, end):
+    """У партиции без сообщений группа ничего не коммитит (offset -1), а конечный offset — 0."""
+    return max(committed, 0) >= end
+
+
+class LagWatermark:
+    def __init__(self, fetch_offsets, grace=CLOSED_DAY_GRACE, max_pending=1000):
+        self.fetch_offsets = fetch_offsets
+        self.grace = grace
+        self.watermark = None
+        self._pending = collections.deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+
+    def observe(self, now=None):
+        now = now or datetime.datetime.utcnow()
+        ends, committed = self.fetch_offsets()
+        with self._lock:
+            self._pending.append((now, ends))
+            while self._pending and all(caught_up(committed.get(tp, -1), end) for tp, end in self._pending[0][1].items()):
+                self.watermark = self._pending.popleft()[0]
+
+    def closed_before(self):
+        """Первый день, который ещё может измениться; None — водяной знак неизвестен."""
+        with self._lock:
+            if self.watermark is None:
+                return None
+            return (self.watermark - self.grace).date()
+
+
+def run(watermark, interval=WATERMARK_INTERVAL):
+    while True:
+        try:
+            watermark.observe()
+        except Exception as e:
+            logger.warning("Failed to read Kafka offsets: %s", e)
+        time.sleep(interval)
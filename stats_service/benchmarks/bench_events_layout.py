@@ -0,0 +1,144 @@
+"""
+Прочитанные байты и размер на диске для старой и новой схемы сырых событий (01_create_main_tables.sql).
+
+    python -m benchmarks.bench_events_layout [--events 5000000] [--posts 50000] [--users 20000]
+
+События генерируются в базе bench_layout_old по прежней схеме (String, DateTime без кодеков, без
+партиций, с текстом комментариев) и переносятся в bench_layout_new теми же INSERT ... SELECT, что
+и в stats_clickhouse/migrations/001_events_layout.sql. Затем одни и те же запросы выполняются
+на обеих схемах; read_bytes берётся из сводки ответа ClickHouse. Подключение — как у сервиса
+(CLICKHOUSE_HOST, CLICKHOUSE_PORT, ...), сервер должен знать политику hot_cold.
+"""
+import argparse
+import os
+import re
+import time
+
+from app.handlers import create_client
+
+OLD = "bench_layout_old"
+NEW = "bench_layout_new"
+DEFAULT_SCHEMA = os.path.join(os.path.dirname(__file__), "..", "..", "stats_clickhouse", "init",
+                              "01_create_main_tables.sql")
+
+OLD_LAYOUT = [
+    "CREATE TABLE {db}.likes (user_id String, post_id String, liked_at DateTime) "
+    "ENGINE = MergeTree() ORDER BY (post_id, liked_at)",
+    "CREATE TABLE {db}.views (user_id String, post_id String, viewed_at DateTime) "
+    "ENGINE = MergeTree() ORDER BY (post_id, viewed_at)",
+    "CREATE TABLE {db}.comments (user_id String, post_id String, comment_id String, content String, "
+    "commented_at DateTime) ENGINE = MergeTree() ORDER BY (post_id, commented_at)",
+]
+# Как в миграциях 001_events_layout.sql и 003_event_ids.sql
+MIGRATE = {
+    "likes": "SELECT user_id, toUUIDOrZero(post_id), generateUUIDv4(), liked_at FROM {old}.likes",
+    "views": "SELECT user_id, toUUIDOrZero(post_id), generateUUIDv4(), viewed_at FROM {old}.views",
+    "comments": "SELECT user_id, toUUIDOrZero(post_id), toUUIDOrZero(comment_id), generateUUIDv4(), commented_at "
+                "FROM {old}.comments",
+}
+# {post} — post_id в условии: строка в старой схеме, UUID в новой
+QUERIES = [
+    ("post stats (GetPostStats exact uniques)",
+     "SELECT count(), uniqExact(user_id) FROM {db}.views WHERE post_id = {post}"),
+    ("post hourly history, 7 days (history_hour_raw)",
+     "SELECT toStartOfHour(viewed_at) AS bucket, count() FROM {db}.views "
+     "WHERE post_id = {post} AND viewed_at >= now() - INTERVAL 7 DAY GROUP BY bucket"),
+    ("recent comments (recent_comments)",
+     "SELECT toStartOfMinute(commented_at) AS minute, count() FROM {db}.comments "
+     "WHERE post_id = {post} AND commented_at > now() - INTERVAL 1 HOUR GROUP BY minute"),
+    ("one month of views (app.backfill)",
+     "SELECT post_id, count() FROM {db}.views "
+     "WHERE viewed_at >= toStartOfMonth(now()) - INTERVAL 1 MONTH AND viewed_at < toStartOfMonth(now()) "
+     "GROUP BY post_id"),
+    ("likes of one user (by_user projection)",
+     "SELECT post_id, liked_at FROM {db}.likes WHERE user_id = {{user_id:String}}"),
+    ("comments of one user (by_user projection)",
+     "SELECT post_id, comment_id FROM {db}.comments WHERE user_id = {{user_id:String}}"),
+]
+
+
+def new_layout(path):
+    """DDL новой схемы из init-скрипта с именами таблиц в базе NEW."""
+    sql = "\n".join(line for line in open(path).read().splitlines() if not line.startswith("--"))
+    return [re.sub(r"IF NOT EXISTS (\w+)", rf"{NEW}.\1", statement)
+            for statement in sql.split(";") if statement.strip()]
+
+
+def prepare(client, events, posts, users, schema):
+    for db in (OLD, NEW):
+        client.command(f"DROP DATABASE IF EXISTS {db}")
+        client.command(f"CREATE DATABASE {db}")
+    for statement in OLD_LAYOUT:
+        client.command(statement.format(db=OLD))
+    for statement in new_layout(schema):
+        client.command(statement)
+
+    # У небольшой части постов и пользователей — большинство событий, время — за последние полгода
+    post = f"UUIDNumToString(sipHash128(toUInt32(pow(rand(1) / 4294967295, 3) * {posts})))"
+    user = f"concat('user', toString(toUInt32(pow(rand(2) / 4294967295, 2) * {users})))"
+    at = "now() - rand(3) % (180 * 86400)"
+    settings = {"max_partitions_per_insert_block": 1000}
+    client.command(f"INSERT INTO {OLD}.views SELECT {user}, {post}, {at} FROM numbers({events})")
+    client.command(f"INSERT INTO {OLD}.likes SELECT {user}, {post}, {at} FROM numbers({events // 5})")
+    client.command(f"INSERT INTO {OLD}.comments SELECT {user}, {post}, toString(generateUUIDv4(number)), "
+                   f"randomPrintableASCII(100 + rand(4) % 400), {at} FROM numbers({events // 20})")
+    for table, select in MIGRATE.items():
+        client.command(f"INSERT INTO {NEW}.{table} {select.format(old=OLD)}", settings=settings)
+    for db in (OLD, NEW):
+        for table in MIGRATE:
+            client.command(f"OPTIMIZE TABLE {db}.{table} FINAL")
+
+
+def disk_usage(client):
+    rows = client.query(
+        "SELECT database, table, sum(bytes_on_disk) FROM system.parts "
+        "WHERE database IN {databases:Array(String)} AND active GROUP BY database, table",
+        parameters={"databases": [OLD, NEW]}
+    ).result_rows
+    return {(db, table): size for db, table, size in rows}
+
+
+def run_query(client, sql, parameters):
+    started = time.perf_counter()
+    result = client.query(sql, parameters=parameters, settings={"use_query_cache": 0})
+    return int(result.summary.get("read_bytes", 0)), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the old and new layout of the raw event tables")
+    parser.add_argument("--events", type=int, default=5_000_000, help="views; likes are 1/5, comments 1/20")
+    parser.add_argument("--posts", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA, help="init script with the new layout")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark databases")
+    args = parser.parse_args()
+
+    client = create_client()
+    prepare(client, args.events, args.posts, args.users, args.schema)
+
+    usage = disk_usage(client)
+    print(f"{'table':<12}{'old MiB':>10}{'new MiB':>10}{'ratio':>8}")
+    for table in MIGRATE:
+        old, new = usage.get((OLD, table), 0), usage.get((NEW, table), 0)
+        print(f"{table:<12}{old / 2 ** 20:>10.1f}{new / 2 ** 20:>10.1f}{old / max(new, 1):>8.1f}")
+
+    post_id, user_id = client.query(
+        f"SELECT (SELECT post_id FROM {OLD}.views GROUP BY post_id ORDER BY count() DESC LIMIT 1), "
+        f"(SELECT user_id FROM {OLD}.likes GROUP BY user_id ORDER BY count() DESC LIMIT 1)"
+    ).result_rows[0]
+    parameters = {"post_id": post_id, "user_id": user_id}
+    print(f"\n{'query':<48}{'old read':>12}{'new read':>12}{'ratio':>8}{'old ms':>9}{'new ms':>9}")
+    for name, sql in QUERIES:
+        old_bytes, old_seconds = run_query(client, sql.format(db=OLD, post="{post_id:String}"), parameters)
+        new_bytes, new_seconds = run_query(client, sql.format(db=NEW, post="toUUIDOrNull({post_id:String})"),
+                                           parameters)
+        print(f"{name:<48}{old_bytes:>12}{new_bytes:>12}{old_bytes / max(new_bytes, 1):>8.1f}"
+              f"{old_seconds * 1000:>9.1f}{new_seconds * 1000:>9.1f}")
+
+    if not args.keep:
+        for db in (OLD, NEW):
+            client.command(f"DROP DATABASE {db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Пропускная способность воркера app.ingest в зависимости от размера пачки и формата событий.
+
+    python -m benchmarks.bench_ingest [--messages 1000000] [--batch-sizes 1000,10000,50000]
+                                      [--formats json,protobuf] [--clickhouse]
+
+Брокер заменён InMemoryConsumer: сообщения (просмотры, лайки и комментарии 20:5:1, доля битых —
+--malformed) заранее сериализованы в JSON или protobuf (events.proto, топики *_v2) и отдаются poll()
+частями, как у KafkaConsumer. По умолчанию
+вставка только собирается в native-блоки clickhouse_connect без отправки — стоимость разбора и
+сериализации в самом воркере. С --clickhouse блоки вставляются в Null-таблицы базы bench_ingest на
+сервере из CLICKHOUSE_HOST, CLICKHOUSE_PORT, ...
+"""
+import argparse
+import collections
+import itertools
+import json
+import random
+import time
+import uuid
+
+from clickhouse_connect.datatypes.registry import get_from_name
+from clickhouse_connect.driver.insert import InsertContext
+from clickhouse_connect.driver.transform import NativeTransform
+
+from app.ingest import IngestWorker, TABLES, TOPICS
+
+BENCH_DB = "bench_ingest"
+Record = collections.namedtuple("Record", "topic partition offset value")
+
+
+class InMemoryConsumer:
+    def __init__(self, records, partitions=4, max_poll_records=500):
+        self.records = records
+        self.partitions = partitions
+        self.max_poll_records = max_poll_records
+        self.position = 0
+        self.commits = 0
+
+    def poll(self, timeout_ms=0, max_records=None):
+        count = min(max_records or self.max_poll_records, self.max_poll_records)
+        chunk = self.records[self.position:self.position + count]
+        self.position += len(chunk)
+        polled = collections.defaultdict(list)
+        for record in chunk:
+            polled[(record.topic, record.partition)].append(record)
+        return polled
+
+    def commit(self):
+        self.commits += 1
+
+    def done(self):
+        return self.position >= len(self.records)
+
+
+class NativeClient:
+    """Собирает тело native-вставки так же, как clickhouse_connect перед отправкой, и ничего не отправляет."""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def insert(self, table, data, column_names=None, column_type_names=None, column_oriented=False, settings=None):
+        context = InsertContext(table, column_names, [get_from_name(name) for name in column_type_names],
+                                data, column_oriented=column_oriented, compression="lz4")
+        for chunk in NativeTransform.build_insert(context):
+            self.bytes += len(chunk)
+
+
+def encode(topic, event, fmt):
+    time_column = TABLES[TOPICS[topic][0]][-1]
+    if fmt == "json":
+        event = {name: str(value) if isinstance(value, uuid.UUID) else value for name, value in event.items()}
+        millis = event[time_column]
+        event[time_column] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(millis // 1000)) + f".{millis % 1000:03d}"
+        return json.dumps(event).encode()
+    event = {name: value.bytes if isinstance(value, uuid.UUID) else value for name, value in event.items()}
+    event[time_column + "_ms"], event[time_column] = event[time_column], event[time_column] // 1000
+    return TOPICS[topic + "_v2"][1](**event).SerializeToString()
+
+
+def generate(messages, posts, users, malformed, fmt):
+    now = int(time.time() * 1000)
+    post_ids = [uuid.UUID(int=random.getrandbits(128)) for _ in range(posts)]
+    topics = random.choices(["post_views", "post_likes", "post_comments"], weights=[20, 5, 1], k=messages)
+    records = []
+    for offset, topic in enumerate(topics):
+        if random.random() < malformed:
+            value = b'{"user_id": "broken' if fmt == "json" else b"\x12\x03abc"
+        else:
+            columns = TABLES[TOPICS[topic][0]]
+            event = {"user_id": f"user{random.randrange(users)}", "post_id": random.choice(post_ids),
+                     "event_id": uuid.uuid4()}
+            if "comment_id" in columns:
+                event["comment_id"] = uuid.uuid4()
+                event["content"] = "x" * random.randrange(20, 200)
+            event[columns[-1]] = now - random.randrange(86400 * 1000)
+            value = encode(topic, event, fmt)
+        records.append(Record(topic if fmt == "json" else topic + "_v2", offset % 4, offset, value))
+    return records
+
+
+def prepare_clickhouse():
+    from app.handlers import create_client
+
+    client = create_client()
+    client.command(f"DROP DATABASE IF EXISTS {BENCH_DB}")
+    client.command(f"CREATE DATABASE {BENCH_DB}")
+    for table, columns in TABLES.items():
+        definition = ", ".join(f"{name} String" for name in columns[:-1])
+        client.command(f"CREATE TABLE {BENCH_DB}.{table} ({definition}, {columns[-1]} DateTime64(3)) ENGINE = Null")
+    client.command(f"CREATE TABLE {BENCH_DB}.kafka_dead_letters (topic String, partition UInt64, offset UInt64, "
+                   f"raw_message String, error String, received_at DateTime) ENGINE = Null")
+    client.database = BENCH_DB
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the Kafka ingestion worker")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--batch-sizes", default="1000,10000,50000")
+    parser.add_argument("--formats", default="json,protobuf")
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--malformed", type=float, default=0.001, help="share of unparsable messages")
+    parser.add_argument("--clickhouse", action="store_true", help="insert into Null tables on the server")
+    args = parser.parse_args()
+
+    client = prepare_clickhouse() if args.clickhouse else NativeClient()
+    print(f"{'format':<10}{'bytes/msg':>10}{'batch':>8}{'msg/s':>12}{'MB/s':>8}{'batches':>9}"
+          f"{'insert ms avg':>15}{'insert ms max':>15}")
+    for fmt, batch_size in itertools.product(args.formats.split(","), [int(size) for size in args.batch_sizes.split(",")]):
+        records = generate(args.messages, args.posts, args.users, args.malformed, fmt)
+        consumer = InMemoryConsumer(records)
+        worker = IngestWorker(consumer, client, batch_size=batch_size, linger=60)
+        started = time.perf_counter()
+        while not consumer.done():
+            worker.poll()
+        worker.flush()
+        seconds = time.perf_counter() - started
+        metrics = worker.metrics
+        assert metrics.messages == len(records) and consumer.commits == metrics.batches
+        print(f"{fmt:<10}{metrics.bytes / metrics.messages:>10.1f}{batch_size:>8}{metrics.messages / seconds:>12.0f}{metrics.bytes / seconds / 2 ** 20:>8.1f}"
+              f"{metrics.batches:>9}{metrics.insert_seconds_total / metrics.batches * 1000:>15.1f}"
+              f"{metrics.insert_seconds_max * 1000:>15.1f}")
+
+    if args.clickhouse:
+        client.command(f"DROP DATABASE {BENCH_DB}")
+
+
+if __name__ == "__main__":
+    main()
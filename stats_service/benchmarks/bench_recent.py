@@ -0,0 +1,59 @@
+"""
+Окно активности в памяти (app.recent): скорость добавления событий и время ответа окна поста.
+
+    python -m benchmarks.bench_recent [--events 1000000] [--posts 10000] [--capacity 50000] [--reads 100000]
+
+События (просмотры, лайки и комментарии 20:5:1) распределены по постам по закону Ципфа и по минутам
+последнего часа и добавляются пачками по --batch, как их передаёт консьюмер. Затем читаются окна
+случайных постов — то, что делает GetPostRecentActivity до сборки ответа.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.recent import RecentActivity
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory recent activity window")
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--capacity", type=int, default=50_000)
+    parser.add_argument("--minutes", type=int, default=60)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--reads", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    now = time.time()
+    end = int(now // 60)
+    post_ids = [f"post{i}" for i in range(args.posts)]
+    posts = (rng.zipf(1.3, args.events) - 1) % args.posts
+    metrics = rng.choice(3, args.events, p=[20 / 26, 5 / 26, 1 / 26])
+    # в порядке времени, как в топике
+    minutes = np.sort(rng.integers(end - args.minutes, end + 1, args.events))
+
+    recent = RecentActivity(args.minutes, args.capacity)
+    recent.mark_complete(0)
+    started = time.perf_counter()
+    for start in range(0, args.events, args.batch):
+        chunk = slice(start, start + args.batch)
+        for metric in range(3):
+            mask = metrics[chunk] == metric
+            recent.add(metric, [post_ids[i] for i in posts[chunk][mask]], minutes[chunk][mask])
+    add_seconds = time.perf_counter() - started
+
+    reads = [post_ids[i] for i in rng.integers(0, args.posts, args.reads)]
+    started = time.perf_counter()
+    for post_id in reads:
+        recent.window(post_id, now)
+    read_seconds = time.perf_counter() - started
+
+    print(f"posts in memory: {recent.stats()['posts']}, counts: {recent.counts.nbytes / 2 ** 20:.1f} MB")
+    print(f"add:    {args.events / add_seconds:>12.0f} events/s")
+    print(f"window: {read_seconds / args.reads * 1e6:>12.1f} us per post")
+
+
+if __name__ == "__main__":
+    main()
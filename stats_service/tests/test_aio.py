@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import grpc
+import stats_pb2
+
+from app import aio
+
+
+class DummyContext:
+    def __init__(self, remaining=None):
+        self.code = None
+        self.details = None
+        self.remaining = remaining
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+    def time_remaining(self):
+        return self.remaining
+
+
+class SlowClient:
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = []
+
+    async def query(self, query, parameters=None, settings=None):
+        self.calls.append((parameters, settings))
+        await asyncio.sleep(self.delay)
+
+        class Result:
+            result_rows = [(post_id, 1, 2, 3) for post_id in parameters.get("post_ids", [])] or [(7, 8, 9)]
+
+        return Result()
+
+
+def test_posts_stats_chunks_run_concurrently(monkeypatch):
+    client = SlowClient()
+    monkeypatch.setattr(aio, "async_client", client)
+    monkeypatch.setattr(aio, "BATCH_CHUNK_POSTS", 100)
+    request = stats_pb2.PostsStatsRequest(post_ids=[f"post{i}" for i in range(250)])
+
+    started = time.perf_counter()
+    response = asyncio.run(aio.AsyncStatsService().GetPostsStats(request, DummyContext()))
+    elapsed = time.perf_counter() - started
+
+    # счётчики и уникальные пользователи каждой части
+    assert [len(parameters["post_ids"]) for parameters, _ in client.calls] == [100, 100, 50] * 2
+    assert elapsed < 2 * client.delay
+    assert [s.post_id for s in response.stats] == list(request.post_ids)
+    assert response.stats[0].views == 1
+
+
+def test_deadline_limits_execution_time(monkeypatch):
+    client = SlowClient(delay=0)
+    monkeypatch.setattr(aio, "async_client", client)
+    context = DummyContext(remaining=1.5)
+
+    response = asyncio.run(aio.AsyncStatsService().GetPostStats(stats_pb2.PostStatsRequest(post_id="p1"), context))
+
+    assert (response.views, response.likes, response.comments) == (7, 8, 9)
+    assert client.calls[0][1]["max_execution_time"] == 2
+
+
+def test_database_error_sets_internal(monkeypatch):
+    class FailingClient:
+        async def query(self, query, parameters=None, settings=None):
+            raise RuntimeError("boom")
+
+    monkeypatch.setattr(aio, "async_client", FailingClient())
+    context = DummyContext()
+    asyncio.run(aio.AsyncStatsService().GetTopTenPosts(stats_pb2.TopTenPostsRequest(param=stats_pb2.LIKES), context))
+    assert context.code == grpc.StatusCode.INTERNAL
@@ -0,0 +1,50 @@
+import datetime
+
+from app.backfill import backfill, month_ranges
+
+
+class RecordingClient:
+    def __init__(self, first_events):
+        self.first_events = first_events
+        self.commands = []
+
+    def query(self, query, parameters=None):
+        table = query.split(" FROM ")[1].split()[0]
+
+        class Result:
+            result_rows = [(self.first_events.get(table),)]
+
+        return Result()
+
+    def command(self, command, parameters=None):
+        self.commands.append((command, parameters))
+
+
+def test_month_ranges():
+    ranges = list(month_ranges(datetime.datetime(2025, 1, 20), datetime.datetime(2025, 3, 4, 12)))
+    assert ranges == [
+        (datetime.datetime(2025, 1, 20), datetime.datetime(2025, 2, 1)),
+        (datetime.datetime(2025, 2, 1), datetime.datetime(2025, 3, 1)),
+        (datetime.datetime(2025, 3, 1), datetime.datetime(2025, 3, 4, 12)),
+    ]
+
+
+def test_backfill_skips_empty_tables():
+    client = RecordingClient({"views": datetime.datetime(2025, 2, 10)})
+    backfill(client, datetime.datetime(2025, 3, 4))
+
+    assert all("(views)" not in command and " FROM views " in command for command, _ in client.commands)
+    assert client.commands[-1][1] == {"start": datetime.datetime(2025, 3, 1), "end": datetime.datetime(2025, 3, 4)}
+    targets = [command.split()[2] for command, _ in client.commands]
+    assert targets.count("post_counters") == 2
+    assert set(targets) == {"post_counters", "post_daily_counters", "user_counters",
+                            "post_hourly_counters", "user_hourly_counters", "post_unique_daily"}
+    assert "post_unique_daily (post_id, date, viewers)" in client.commands[-1][0]
+
+
+def test_backfill_skips_hourly_rollups_beyond_retention():
+    client = RecordingClient({"likes": datetime.datetime(2024, 12, 10)})
+    backfill(client, datetime.datetime(2025, 3, 4))
+
+    hourly = [parameters["start"] for command, parameters in client.commands if "_hourly_counters" in command]
+    assert hourly == [datetime.datetime(2025, 2, 1)] * 2 + [datetime.datetime(2025, 3, 1)] * 2
@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+import stats_pb2
+
+from app.history import history_query, history_range, metrics_history_query
+
+NOW = datetime.datetime(2025, 5, 14, 10, 30, 15)
+
+
+def request(**kwargs):
+    return stats_pb2.PostHistoryRequest(post_id="p1", **kwargs)
+
+
+def test_default_ranges_end_with_current_bucket():
+    assert history_range(request(granularity=stats_pb2.MINUTE), NOW) == (
+        datetime.datetime(2025, 5, 14, 9, 30), datetime.datetime(2025, 5, 14, 10, 31))
+    assert history_range(request(granularity=stats_pb2.DAY), NOW) == (
+        datetime.datetime(2025, 4, 14), datetime.datetime(2025, 5, 15))
+    # 14.05.2025 — среда, недели с понедельника
+    assert history_range(request(granularity=stats_pb2.WEEK), NOW)[1] == datetime.datetime(2025, 5, 19)
+    assert history_range(request(granularity=stats_pb2.MONTH, from_time="2024-12-20"), NOW) == (
+        datetime.datetime(2024, 12, 1), datetime.datetime(2025, 6, 1))
+
+
+def test_explicit_range_with_offset():
+    start, end = history_range(request(granularity=stats_pb2.HOUR, from_time="2025-05-10T03:20:00+03:00",
+                                       to_time="2025-05-10T05:00:00Z"), NOW)
+    assert (start, end) == (datetime.datetime(2025, 5, 10, 0), datetime.datetime(2025, 5, 10, 6))
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"granularity": stats_pb2.DAY, "from_time": "2025-05-10", "to_time": "2025-05-01"},
+    {"granularity": stats_pb2.MINUTE, "from_time": "2020-01-01"},
+    {"granularity": stats_pb2.DAY, "from_time": "yesterday"},
+])
+def test_invalid_ranges(kwargs):
+    with pytest.raises(ValueError):
+        history_range(request(**kwargs), NOW)
+
+
+def test_cheapest_table_for_granularity():
+    name, parameters = history_query(request(granularity=stats_pb2.HOUR), "likes", NOW)
+    assert name == "history_hour"
+    assert parameters["metric"] == "likes"
+
+    name, parameters = history_query(request(granularity=stats_pb2.HOUR, from_time="2025-04-01"), "likes", NOW)
+    assert name == "history_hour_raw"
+    assert (parameters["table"], parameters["time_column"]) == ("likes", "liked_at")
+
+    name, parameters = history_query(request(granularity=stats_pb2.WEEK), "views", NOW)
+    assert name == "history_week"
+    assert parameters["start"] == datetime.date(2024, 11, 11)
+
+    with pytest.raises(ValueError):
+        history_query(request(granularity=stats_pb2.DAY), None, NOW)
+
+
+def test_metrics_history_uses_same_sources():
+    assert metrics_history_query(request(granularity=stats_pb2.MINUTE), NOW)[0] == "metrics_history_minute_raw"
+    assert metrics_history_query(request(granularity=stats_pb2.HOUR), NOW)[0] == "metrics_history_hour"
+    name, parameters = metrics_history_query(request(granularity=stats_pb2.MONTH), NOW)
+    assert name == "metrics_history_month"
+    assert parameters == {"post_id": "p1", "start": datetime.date(2024, 5, 1), "end": datetime.date(2025, 6, 1)}
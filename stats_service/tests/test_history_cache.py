@@ -0,0 +1,129 @@
+import datetime
+
+import numpy as np
+import stats_pb2
+
+from app import handlers
+from app.history_cache import EPOCH, DailyHistoryCache, DaySeries, merge, since
+from app import watermark as watermark_module
+from app.watermark import LagWatermark
+
+
+def day_columns(*days):
+    return np.array([(np.datetime64(day), stat) for day, stat in days],
+                    dtype=[("date", "datetime64[D]"), ("stat", "uint64")])
+
+
+def test_watermark_waits_for_engine_groups_to_catch_up():
+    snapshots = iter([
+        ({"p0": 10}, {"p0": 5}),
+        ({"p0": 12}, {"p0": 11}),
+        ({"p0": 15}, {"p0": 12}),
+    ])
+    watermark = LagWatermark(lambda: next(snapshots), grace=datetime.timedelta(minutes=5))
+    t0 = datetime.datetime(2025, 5, 2, 0, 1)
+
+    watermark.observe(t0)
+    assert watermark.closed_before() is None
+    watermark.observe(t0 + datetime.timedelta(minutes=1))
+    # offset'ы на момент t0 уже закоммичены, на t0 + 1 минута — ещё нет
+    assert watermark.watermark == t0
+    assert watermark.closed_before() == datetime.date(2025, 5, 1)
+    watermark.observe(t0 + datetime.timedelta(minutes=10))
+    assert watermark.watermark == t0 + datetime.timedelta(minutes=1)
+    assert watermark.closed_before() == datetime.date(2025, 5, 1)
+
+
+def test_watermark_passes_empty_partitions():
+    # в JSON-топики никто не пишет: конечный offset 0, закоммиченного offset'а у группы нет (-1)
+    snapshots = iter([
+        ({"post_views/0": 0, "post_views_v2/0": 10}, {"post_views/0": -1, "post_views_v2/0": 10}),
+    ])
+    watermark = LagWatermark(lambda: next(snapshots), grace=datetime.timedelta(minutes=5))
+    t0 = datetime.datetime(2025, 5, 2, 0, 1)
+
+    watermark.observe(t0)
+    assert watermark.watermark == t0
+
+
+def test_watermark_follows_ingest_worker_group(monkeypatch):
+    monkeypatch.setattr(watermark_module, "INGESTION", "worker")
+    groups = watermark_module.KafkaOffsets().groups
+    assert set(groups) == set(watermark_module.KAFKA_ENGINE_GROUPS)
+    assert set(groups.values()) == {watermark_module.INGEST_GROUP}
+
+    monkeypatch.setattr(watermark_module, "INGESTION", "engine")
+    assert watermark_module.KafkaOffsets().groups["post_views_v2"] == "clickhouse-group-views-v2"
+
+
+def test_merge_caches_closed_days_only():
+    cache = DailyHistoryCache(size=10)
+    closed_before = datetime.date(2025, 1, 4)
+    columns = day_columns(("2025-01-01", 2), ("2025-01-03", 1), ("2025-01-04", 7))
+
+    series = merge(cache, "p1", "views", None, columns, closed_before)
+    assert (series.start, series.counts.tolist()) == (datetime.date(2025, 1, 1), [2, 0, 1, 7])
+
+    cached = cache.get("p1", "views")
+    assert since(cached) == closed_before
+    assert cached[0].counts.tolist() == [2, 0, 1]
+
+    # следующий запрос читает только открытые дни
+    series = merge(cache, "p1", "views", cached, day_columns(("2025-01-04", 9)), closed_before)
+    assert series.counts.tolist() == [2, 0, 1, 9]
+
+
+def test_merge_without_watermark_does_not_cache():
+    cache = DailyHistoryCache(size=10)
+    series = merge(cache, "p1", "views", None, day_columns(("2025-01-02", 3)), None)
+    assert (series.start, series.counts.tolist()) == (datetime.date(2025, 1, 2), [3])
+    assert cache.get("p1", "views") is None
+
+
+def test_cache_is_bounded_and_persists_to_directory(tmp_path):
+    cache = DailyHistoryCache(size=1, directory=str(tmp_path))
+    cache.put("p1", "views", DaySeries(datetime.date(2025, 1, 1), np.array([1, 2])), datetime.date(2025, 1, 3))
+    cache.put("p2", "views", DaySeries(), datetime.date(2025, 1, 3))
+    assert cache.stats()["entries"] == 1
+
+    series, until = DailyHistoryCache(size=1, directory=str(tmp_path)).get("p1", "views")
+    assert (series.start, series.counts.tolist(), until) == (datetime.date(2025, 1, 1), [1, 2],
+                                                             datetime.date(2025, 1, 3))
+
+
+def test_window_pads_with_zeros():
+    series = DaySeries(datetime.date(2025, 1, 2), np.array([4, 5]))
+    assert series.window(datetime.date(2025, 1, 1), datetime.date(2025, 1, 5)).tolist() == [0, 4, 5, 0]
+
+
+def test_history_rpc_reads_only_open_days(monkeypatch):
+    queries = []
+
+    class Result:
+        def __init__(self, since):
+            days = [("2025-01-01", 2), ("2025-01-05", 1)]
+            self.np_result = day_columns(*[day for day in days if datetime.date.fromisoformat(day[0]) >= since])
+
+    class MockClient:
+        def query(self, query, parameters=None, settings=None, use_numpy=False):
+            queries.append(parameters["since"])
+            return Result(parameters["since"])
+
+    class Context:
+        def time_remaining(self):
+            return None
+
+    watermark = LagWatermark(lambda: ({}, {}), grace=datetime.timedelta(0))
+    watermark.watermark = datetime.datetime(2025, 1, 5, 12)
+    monkeypatch.setattr(handlers, "client", MockClient())
+    monkeypatch.setattr(handlers, "watermark", watermark)
+    monkeypatch.setattr(handlers, "history_cache", DailyHistoryCache(size=10))
+    service = handlers.StatsService()
+    request = stats_pb2.PostStatsRequest(post_id="p1")
+
+    first = service.GetPostViewsHistory(request, Context())
+    second = service.GetPostViewsHistory(request, Context())
+
+    assert queries == [EPOCH, datetime.date(2025, 1, 5)]
+    assert [(d.date, d.stat) for d in first.history] == [(d.date, d.stat) for d in second.history] == [
+        ("2025-01-01", 2), ("2025-01-05", 1)]
@@ -0,0 +1,133 @@
+import base64
+import collections
+import json
+import uuid
+
+import events_pb2
+from clickhouse_connect.driver.exceptions import OperationalError
+
+from app import ingest
+from app.ingest import Batch, IngestWorker, epoch_millis
+
+Record = collections.namedtuple("Record", "topic partition offset value")
+
+
+def view(offset, post_id="p1", viewed_at="2025-01-01 00:00:10.250"):
+    return Record("post_views", 0, offset, json.dumps(
+        {"user_id": "u1", "post_id": post_id, "event_id": f"e{offset}", "viewed_at": viewed_at}).encode())
+
+
+class FakeConsumer:
+    def __init__(self, *polls):
+        self.polls = list(polls)
+        self.commits = 0
+
+    def poll(self, timeout_ms=0, max_records=None):
+        records = self.polls.pop(0) if self.polls else []
+        return {("topic", 0): records} if records else {}
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakeClient:
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.inserts = []
+        self.tokens = []
+
+    def insert(self, table, data, column_names=None, column_type_names=None, column_oriented=False, settings=None):
+        self.tokens.append(settings["insert_deduplication_token"])
+        if self.failures.get(table):
+            self.failures[table] -= 1
+            raise OperationalError("connection refused")
+        self.inserts.append((table, column_names, data))
+
+
+def test_epoch_millis_marks_invalid_times():
+    millis, valid = epoch_millis(["2025-01-01 00:00:10.250", 1735689600000, "yesterday", None, "1960-01-01 00:00:00"])
+    assert millis[:2].tolist() == [1735689610250, 1735689600000]
+    assert valid.tolist() == [True, True, False, False, False]
+
+
+def test_batch_is_inserted_by_columns_and_committed_after_insert():
+    consumer = FakeConsumer([view(0), view(1, "p2")])
+    client = FakeClient()
+    worker = IngestWorker(consumer, client, batch_size=2, linger=60)
+
+    worker.poll()
+
+    assert client.inserts == [("views_stream", ("user_id", "post_id", "event_id", "viewed_at"),
+                               [["u1", "u1"], ["p1", "p2"], ["e0", "e1"], [1735689610250, 1735689610250]])]
+    assert client.tokens == ["views_stream:post_views/0/0-1"]
+    assert consumer.commits == 1
+    assert worker.metrics.snapshot()["rows"] == 2
+
+
+def test_batch_waits_for_linger():
+    consumer = FakeConsumer([view(0)], [])
+    client = FakeClient()
+    worker = IngestWorker(consumer, client, batch_size=100, linger=60)
+
+    worker.poll()
+    assert client.inserts == [] and consumer.commits == 0
+
+    worker.linger = 0
+    worker.poll()
+    assert [table for table, _, _ in client.inserts] == ["views_stream"]
+    assert consumer.commits == 1
+
+
+def test_malformed_messages_go_to_dead_letters():
+    batch = Batch()
+    batch.add(view(0))
+    batch.add(Record("post_views", 1, 7, b"{not json"))
+    batch.add(Record("post_likes", 0, 3, json.dumps({"user_id": 5, "post_id": "p1", "liked_at": "x"}).encode()))
+    batch.add(view(1, viewed_at="soon"))
+
+    inserts = batch.inserts()
+
+    assert [(table, data[1]) for table, _, _, data in inserts] == [("views_stream", ["p1"]),
+                                                                   ("kafka_dead_letters", (1, 0, 0))]
+    topics, partitions, offsets, raw, errors, _ = inserts[-1][3]
+    assert offsets == (7, 3, 1)
+    assert raw[0] == "{not json"
+    assert errors[2] == "Invalid viewed_at"
+
+
+def test_protobuf_and_json_topics_share_a_table():
+    post_id = uuid.UUID("6f1c6b2e-0000-4000-8000-000000000001")
+    event_id = uuid.UUID("6f1c6b2e-0000-4000-8000-0000000000e1")
+    batch = Batch()
+    batch.add(view(0, str(post_id)))
+    batch.add(Record("post_views_v2", 0, 0, events_pb2.PostView(
+        user_id="u2", post_id=post_id.bytes, event_id=event_id.bytes, viewed_at=1735689600,
+        viewed_at_ms=1735689600123).SerializeToString()))
+    # Записано до появления event_id и viewed_at_ms
+    batch.add(Record("post_views_v2", 0, 1, events_pb2.PostView(
+        user_id="u3", post_id=post_id.bytes, viewed_at=1735689601).SerializeToString()))
+    batch.add(Record("post_views_v2", 0, 2, b"\x12\x03abc"))
+
+    inserts = batch.inserts()
+
+    assert inserts[0][3] == [["u1", "u2", "u3"], [str(post_id)] * 3, ["e0", str(event_id), ""],
+                             [1735689610250, 1735689600123, 1735689601000]]
+    topics, _, offsets, raw, errors, _ = inserts[-1][3]
+    assert (topics, offsets, raw) == (("post_views_v2",), (2,), (base64.b64encode(b"\x12\x03abc").decode(),))
+
+
+def test_failed_insert_is_retried_before_commit(monkeypatch):
+    monkeypatch.setattr(ingest.time, "sleep", lambda seconds: None)
+    consumer = FakeConsumer([view(0), Record("post_likes", 0, 0, json.dumps(
+        {"user_id": "u2", "post_id": "p1", "liked_at": "2025-01-01 00:00:00"}).encode())])
+    client = FakeClient(failures={"likes_stream": 2})
+    worker = IngestWorker(consumer, client, batch_size=2, linger=60)
+
+    worker.poll()
+
+    # views_stream не вставляется повторно, коммит — после обеих вставок
+    assert [table for table, _, _ in client.inserts] == ["views_stream", "likes_stream"]
+    # повторы вставки — с тем же токеном: если вставка на самом деле прошла, ClickHouse её отбросит
+    assert client.tokens[1:] == ["likes_stream:post_likes/0/0-0,post_views/0/0-0"] * 3
+    assert consumer.commits == 1
+    assert worker.metrics.snapshot()["insert_errors"] == 2
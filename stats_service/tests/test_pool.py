@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from clickhouse_connect.driver.exceptions import OperationalError
+
+from app.pool import ClientPool, PoolTimeout
+
+
+class FakeClient:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = False
+
+    def ping(self):
+        return self.healthy
+
+    def query(self, query, **kwargs):
+        if query == "network error":
+            raise OperationalError("connection reset")
+        return query
+
+    def close(self):
+        self.closed = True
+
+
+class Factory:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.created = []
+
+    def __call__(self):
+        self.created.append(FakeClient(self.healthy))
+        return self.created[-1]
+
+
+def test_clients_are_created_lazily_and_reused():
+    factory = Factory()
+    pool = ClientPool(factory, size=2)
+    assert factory.created == []
+    assert pool.query("SELECT 1") == "SELECT 1"
+    assert pool.query("SELECT 1") == "SELECT 1"
+    assert len(factory.created) == 1
+
+
+def test_pool_size_limits_concurrent_clients():
+    pool = ClientPool(FakeClient, size=1, acquire_timeout=0.05)
+    first = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_waiting_thread_gets_released_client():
+    pool = ClientPool(FakeClient, size=1, acquire_timeout=5)
+    first = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    pool.release(first)
+    waiter.join(timeout=5)
+    assert acquired == [first]
+    assert pool.stats()["wait_seconds_max"] > 0
+
+
+def test_broken_client_is_replaced():
+    factory = Factory()
+    pool = ClientPool(factory, size=1)
+    with pytest.raises(OperationalError):
+        pool.query("network error")
+    assert factory.created[0].closed
+    assert pool.query("SELECT 1") == "SELECT 1"
+    assert len(factory.created) == 2
+
+
+def test_idle_client_is_health_checked():
+    factory = Factory(healthy=False)
+    pool = ClientPool(factory, size=1, health_check_interval=0)
+    pool.query("SELECT 1")
+    pool.query("SELECT 1")
+    assert factory.created[0].closed
+    assert pool.stats()["discarded"] == 1
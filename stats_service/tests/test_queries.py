@@ -0,0 +1,74 @@
+import re
+
+import pytest
+
+from app import queries
+
+
+class Result:
+    result_rows = [(1,)]
+    summary = {"read_rows": "42"}
+
+
+class RecordingClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def query(self, query, parameters=None, settings=None):
+        self.calls.append((query, parameters, settings))
+        if self.error:
+            raise self.error
+        return Result()
+
+
+@pytest.fixture(autouse=True)
+def reset_stats(monkeypatch):
+    monkeypatch.setattr(queries, "_stats", {})
+
+
+def test_execute_binds_parameters_and_settings():
+    client = RecordingClient()
+    queries.execute(client, "post_stats", post_id="x' OR 1=1 --")
+
+    query, parameters, settings = client.calls[0]
+    assert "x' OR 1=1" not in query
+    assert parameters == {"post_id": "x' OR 1=1 --"}
+    assert settings["max_execution_time"] == queries.MAX_EXECUTION_TIME
+    assert settings["max_rows_to_read"] == queries.TEMPLATES["post_stats"].settings["max_rows_to_read"]
+
+
+def test_execute_records_stats():
+    client = RecordingClient()
+    queries.execute(client, "top_posts", metric="views", limit=10)
+    queries.execute(client, "top_posts", metric="likes", limit=20)
+    with pytest.raises(RuntimeError):
+        queries.execute(RecordingClient(RuntimeError("timeout")), "top_posts", metric="views", limit=10)
+
+    stats = queries.query_stats()["top_posts"]
+    assert stats["calls"] == 3
+    assert stats["errors"] == 1
+    assert stats["rows_read"] == 84
+    # текст запроса одинаков для всех аргументов
+    assert client.calls[0][0] == client.calls[1][0]
+
+
+def test_execute_limits_execution_time_by_deadline(monkeypatch):
+    monkeypatch.setattr(queries, "MAX_EXECUTION_TIME", 5)
+    client = RecordingClient()
+    queries.execute(client, "post_stats", timeout=2.3, post_id="p1")
+    queries.execute(client, "post_stats", timeout=0.2, post_id="p1")
+    queries.execute(client, "post_stats", timeout=60, post_id="p1")
+
+    limits = [settings["max_execution_time"] for _, _, settings in client.calls]
+    assert limits == [3, 1, queries.TEMPLATES["post_stats"].settings["max_execution_time"]]
+
+
+def test_raw_event_queries_convert_post_id_to_uuid():
+    raw = [template for template in queries.TEMPLATES.values()
+           if re.search(r"FROM (views|likes|comments|\{table:Identifier\})\s", template.sql)]
+    assert raw
+    for template in raw:
+        # post_id в сырых таблицах — UUID: прямое сравнение со строкой падает на id, которые не UUID
+        assert "toUUIDOrNull(" in template.sql
+        assert not re.search(r"post_id (=|IN) \{post_ids?:", template.sql)
@@ -0,0 +1,153 @@
+import collections
+import json
+
+from kafka import TopicPartition
+
+from app.recent import RecentActivity, RecentConsumer
+from app.stream import PostStatsStreams
+
+Record = collections.namedtuple("Record", "topic partition offset value")
+OffsetAndTimestamp = collections.namedtuple("OffsetAndTimestamp", "offset timestamp")
+
+NOW = 1000 * 60 + 30  # 30-я секунда минуты 1000
+VIEWS, LIKES, COMMENTS = 0, 1, 2
+
+
+def warm(recent, minute=0):
+    recent.mark_complete(minute)
+    return recent
+
+
+def test_window_counts_events_per_minute():
+    recent = warm(RecentActivity(minutes=3, capacity=10))
+    recent.add(VIEWS, ["p1", "p1", "p2", "p1"], [998, 1000, 1000, 1000])
+    recent.add(COMMENTS, ["p1"], [999])
+
+    start, counts = recent.window("p1", NOW)
+
+    assert start == 997
+    assert counts.tolist() == [[0, 1, 0, 2], [0, 0, 0, 0], [0, 0, 1, 0]]
+    assert recent.window("p2", NOW)[1][VIEWS].tolist() == [0, 0, 0, 1]
+    assert recent.window("p3", NOW)[1].sum() == 0
+
+
+def test_ring_drops_minutes_that_left_the_window():
+    recent = warm(RecentActivity(minutes=3, capacity=10))
+    recent.add(VIEWS, ["p1"] * 3, [996, 997, 998])
+    recent.add(VIEWS, ["p1"], [1001])
+    # старше окна поста
+    recent.add(VIEWS, ["p1"], [997])
+
+    assert recent.window("p1", NOW + 60)[1][VIEWS].tolist() == [1, 0, 0, 1]
+    # последнее событие поста было давно: всё окно — нули
+    assert recent.window("p1", NOW + 60 * 10)[1].sum() == 0
+
+
+def test_window_is_unavailable_until_complete():
+    recent = RecentActivity(minutes=3, capacity=10)
+    recent.add(VIEWS, ["p1"], [1000])
+    assert recent.window("p1", NOW) is None
+
+    recent.mark_complete(998)
+    assert recent.window("p1", NOW) is None
+    assert recent.window("p1", NOW + 60) is not None
+    assert recent.stats()["misses"] == 2
+
+
+def test_eviction_of_active_post_makes_window_incomplete():
+    recent = warm(RecentActivity(minutes=3, capacity=2))
+    recent.add(VIEWS, ["p1", "p2"], [990, 1000])
+    # p1 давно без событий, его вытеснение окно не портит
+    recent.add(VIEWS, ["p3"], [1000])
+    assert recent.window("p2", NOW) is not None
+
+    recent.add(VIEWS, ["p1"], [1000])
+    assert recent.stats()["evictions"] == 2
+    assert recent.window("p2", NOW) is None
+    assert recent.window("p1", NOW + 60 * 4)[1].sum() == 0
+
+
+class FakeConsumer:
+    def __init__(self, records, end=2):
+        self.records = records
+        self.end = end
+        self.positions = {}
+
+    def partitions_for_topic(self, topic):
+        return {0} if topic in ("post_views", "post_comments_v2") else None
+
+    def assign(self, partitions):
+        self.partitions = partitions
+
+    def offsets_for_times(self, timestamps):
+        self.since = set(timestamps.values())
+        return {tp: OffsetAndTimestamp(0, 0) if tp.topic == "post_views" else None for tp in timestamps}
+
+    def seek(self, tp, offset):
+        self.positions[tp] = offset
+
+    def seek_to_end(self, tp):
+        self.positions[tp] = 0
+
+    def end_offsets(self, partitions):
+        return {tp: self.end if tp.topic == "post_views" else 0 for tp in partitions}
+
+    def position(self, tp):
+        return self.positions[tp]
+
+    def poll(self, timeout_ms=0, max_records=None):
+        records, self.records = self.records, []
+        tp = TopicPartition("post_views", 0)
+        self.positions[tp] += len(records)
+        return {tp: records} if records else {}
+
+
+def view(offset, post_id, viewed_at, event_id=None):
+    event = {"user_id": "u1", "post_id": post_id, "viewed_at": viewed_at}
+    if event_id is not None:
+        event["event_id"] = event_id
+    return Record("post_views", 0, offset, json.dumps(event).encode())
+
+
+def test_consumer_reads_window_and_becomes_warm():
+    recent = RecentActivity(minutes=60, capacity=10)
+    streams = PostStatsStreams()
+    subscription = streams.subscribe("p1")
+    consumer = FakeConsumer([view(0, "p1", "1970-01-01 16:40:05"), view(1, "p1", "bad")])
+    reader = RecentConsumer(recent, consumer, streams)
+
+    reader.start(now=NOW)
+    assert consumer.since == {(NOW - 61 * 60) * 1000}
+    assert recent.window("p1", NOW) is None
+
+    reader.poll()
+    start, counts = recent.window("p1", NOW)
+    assert start == 940
+    assert counts[VIEWS, -1] == 1 and counts.sum() == 1
+    # перечитанные при старте события подписчикам не отправляются
+    assert subscription.take() == [0, 0, 0]
+
+    consumer.records = [view(2, "p1", "1970-01-01 16:40:20")]
+    reader.poll()
+    assert subscription.take() == [1, 0, 0]
+
+
+def test_consumer_drops_redelivered_events():
+    recent = RecentActivity(minutes=60, capacity=10)
+    streams = PostStatsStreams()
+    subscription = streams.subscribe("p1")
+    consumer = FakeConsumer([], end=0)
+    reader = RecentConsumer(recent, consumer, streams)
+    reader.start(now=NOW)
+
+    consumer.records = [view(0, "p1", "1970-01-01 16:40:05", "e1"), view(1, "p1", "1970-01-01 16:40:05", "e1"),
+                        view(2, "p1", "1970-01-01 16:40:06", "e2")]
+    reader.poll()
+    consumer.records = [view(3, "p1", "1970-01-01 16:40:05", "e1"),
+                        # события без event_id (записанные раньше) не сравниваются
+                        view(4, "p1", "1970-01-01 16:40:07"), view(5, "p1", "1970-01-01 16:40:07")]
+    reader.poll()
+
+    assert recent.window("p1", NOW)[1][VIEWS, -1] == 4
+    assert subscription.take() == [4, 0, 0]
+    assert reader.seen.duplicates == 2
@@ -1,8 +1,13 @@
 import pytest
 import stats_pb2
 from app.handlers import StatsService
+from app.recent import RecentActivity
+from app.stream import PostStatsStreams
 import grpc
 import datetime
+import time
+
+import numpy as np
 
 
 class DummyContext:
@@ -16,6 +21,9 @@ class DummyContext:
     def set_details(self, details):
         self.details = details
 
+    def time_remaining(self):
+        return None
+
 
 @pytest.fixture
 def context():
@@ -26,10 +34,21 @@ def context():
 def service(monkeypatch):
     mock_client = type("MockClient", (), {})()
 
-    def mock_query(query):
+    def mock_query(query, parameters=None, settings=None, use_numpy=False):
         class Result:
+            @property
+            def np_result(self):
+                if "FROM post_daily_counters" in query:
+                    return np.array([(np.datetime64("2025-01-01"), 1), (np.datetime64("2025-01-02"), 2)],
+                                    dtype=[("date", "datetime64[D]"), ("stat", "uint64")])
+                return np.array([])
+
             @property
             def result_rows(self):
+                if "FROM post_counters WHERE" in query:
+                    return [(7, 8, 9)]
+                if "uniq" in query:
+                    return [("post1", 3, 2, 1)]
                 if "GROUP BY" in query:
                     if "post_id" in query and "GROUP BY date" in query:
                         return [
@@ -52,9 +71,10 @@ def service(monkeypatch):
 def test_get_post_stats(service, context):
     request = stats_pb2.PostStatsRequest(post_id="post1")
     response = service.GetPostStats(request, context)
-    assert response.likes == 7
     assert response.views == 7
-    assert response.comments == 7
+    assert response.likes == 8
+    assert response.comments == 9
+    assert (response.unique_viewers, response.unique_likers, response.unique_commenters) == (3, 2, 1)
     assert context.code is None
 
 
@@ -86,7 +106,220 @@ def test_get_top_ten_posts(service, context):
     assert response.post_ids == ["post1", "post2"]
 
 
+def test_get_top_posts_limit_and_window(monkeypatch, context):
+    queries = []
+
+    class Result:
+        result_rows = [("post1", 5)]
+
+    class MockClient:
+        def query(self, query, parameters=None, settings=None):
+            queries.append((query, parameters))
+            return Result()
+
+    monkeypatch.setattr("app.handlers.client", MockClient())
+    service = StatsService()
+
+    request = stats_pb2.TopTenPostsRequest(param=stats_pb2.LIKES, limit=50, window=stats_pb2.LAST_DAY)
+    assert service.GetTopTenPosts(request, context).post_ids == ["post1"]
+    query, parameters = queries[-1]
+    assert "FROM post_hourly_counters" in query
+    assert parameters == {"metric": "likes", "limit": 50, "hours": 24}
+
+    service.GetTopTenUsers(stats_pb2.TopTenUsersRequest(param=stats_pb2.VIEWS, limit=10 ** 6), context)
+    query, parameters = queries[-1]
+    assert "FROM user_counters" in query
+    assert parameters == {"metric": "views", "limit": 1000}
+
+
 def test_get_top_ten_users(service, context):
     request = stats_pb2.TopTenUsersRequest(param=stats_pb2.VIEWS)
     response = service.GetTopTenUsers(request, context)
     assert response.user_ids == ["user1", "user2"]
+
+
+def test_get_posts_stats(monkeypatch, context):
+    queries = []
+
+    class Result:
+        result_rows = [("post2", 4, 2, 1), ("post1", 7, 8, 9)]
+
+    class MockClient:
+        def query(self, query, parameters=None, settings=None):
+            queries.append(parameters)
+            return Result()
+
+    monkeypatch.setattr("app.handlers.client", MockClient())
+    request = stats_pb2.PostsStatsRequest(post_ids=["post1", "post2", "post3", "post1"])
+    response = StatsService().GetPostsStats(request, context)
+
+    # счётчики и уникальные пользователи
+    assert queries == [{"post_ids": ["post1", "post2", "post3"]}] * 2
+    assert [(s.post_id, s.views, s.likes, s.comments) for s in response.stats] == [
+        ("post1", 7, 8, 9), ("post2", 4, 2, 1), ("post3", 0, 0, 0)]
+    assert [s.unique_viewers for s in response.stats] == [7, 4, 0]
+
+
+def test_approximate_mode_reads_sketches(monkeypatch, context):
+    queries = []
+
+    class Result:
+        result_rows = [("post1", 5, 4, 3)]
+
+    class MockClient:
+        def query(self, query, parameters=None, settings=None):
+            queries.append(query)
+            return Result()
+
+    monkeypatch.setattr("app.handlers.client", MockClient())
+    service = StatsService()
+
+    service.GetPostsStats(stats_pb2.PostsStatsRequest(post_ids=["post1"], approximate=True), context)
+    assert "uniqCombinedMerge(viewers)" in queries[-1] and "uniqExact" not in queries[-1]
+    service.GetPostsStats(stats_pb2.PostsStatsRequest(post_ids=["post1"]), context)
+    assert "uniqExactIf(user_id, metric = 'views')" in queries[-1]
+
+    request = stats_pb2.TopTenPostsRequest(param=stats_pb2.LIKES, window=stats_pb2.LAST_DAY, approximate=True)
+    assert service.GetTopTenPosts(request, context).post_ids == ["post1"]
+    assert "topKWeighted" in queries[-1] and "FROM post_hourly_counters" in queries[-1]
+
+
+def test_get_posts_stats_too_many_ids(service, context):
+    request = stats_pb2.PostsStatsRequest(post_ids=[f"post{i}" for i in range(1000)])
+    service.GetPostsStats(request, context)
+    assert context.code == grpc.StatusCode.INVALID_ARGUMENT
+
+
+def test_get_post_packed_history(monkeypatch, context):
+    calls = []
+
+    class Result:
+        np_result = np.array([(np.datetime64("2025-01-01"), 2), (np.datetime64("2025-01-03"), 5)],
+                             dtype=[("date", "datetime64[D]"), ("stat", "uint64")])
+        summary = {"read_rows": "2"}
+
+    class MockClient:
+        def query(self, query, parameters=None, settings=None, use_numpy=False):
+            calls.append((query, parameters, use_numpy))
+            return Result()
+
+    monkeypatch.setattr("app.handlers.client", MockClient())
+    request = stats_pb2.PackedHistoryRequest(post_id="post1", metric=stats_pb2.LIKES)
+    response = StatsService().GetPostPackedHistory(request, context)
+
+    query, parameters, use_numpy = calls[0]
+    assert "FROM post_daily_counters" in query and use_numpy
+    assert parameters == {"metric": "likes", "post_id": "post1", "since": datetime.date(1970, 1, 1)}
+    # пропущенный день дополняется нулём
+    assert response.start == "2025-01-01"
+    assert response.bucket_seconds == 24 * 60 * 60
+    assert list(response.counts) == [2, 0, 5]
+
+
+def test_get_post_packed_history_empty(monkeypatch, context):
+    class Result:
+        np_result = np.array([])
+
+    monkeypatch.setattr("app.handlers.client", type("MockClient", (), {
+        "query": lambda self, query, parameters=None, settings=None, use_numpy=False: Result()})())
+    response = StatsService().GetPostRecentCommentsPacked(stats_pb2.PostStatsRequest(post_id="post1"), context)
+
+    assert context.code is None
+    assert response.start == ""
+    assert response.bucket_seconds == 60
+    assert list(response.counts) == []
+
+
+def test_get_post_metrics_history(monkeypatch, context):
+    calls = []
+
+    class Result:
+        np_result = np.array([(np.datetime64("2025-01-01"), 5, 1, 0), (np.datetime64("2025-01-02"), 0, 0, 0)],
+                             dtype=[("bucket", "datetime64[D]"), ("views", "uint64"),
+                                    ("likes", "uint64"), ("comments", "uint64")])
+
+    class MockClient:
+        def query(self, query, parameters=None, settings=None, use_numpy=False):
+            calls.append(query)
+            return Result()
+
+    monkeypatch.setattr("app.handlers.client", MockClient())
+    request = stats_pb2.PostHistoryRequest(post_id="post1", granularity=stats_pb2.DAY)
+    response = StatsService().GetPostMetricsHistory(request, context)
+
+    assert len(calls) == 1
+    assert response.start == "2025-01-01"
+    assert (list(response.views), list(response.likes), list(response.comments)) == ([5, 0], [1, 0], [0, 0])
+
+
+def test_get_post_recent_activity_from_memory(monkeypatch, context):
+    recent = RecentActivity(minutes=60, capacity=10)
+    recent.mark_complete(0)
+    now = time.time()
+    recent.add(0, ["post1", "post1"], [int(now // 60)] * 2)
+    recent.add(2, ["post1"], [int(now // 60) - 1])
+    monkeypatch.setattr("app.handlers.recent", recent)
+    # ClickHouse не запрашивается
+    monkeypatch.setattr("app.handlers.client", None)
+
+    response = StatsService().GetPostRecentActivity(stats_pb2.PostStatsRequest(post_id="post1"), context)
+    packed = StatsService().GetPostRecentCommentsPacked(stats_pb2.PostStatsRequest(post_id="post1"), context)
+
+    assert context.code is None
+    assert response.bucket_seconds == 60 and len(response.views) == 61
+    assert (response.views[-1], sum(response.likes), response.comments[-2]) == (2, 0, 1)
+    assert list(packed.counts) == list(response.comments)
+
+
+def test_get_post_recent_activity_falls_back_to_clickhouse(monkeypatch, context):
+    calls = []
+
+    class Result:
+        np_result = np.array([(np.datetime64("2025-01-01T10:00"), 5, 1, 0)],
+                             dtype=[("bucket", "datetime64[m]"), ("views", "uint64"),
+                                    ("likes", "uint64"), ("comments", "uint64")])
+
+    class MockClient:
+        def query(self, query, parameters=None, settings=None, use_numpy=False):
+            calls.append((query, parameters))
+            return Result()
+
+    monkeypatch.setattr("app.handlers.client", MockClient())
+    monkeypatch.setattr("app.handlers.recent", RecentActivity(minutes=60, capacity=10))
+    response = StatsService().GetPostRecentActivity(stats_pb2.PostStatsRequest(post_id="post1"), context)
+
+    query, parameters = calls[0]
+    assert "FROM views" in query and "toStartOfMinute" in query
+    assert parameters["end"] - parameters["start"] == datetime.timedelta(minutes=61)
+    assert (response.start, list(response.views)) == ("2025-01-01 10:00", [5])
+
+
+class StreamContext(DummyContext):
+    def __init__(self):
+        super().__init__()
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def is_active(self):
+        return True
+
+
+def test_stream_post_stats_sends_snapshot_then_deltas(service, monkeypatch):
+    streams = PostStatsStreams()
+    monkeypatch.setattr("app.handlers.streams", streams)
+    monkeypatch.setattr("app.handlers.STREAM_INTERVAL", 0)
+    context = StreamContext()
+
+    updates = service.StreamPostStats(stats_pb2.PostStatsRequest(post_id="post1"), context)
+    snapshot = next(updates)
+    streams.publish(0, ["post1", "post1"])
+    streams.publish(2, ["post1", "post2"])
+    delta = next(updates)
+    updates.close()
+
+    assert (snapshot.snapshot, snapshot.views, snapshot.likes, snapshot.comments) == (True, 7, 8, 9)
+    assert (delta.snapshot, delta.views, delta.likes, delta.comments) == (False, 2, 0, 1)
+    assert len(context.callbacks) == 1
+    assert streams.stats()["streams"] == 0
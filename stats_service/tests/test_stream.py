@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.stream import PostStatsStreams, TooManyStreams
+
+VIEWS, LIKES, COMMENTS = 0, 1, 2
+
+
+def test_deltas_are_summed_until_taken():
+    streams = PostStatsStreams()
+    first = streams.subscribe("p1")
+    second = streams.subscribe("p1")
+    streams.publish(VIEWS, ["p1", "p2", "p1"])
+    streams.publish(LIKES, ["p1"])
+
+    assert first.take() == [2, 1, 0]
+    assert first.take() == [0, 0, 0]
+    assert second.wait(timeout=0) == [2, 1, 0]
+
+
+def test_unsubscribe_and_limit():
+    streams = PostStatsStreams(max_streams=1)
+    subscription = streams.subscribe("p1")
+    with pytest.raises(TooManyStreams):
+        streams.subscribe("p2")
+
+    streams.unsubscribe(subscription)
+    streams.unsubscribe(subscription)
+    assert streams.stats() == {"posts": 0, "streams": 0}
+    streams.subscribe("p2")
+
+
+def test_close_wakes_waiting_stream():
+    subscription = PostStatsStreams().subscribe("p1")
+    threading.Timer(0.05, subscription.close).start()
+    assert subscription.wait(timeout=10) == [0, 0, 0]
+
+
+def test_async_subscription_is_woken_from_consumer_thread():
+    async def main():
+        streams = PostStatsStreams()
+        subscription = streams.subscribe("p1", asyncio.get_running_loop())
+        threading.Timer(0.05, streams.publish, args=(COMMENTS, ["p1"])).start()
+        return await subscription.wait_async(timeout=10)
+
+    assert asyncio.run(main()) == [0, 0, 1]
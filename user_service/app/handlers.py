@@ -4,12 +4,20 @@ from datetime import datetime
 from .models import User
 from .schemas import RegisterRequest, LoginRequest, ProfileUpdateRequest
 from passlib.context import CryptContext
-from .models import get_db
+from .models import get_db, get_read_db, replica_set
 
 router = APIRouter()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+def find_user(username, db, primary_db):
+    user = db.query(User).filter(User.username == username).first()
+    if user is None and db is not primary_db:
+        # реплика могла ещё не получить только что созданного пользователя
+        user = primary_db.query(User).filter(User.username == username).first()
+    return user
+
+
 @router.post("/register", status_code=201)
 def register_user(request: RegisterRequest, db: Session = Depends(get_db)):
     existing_username = db.query(User).filter(User.username == request.username).first()
@@ -28,11 +36,12 @@ def register_user(request: RegisterRequest, db: Session = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    replica_set.mark_written(new_user.username)
     return {"message": "User created", "user_id": new_user.id}
 
 @router.post("/login")
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == request.username).first()
+def login(request: LoginRequest, db: Session = Depends(get_read_db), primary_db: Session = Depends(get_db)):
+    user = find_user(request.username, db, primary_db)
     if not user or not pwd_context.verify(request.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     return {
@@ -42,8 +51,8 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
     }
 
 @router.get("/profile")
-def get_profile(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+def get_profile(username: str, db: Session = Depends(get_read_db), primary_db: Session = Depends(get_db)):
+    user = find_user(username, db, primary_db)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {
@@ -78,4 +87,5 @@ def update_profile(username: str, req: ProfileUpdateRequest, db: Session = Depen
     user.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(user)
+    replica_set.mark_written(username)
     return {"message": "Profile updated"}
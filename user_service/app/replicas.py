@@ -0,0 +1,83 @@
+# Копия posts_comments_service/app/replicas.py: каждый сервис собирается из своего каталога (build context),
+# общего пакета у них нет. Изменения вносить в обе копии.
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+# На простаивающем primary pg_last_xact_replay_timestamp() не обновляется,
+# поэтому при полностью применённом WAL отставание считаем нулевым
+LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def postgres_replication_lag(session_factory):
+    session = session_factory()
+    try:
+        return float(session.execute(LAG_QUERY).scalar())
+    finally:
+        session.close()
+
+
+class ReplicaSet:
+    """
+    Primary и его реплики. Запись всегда идёт в primary, чтение — round-robin
+    по репликам, отстающим не больше чем на max_lag секунд. Ключи, записанные
+    этим процессом за последние read_your_writes_window секунд, читаются из primary.
+    """
+
+    def __init__(self, primary, replicas=(), max_lag=5.0, lag_check_interval=1.0,
+                 read_your_writes_window=5.0, lag_probe=postgres_replication_lag):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.read_your_writes_window = read_your_writes_window
+        self.lag_probe = lag_probe
+        self._next_replica = itertools.count()
+        self._lag_cache = {}
+        self._recent_writes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark_written(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._recent_writes[key] = now
+                self._recent_writes.move_to_end(key)
+            while self._recent_writes:
+                oldest = next(iter(self._recent_writes.values()))
+                if now - oldest < self.read_your_writes_window:
+                    break
+                self._recent_writes.popitem(last=False)
+
+    def recently_written(self, key):
+        with self._lock:
+            written_at = self._recent_writes.get(key)
+        return written_at is not None and time.monotonic() - written_at < self.read_your_writes_window
+
+    def replica_lag(self, index):
+        now = time.monotonic()
+        cached = self._lag_cache.get(index)
+        if cached is not None and now - cached[0] < self.lag_check_interval:
+            return cached[1]
+        try:
+            lag = self.lag_probe(self.replicas[index])
+        except SQLAlchemyError:
+            lag = float("inf")
+        self._lag_cache[index] = (now, lag)
+        return lag
+
+    def read_session(self, key=None, use_primary=False):
+        if use_primary or not self.replicas or (key is not None and self.recently_written(key)):
+            return self.primary()
+        for _ in range(len(self.replicas)):
+            index = next(self._next_replica) % len(self.replicas)
+            if self.replica_lag(index) <= self.max_lag:
+                return self.replicas[index]()
+        return self.primary()
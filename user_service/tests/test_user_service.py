@@ -2,7 +2,9 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from app.models import  Base, get_db
+from sqlalchemy.pool import StaticPool
+from fastapi import Depends
+from app.models import  Base, get_db, get_read_db, read_key
 from app.main import app
 
 # Создадим in-memory SQLite базу для тестирования
@@ -20,6 +22,7 @@ def override_get_db():
         db.close()
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 Base.metadata.drop_all(bind=engine)
 Base.metadata.create_all(bind=engine)
@@ -299,4 +302,52 @@ def test_update_profile_nonexistent_user():
     assert response.status_code == 404
     data = response.json()
     assert data["detail"] == "User not found"
-    
\ No newline at end of file
+    
+
+
+def test_read_falls_back_to_primary_when_replica_is_behind():
+    # Реплика ещё пустая: пользователь, только что созданный в primary, должен находиться
+    replica_engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=replica_engine)
+    ReplicaSession = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+
+    def override_get_read_db():
+        db = ReplicaSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    response = client.post("/register", json={
+        "username": "laggy",
+        "password": "password",
+        "email": "laggy@example.com"
+    })
+    assert response.status_code == 201
+
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    try:
+        response = client.post("/login", json={"username": "laggy", "password": "password"})
+        assert response.status_code == 200
+        response = client.get("/profile", params={"username": "laggy"})
+        assert response.status_code == 200
+        assert response.json()["email"] == "laggy@example.com"
+    finally:
+        app.dependency_overrides[get_read_db] = override_get_db
+
+
+def test_read_key_from_query_and_login_body():
+    keys = []
+
+    def capture_read_db(key=Depends(read_key)):
+        keys.append(key)
+        yield from override_get_db()
+
+    client.post("/register", json={"username": "keyed", "password": "password", "email": "keyed@example.com"})
+    app.dependency_overrides[get_read_db] = capture_read_db
+    try:
+        assert client.post("/login", json={"username": "keyed", "password": "password"}).status_code == 200
+        assert client.get("/profile", params={"username": "keyed"}).status_code == 200
+    finally:
+        app.dependency_overrides[get_read_db] = override_get_db
+    assert keys == ["keyed", "keyed"]